@@ -6,6 +6,7 @@ pyasassnを使用してASASSNデータの取得時間を計測するAPIサーバ
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import List, Optional
 import time
@@ -15,6 +16,9 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# メトリクス（/metrics）。実装は同じディレクトリの metrics_exporter.py（外部に依存しない）
+from metrics_exporter import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, ROW_BUCKETS, MetricsMiddleware
+
 app = FastAPI(
     title="ASASSN Performance Test API",
     description="ASASSNデータ取得のパフォーマンステストAPI",
@@ -30,6 +34,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware, registry=REGISTRY)
+# ASAS-SN Sky Patrolへの問い合わせ（方式ごと）の所要時間・データ点数
+UPSTREAM_QUERY_SECONDS = REGISTRY.histogram(
+    "upstream_query_duration_seconds", "Duration of ASAS-SN queries by method and outcome", ("method", "outcome")
+)
+UPSTREAM_QUERY_ROWS = REGISTRY.histogram(
+    "upstream_query_rows", "Datapoints returned by ASAS-SN queries by method", ("method",), buckets=ROW_BUCKETS
+)
+
+
+def observe_query(method: str, query_time: float, num_rows: Optional[int] = None):
+    """ASAS-SNへの問い合わせ1回を記録（num_rowsがNoneなら失敗）"""
+    UPSTREAM_QUERY_SECONDS.observe(query_time, (method, "error" if num_rows is None else "ok"))
+    if num_rows is not None:
+        UPSTREAM_QUERY_ROWS.observe(num_rows, (method,))
+
 
 class CatalogEntry(BaseModel):
     """カタログエントリ"""
@@ -100,16 +120,19 @@ def query_asassn_by_gaia_id(gaia_id: str) -> tuple:
         query_time = time.time() - start_time
         
         if lcs is None or len(lcs) == 0:
+            observe_query("adql_query", query_time, 0)
             return 0, 0, query_time
         
         # ライトカーブ数とデータポイント数を計算
         num_lightcurves = len(lcs)
         total_datapoints = sum(len(lc) if hasattr(lc, '__len__') else 0 for lc in lcs)
         
+        observe_query("adql_query", query_time, total_datapoints)
         return num_lightcurves, total_datapoints, query_time
         
     except Exception as e:
         query_time = time.time() - start_time
+        observe_query("adql_query", query_time)
         error_msg = str(e)
         
         # エラーメッセージを解析
@@ -157,16 +180,19 @@ def query_asassn_by_coordinates(ra: float, dec: float, radius_arcsec: float = 3.
         query_time = time.time() - start_time
         
         if lcs is None or len(lcs) == 0:
+            observe_query("cone_search", query_time, 0)
             return 0, 0, query_time
         
         # ライトカーブ数とデータポイント数を計算
         num_lightcurves = len(lcs)
         total_datapoints = sum(len(lc) if hasattr(lc, '__len__') else 0 for lc in lcs)
         
+        observe_query("cone_search", query_time, total_datapoints)
         return num_lightcurves, total_datapoints, query_time
         
     except Exception as e:
         query_time = time.time() - start_time
+        observe_query("cone_search", query_time)
         error_msg = str(e)
         
         if 'No data found' in error_msg or 'empty' in error_msg.lower():
@@ -187,6 +213,7 @@ def root():
         "version": "1.0.0",
         "endpoints": {
             "test": "/test-performance",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
@@ -276,6 +303,12 @@ def test_performance(request: TestRequest):
     return result
 
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus形式のメトリクス（エンドポイントごとのレイテンシ、ASAS-SNへの問い合わせの所要時間・データ点数）"""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
     print("Starting ASASSN Performance Test API server...")
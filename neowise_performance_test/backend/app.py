@@ -1,12 +1,18 @@
 """
 NEOWISE Performance Testing Backend
 Tests query_region vs query_tap performance for NEOWISE data retrieval
+
+環境変数 IRSA_URL でIRSAの問い合わせ先を変更できる
+（ローカルのスタンドイン prototype/scripts/mock_irsa_server.py で計測する場合。astroquery 0.4.7以降）:
+    IRSA_URL=http://127.0.0.1:8765 python app.py
 """
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
 from typing import List, Optional
+import os
 import time
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
@@ -16,6 +22,15 @@ from astroquery.ipac.irsa import Irsa
 import astropy.coordinates as coord
 import astropy.units as u
 
+# メトリクス（/metrics）。実装は同じディレクトリの metrics_exporter.py（外部に依存しない）
+from metrics_exporter import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, ROW_BUCKETS, MetricsMiddleware
+
+# IRSAの問い合わせ先（query_region・query_tapともTAPで実行される）
+DEFAULT_IRSA_URL = "https://irsa.ipac.caltech.edu"
+IRSA_URL = os.environ.get("IRSA_URL", DEFAULT_IRSA_URL).rstrip("/")
+if IRSA_URL != DEFAULT_IRSA_URL:
+    Irsa.tap_url = IRSA_URL + "/TAP"
+
 app = FastAPI(
     title="NEOWISE Performance Testing API",
     description="Compare performance of different NEOWISE data retrieval methods",
@@ -31,6 +46,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware, registry=REGISTRY)
+# IRSAへの問い合わせ（方式ごと）の所要時間・行数
+UPSTREAM_QUERY_SECONDS = REGISTRY.histogram(
+    "upstream_query_duration_seconds", "Duration of IRSA queries by method and outcome", ("method", "outcome")
+)
+UPSTREAM_QUERY_ROWS = REGISTRY.histogram(
+    "upstream_query_rows", "Rows returned by IRSA queries by method", ("method",), buckets=ROW_BUCKETS
+)
+
+
+def observe_query(method: str, query_time: float, num_rows: Optional[int] = None):
+    """IRSAへの問い合わせ1回を記録（num_rowsがNoneなら失敗）"""
+    UPSTREAM_QUERY_SECONDS.observe(query_time, (method, "error" if num_rows is None else "ok"))
+    if num_rows is not None:
+        UPSTREAM_QUERY_ROWS.observe(num_rows, (method,))
+
+
 # スレッドプール（同期的なastroqueryをバックグラウンドで実行）
 executor = ThreadPoolExecutor(max_workers=4)
 
@@ -101,13 +133,13 @@ def query_neowise_by_region(ra: float, dec: float) -> tuple:
         )
         query_time = time.time() - start_time
         
-        if table is None or len(table) == 0:
-            return 0, query_time
-        
-        return len(table), query_time
+        num_rows = 0 if table is None else len(table)
+        observe_query("query_region", query_time, num_rows)
+        return num_rows, query_time
         
     except Exception as e:
         query_time = time.time() - start_time
+        observe_query("query_region", query_time)
         # より詳細なエラーメッセージ
         error_msg = str(e)
         if '502' in error_msg or 'Proxy Error' in error_msg:
@@ -147,13 +179,13 @@ def query_neowise_by_tap(ra: float, dec: float, allwise_id: Optional[str] = None
         table = Irsa.query_tap(query)
         query_time = time.time() - start_time
         
-        if table is None or len(table) == 0:
-            return 0, query_time
-        
-        return len(table), query_time
+        num_rows = 0 if table is None else len(table)
+        observe_query("query_tap", query_time, num_rows)
+        return num_rows, query_time
         
     except Exception as e:
         query_time = time.time() - start_time
+        observe_query("query_tap", query_time)
         error_msg = str(e)
         
         # エラーメッセージを解析
@@ -172,8 +204,10 @@ async def root():
     return {
         "message": "NEOWISE Performance Testing API",
         "version": "0.1.0",
+        "irsa_url": IRSA_URL,
         "endpoints": {
             "/test-performance": "POST - テストを実行",
+            "/metrics": "GET - Prometheus形式のメトリクス",
             "/docs": "API documentation"
         }
     }
@@ -266,6 +300,12 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus形式のメトリクス（エンドポイントごとのレイテンシ、IRSAへの問い合わせの所要時間・行数）"""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
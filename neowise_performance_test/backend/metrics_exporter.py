@@ -0,0 +1,288 @@
+"""
+Prometheus形式のメトリクス（/metrics）の最小限の実装
+
+prototype/backend/metrics.py のうち、このバックエンドで使う部分（カウンター・ゲージ・ヒストグラム、
+テキスト形式の出力、MetricsMiddleware）だけを持つ。外部のパッケージ・他のディレクトリに依存しないため、
+このディレクトリだけをコピー・デプロイしても /metrics が動く。
+値はプロセスごとに保持する（uvicornを複数ワーカーで起動した場合はワーカーごとの値になる）。
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ヒストグラムのバケット（上限値）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# ルートに一致しなかったリクエスト（404など）のラベル（パスをそのままラベルにしない）
+UNMATCHED_ROUTE = "<unmatched>"
+
+# (名前, 種類, 説明, [(ラベル, 値), ...]) の組
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    ラベルの値の組ごとに値を持つメトリクスの基底クラス
+
+    Parameters:
+    -----------
+    name : str
+        メトリクス名
+    documentation : str
+        # HELP に出す説明
+    labelnames : sequence of str
+        ラベル名（記録時はこの順の値のタプルを渡す）
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def _labels(self, values: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def collect(self) -> Family:
+        with self._lock:
+            samples = [(self._labels(labels), value) for labels, value in self._values.items()]
+        return self.name, self.kind, self.documentation, samples
+
+
+class Counter(Metric):
+    """単調増加するカウンター"""
+
+    kind = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """増減する値"""
+
+    kind = "gauge"
+
+    def set(self, value: float, labels: tuple = ()):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    """
+    バケットごとの度数・合計・件数を持つヒストグラム
+
+    Parameters:
+    -----------
+    buckets : sequence of float
+        バケットの上限値（昇順。+Infは自動で追加する）
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: tuple = ()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [バケットごとの度数（最後は+Inf）, 合計]
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def collect(self) -> Family:
+        with self._lock:
+            states = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        samples = []
+        for labels, counts, total in states:
+            names = self._labels(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append((dict(names, le=_format_value(bound)), cumulative, "_bucket"))
+            samples.append((names, total, "_sum"))
+            samples.append((names, cumulative, "_count"))
+        return self.name, self.kind, self.documentation, samples
+
+
+class MetricsRegistry:
+    """メトリクスと、出力時に値を読むコレクター（関数）の一覧"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # モジュールの再読み込みなどで同じ名前が登録された場合は既存のものを使う
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]):
+        """出力時に呼ばれ、(名前, 種類, 説明, サンプル) を返す関数を登録"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheusのテキスト形式で出力"""
+        with self._lock:
+            families = [metric.collect() for metric in self._metrics.values()]
+            collectors = list(self._collectors)
+        for collector in collectors:
+            families.extend(collector())
+
+        lines = []
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample in samples:
+                labels, value = sample[0], sample[1]
+                suffix = sample[2] if len(sample) > 2 else ""
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# プロセス全体のレジストリ
+REGISTRY = MetricsRegistry()
+
+
+def route_template(scope) -> str:
+    """
+    リクエストが一致したルートのパスのテンプレート（/api/neowise/raw/{source_id} など）
+
+    ルーティングを通らなかったリクエスト（レスポンスキャッシュのヒットなど）は
+    アプリのルートと照合し直す。どのルートにも一致しなければ UNMATCHED_ROUTE
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    app = scope.get("app")
+    if app is None:
+        return UNMATCHED_ROUTE
+    from starlette.routing import Match
+    for candidate in getattr(app, "routes", []):
+        match, _ = candidate.matches(scope)
+        if match == Match.FULL:
+            return getattr(candidate, "path", UNMATCHED_ROUTE)
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    リクエストのレイテンシ・レスポンスサイズ・処理中の数を記録するASGIミドルウェア
+
+    BaseHTTPMiddleware を使わない素のASGIミドルウェアで、本文のバイト数を数えるだけでコピーはしない。
+    レスポンスキャッシュのヒットも含めて計測するよう、他のミドルウェアより外側に配置する
+
+    Parameters:
+    -----------
+    app : ASGI app
+    registry : MetricsRegistry
+        記録先（デフォルトはプロセス全体のREGISTRY）
+    exclude_paths : sequence of str
+        記録しないパス（/metrics 自体など）
+    """
+
+    def __init__(self, app, registry: Optional[MetricsRegistry] = None, exclude_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.exclude_paths = frozenset(exclude_paths)
+        registry = registry or REGISTRY
+        self.duration = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+        )
+        self.response_size = registry.histogram(
+            "http_response_size_bytes", "HTTP response body size by route", ("method", "route"), buckets=SIZE_BUCKETS
+        )
+        self.in_progress = registry.gauge("http_requests_in_progress", "HTTP requests currently being processed")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+        content_length = 0
+
+        async def counting_send(message):
+            nonlocal status, size, content_length
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name.lower() == b"content-length":
+                        content_length = int(value)
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            elif message["type"] == "http.response.pathsend":
+                # ファイルをサーバーが直接送る場合は本文が流れないのでContent-Lengthを使う
+                size += content_length
+            await send(message)
+
+        self.in_progress.inc()
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            self.in_progress.dec()
+            route = route_template(scope)
+            method = scope["method"]
+            self.duration.observe(time.perf_counter() - start, (method, route, str(status)))
+            self.response_size.observe(size, (method, route))
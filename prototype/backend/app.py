@@ -2,20 +2,43 @@
 プロトタイプ用バックエンドAPI
 
 あらかじめ取得したNEOWISE/ASASSNライトカーブデータを提供する
+
+NEOWISEは lightcurve_store のストア経由で読む。デフォルトは data/neowise のJSONで、
+環境変数 NEOWISE_STORE にSQLiteのDBやParquetデータセット（scripts/convert_to_parquet.py）、
+列ファイル（scripts/export_columnar.py）を指定すると同じAPIでそこから配信する
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 import json
+import os
 from pathlib import Path
 
+import numpy as np
+
+from downsample import DOWNSAMPLE_METHODS, downsample as downsample_points
+from lightcurve_store import JSONStore, LightcurveFileIndex, open_store
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, MetricsMiddleware, cache_collector
+from response_cache import LRUCache, ResponseCacheMiddleware
+from server_timing import ServerTimingMiddleware, TimedRoute, phase
+
 app = FastAPI(
     title="Lightcurve Data API (Prototype)",
     description="NEOWISEとASASSNのライトカーブデータを提供するプロトタイプAPI",
     version="0.1.0"
 )
+# エンドポイントの終了時刻を記録し、Server-Timing の serialize（JSONへの変換）を分けて計測する
+app.router.route_class = TimedRoute
+
+# レスポンスキャッシュ（正規化したクエリ + データディレクトリのバージョンをキーとするLRU）
+# CORSヘッダーをキャッシュしないよう、CORSより内側に配置する
+RESPONSE_CACHE_MAX_ENTRIES = 2048
+RESPONSE_CACHE_MAX_BYTES = 128 * 1024 * 1024  # 128 MiB
+response_cache = LRUCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES)
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache, version_fn=lambda: data_version())
 
 # CORS設定
 app.add_middleware(
@@ -26,6 +49,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Server-Timingヘッダー（区間ごとの時間）。キャッシュにヘッダーが保存されないようキャッシュより外側に配置する
+# 環境変数 LIGHTCURVE_PROFILING=1 のときだけ ?profile=1 でリクエストをプロファイルできる
+REQUEST_PROFILING = os.environ.get("LIGHTCURVE_PROFILING") == "1"
+app.add_middleware(ServerTimingMiddleware, profiling=REQUEST_PROFILING)
+
+# メトリクス（/metrics）。キャッシュのヒットも計測するよう最も外側に配置する
+app.add_middleware(MetricsMiddleware, registry=REGISTRY)
+REGISTRY.add_collector(cache_collector({"response": response_cache}))
+
 # データディレクトリのパス
 DATA_DIR = Path(__file__).parent.parent / "data"
 NEOWISE_DIR = DATA_DIR / "neowise"
@@ -69,46 +101,152 @@ class ASASSNLightCurve(BaseModel):
     observations: List[ASASSNObservation]
 
 
-def find_lightcurve_file(data_dir: Path, source_id: str = None, ra: float = None, dec: float = None) -> Optional[Path]:
+# 起動時にインデックスを構築
+# NEOWISEのストア（環境変数 NEOWISE_STORE があればSQLite / Parquet / 列ファイル / JSONディレクトリ、無ければdata/neowise）
+NEOWISE_STORE = open_store(os.environ["NEOWISE_STORE"]) if os.environ.get("NEOWISE_STORE") else JSONStore(NEOWISE_DIR)
+ASASSN_INDEX = LightcurveFileIndex(ASASSN_DIR)
+
+
+# バッチ取得で一度に指定できる天体数の上限
+MAX_BATCH_SIZE = 1000
+
+
+class BatchCoordinate(BaseModel):
+    """バッチ取得の座標指定"""
+    ra: float
+    dec: float
+
+
+class BatchLightcurveRequest(BaseModel):
+    """バッチ取得リクエスト"""
+    source_ids: List[str] = []
+    coordinates: List[BatchCoordinate] = []
+
+
+def data_version() -> tuple:
+    """データディレクトリ全体のバージョンスタンプ（レスポンスキャッシュのキー）"""
+    return (NEOWISE_STORE.version(), ASASSN_INDEX.current_version())
+
+
+# 事前圧縮ファイルの拡張子（scripts/precompress_data.py で作成、優先順）
+PRECOMPRESSED_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Accept-Encodingヘッダーを {エンコーディング: q値} に変換"""
+    encodings = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[token.strip().lower()] = q
+    return encodings
+
+
+def lightcurve_file_response(file_path: Path, accept_encoding: Optional[str]) -> FileResponse:
+    """
+    ライトカーブファイルをそのまま配信するレスポンスを作成
+
+    クライアントが対応していれば、元ファイルより新しい事前圧縮版（.br / .gz）を
+    Content-Encoding付きで返す。json.load・pydantic検証を経由せずにファイルを送る
+    """
+    accepted = parse_accept_encoding(accept_encoding)
+    source_mtime = file_path.stat().st_mtime_ns
+    headers = {"Vary": "Accept-Encoding"}
+    
+    candidates = []
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q <= 0:
+            continue
+        variant = file_path.with_name(file_path.name + suffix)
+        try:
+            if variant.stat().st_mtime_ns >= source_mtime:
+                candidates.append((q, variant, encoding))
+        except FileNotFoundError:
+            continue
+    
+    if candidates:
+        # q値が最大のものを選ぶ（同値ならPRECOMPRESSED_ENCODINGSの順）
+        _, variant, encoding = max(candidates, key=lambda c: c[0])
+        headers["Content-Encoding"] = encoding
+        return FileResponse(variant, media_type="application/json", headers=headers)
+    
+    return FileResponse(file_path, media_type="application/json", headers=headers)
+
+
+def _finite_or_none(values: np.ndarray) -> list:
+    """NaNをNoneに置き換えたリスト"""
+    return [v if v == v else None for v in values.tolist()]
+
+
+def _downsample_observations(observations: list, mag_key: str, err_key: str,
+                             max_points: int, method: str):
+    """観測リストから1バンド分を取り出してダウンサンプリング"""
+    points = [
+        (o['mjd'], o[mag_key], o.get(err_key) if o.get(err_key) is not None else np.nan)
+        for o in observations if o.get(mag_key) is not None
+    ]
+    arrays = np.array(points, dtype=np.float64).reshape(-1, 3)
+    return downsample_points(arrays[:, 0], arrays[:, 1], arrays[:, 2], max_points, method)
+
+
+def downsample_neowise(data: dict, max_points: int, method: str) -> dict:
+    """NEOWISEライトカーブのW1/W2をそれぞれダウンサンプリングし、MJDで結合し直す"""
+    rows = {}
+    for band in ['w1', 'w2']:
+        mjd, mag, err = _downsample_observations(
+            data['observations'], f'{band}_mag', f'{band}_err', max_points, method
+        )
+        for t, m, e in zip(mjd.tolist(), _finite_or_none(mag), _finite_or_none(err)):
+            row = rows.setdefault(t, {"mjd": t, "w1_mag": None, "w1_err": None, "w2_mag": None, "w2_err": None})
+            row[f'{band}_mag'] = m
+            row[f'{band}_err'] = e
+    
+    observations = [rows[t] for t in sorted(rows)]
+    return dict(data, num_observations=len(observations), observations=observations)
+
+
+def downsample_asassn(data: dict, max_points: int, method: str) -> dict:
+    """ASASSNライトカーブをバンドごとにダウンサンプリング"""
+    observations = []
+    for band in sorted({o.get('band') for o in data['observations']}):
+        band_obs = [o for o in data['observations'] if o.get('band') == band]
+        mjd, mag, err = _downsample_observations(band_obs, 'mag', 'mag_err', max_points, method)
+        observations += [
+            {"mjd": t, "mag": m, "mag_err": e, "band": band}
+            for t, m, e in zip(mjd.tolist(), _finite_or_none(mag), _finite_or_none(err))
+        ]
+    
+    observations.sort(key=lambda o: o['mjd'])
+    return dict(data, num_observations=len(observations), observations=observations)
+
+
+def validate_downsample_method(method: str):
+    """ダウンサンプリング方式の検証"""
+    if method not in DOWNSAMPLE_METHODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未対応のdownsampleです: {method}（{', '.join(DOWNSAMPLE_METHODS)} のいずれか）"
+        )
+
+
+def find_lightcurve_file(index: LightcurveFileIndex, source_id: str = None, ra: float = None, dec: float = None) -> Optional[Path]:
     """
     ライトカーブファイルを検索
     
     source_idが指定されている場合は直接ファイルを探す
     座標が指定されている場合は、最も近い天体のファイルを返す
     """
-    if source_id:
-        # source_idで直接検索
-        file_path = data_dir / f"{source_id}.json"
-        if file_path.exists():
-            return file_path
-        return None
-    
-    if ra is not None and dec is not None:
-        # 座標で検索（最近傍）
-        min_distance = float('inf')
-        closest_file = None
-        
-        for file_path in data_dir.glob("*.json"):
-            try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                    file_ra = data.get('ra')
-                    file_dec = data.get('dec')
-                    
-                    if file_ra is not None and file_dec is not None:
-                        # 簡易的な距離計算（小角度近似）
-                        distance = ((ra - file_ra)**2 + (dec - file_dec)**2)**0.5
-                        if distance < min_distance:
-                            min_distance = distance
-                            closest_file = file_path
-            except Exception:
-                continue
-        
-        # 3秒角（0.00083度）以内であればマッチとみなす
-        if min_distance < 0.00083:
-            return closest_file
-    
-    return None
+    entry = index.find(source_id, ra, dec)
+    return entry.path if entry else None
 
 
 @app.get("/")
@@ -120,7 +258,9 @@ def root():
         "endpoints": {
             "neowise": "/api/lightcurve/neowise",
             "asassn": "/api/lightcurve/asassn",
+            "batch": "/api/lightcurve/{survey}/batch",
             "list": "/api/list",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
@@ -129,47 +269,62 @@ def root():
 @app.get("/api/list")
 def list_available_data():
     """利用可能なデータのリスト"""
-    neowise_files = list(NEOWISE_DIR.glob("*.json"))
-    asassn_files = list(ASASSN_DIR.glob("*.json"))
+    asassn_ids = list(ASASSN_INDEX.entries)
     
     return {
-        "neowise_count": len(neowise_files),
-        "asassn_count": len(asassn_files),
-        "neowise_sources": [f.stem for f in neowise_files[:10]],  # 最初の10個のみ
-        "asassn_sources": [f.stem for f in asassn_files[:10]]
+        "neowise_count": NEOWISE_STORE.count(),
+        "asassn_count": len(asassn_ids),
+        "neowise_sources": NEOWISE_STORE.source_ids(limit=10),  # 最初の10個のみ
+        "asassn_sources": asassn_ids[:10]
     }
 
 
 @app.get("/api/lightcurve/neowise", response_model=NEOWISELightCurve)
 def get_neowise_lightcurve(
+    request: Request,
     source_id: Optional[str] = None,
     ra: Optional[float] = None,
-    dec: Optional[float] = None
+    dec: Optional[float] = None,
+    max_points: Optional[int] = Query(None, ge=3),
+    downsample: str = "lttb"
 ):
     """
     NEOWISEライトカーブを取得
     
     - **source_id**: SOURCE_ID（Gaia DR3）で検索
     - **ra, dec**: 座標で検索（度単位）
+    - **max_points**: 指定するとバンドごとにこの点数以下へダウンサンプリング（プロット用）
+    - **downsample**: ダウンサンプリング方式 lttb（デフォルト）/ minmax / epoch
     """
     if not source_id and (ra is None or dec is None):
         raise HTTPException(
             status_code=400,
             detail="source_id または (ra, dec) のいずれかを指定してください"
         )
+    validate_downsample_method(downsample)
     
-    file_path = find_lightcurve_file(NEOWISE_DIR, source_id, ra, dec)
+    with phase("match"):
+        found = NEOWISE_STORE.find(source_id, ra, dec)
     
-    if not file_path:
+    if found is None:
         raise HTTPException(
             status_code=404,
             detail="指定された条件に一致するNEOWISEライトカーブが見つかりませんでした"
         )
     
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        return data
+        # JSONストアはファイルをそのまま配信する
+        file_path = NEOWISE_STORE.file_path(found)
+        if file_path is not None and max_points is None:
+            return lightcurve_file_response(file_path, request.headers.get("accept-encoding"))
+        with phase("merge"):
+            data = NEOWISE_STORE.lightcurves([found])[found]
+        if max_points is not None:
+            # ダウンサンプリング結果はレスポンスキャッシュに（天体・解像度ごとに）保持される
+            with phase("downsample"):
+                data = downsample_neowise(data, max_points, downsample)
+        with phase("serialize"):
+            return JSONResponse(data)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -179,23 +334,30 @@ def get_neowise_lightcurve(
 
 @app.get("/api/lightcurve/asassn", response_model=ASASSNLightCurve)
 def get_asassn_lightcurve(
+    request: Request,
     source_id: Optional[str] = None,
     ra: Optional[float] = None,
-    dec: Optional[float] = None
+    dec: Optional[float] = None,
+    max_points: Optional[int] = Query(None, ge=3),
+    downsample: str = "lttb"
 ):
     """
     ASASSNライトカーブを取得
     
     - **source_id**: SOURCE_ID（Gaia DR3）で検索
     - **ra, dec**: 座標で検索（度単位）
+    - **max_points**: 指定するとバンドごとにこの点数以下へダウンサンプリング（プロット用）
+    - **downsample**: ダウンサンプリング方式 lttb（デフォルト）/ minmax / epoch
     """
     if not source_id and (ra is None or dec is None):
         raise HTTPException(
             status_code=400,
             detail="source_id または (ra, dec) のいずれかを指定してください"
         )
+    validate_downsample_method(downsample)
     
-    file_path = find_lightcurve_file(ASASSN_DIR, source_id, ra, dec)
+    with phase("match"):
+        file_path = find_lightcurve_file(ASASSN_INDEX, source_id, ra, dec)
     
     if not file_path:
         raise HTTPException(
@@ -204,9 +366,15 @@ def get_asassn_lightcurve(
         )
     
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        return data
+        if max_points is not None:
+            # ダウンサンプリング結果はレスポンスキャッシュに（天体・解像度ごとに）保持される
+            with phase("read"), open(file_path, 'r') as f:
+                data = json.load(f)
+            with phase("downsample"):
+                data = downsample_asassn(data, max_points, downsample)
+            with phase("serialize"):
+                return JSONResponse(data)
+        return lightcurve_file_response(file_path, request.headers.get("accept-encoding"))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -214,10 +382,82 @@ def get_asassn_lightcurve(
         )
 
 
+@app.post("/api/lightcurve/{survey}/batch")
+def get_lightcurves_batch(survey: str, request: BatchLightcurveRequest):
+    """
+    複数天体のライトカーブを1回のリクエストでまとめて取得
+    
+    - **survey**: neowise または asassn
+    - **source_ids**: SOURCE_ID（Gaia DR3）のリスト
+    - **coordinates**: 座標（{ra, dec}、度単位）のリスト
+    """
+    if survey not in ("neowise", "asassn"):
+        raise HTTPException(status_code=404, detail=f"未対応のサーベイです: {survey}")
+    
+    num_requested = len(request.source_ids) + len(request.coordinates)
+    if num_requested == 0:
+        raise HTTPException(status_code=400, detail="source_ids または coordinates を指定してください")
+    if num_requested > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一度に取得できる天体数は{MAX_BATCH_SIZE}までです（指定数: {num_requested}）"
+        )
+    
+    lightcurves = []
+    not_found = []
+    if survey == "neowise":
+        # source_idはストアでまとめて検索し、座標は空間インデックスでsource_idに解決する
+        queries = [(source_id, source_id) for source_id in request.source_ids]
+        if request.coordinates:
+            with phase("match"):
+                sky = NEOWISE_STORE.sky_index()
+                positions = sky.nearest_many([c.ra for c in request.coordinates], [c.dec for c in request.coordinates])
+            queries += [
+                (str(sky.ids[position]) if position >= 0 else None, {"ra": c.ra, "dec": c.dec})
+                for c, position in zip(request.coordinates, positions)
+            ]
+        with phase("merge"):
+            documents = NEOWISE_STORE.lightcurves([source_id for source_id, _ in queries if source_id])
+        for source_id, query in queries:
+            if source_id in documents:
+                lightcurves.append(documents[source_id])
+            else:
+                not_found.append(query)
+    else:
+        with phase("match"):
+            queries = [(ASASSN_INDEX.find(source_id=source_id), source_id) for source_id in request.source_ids]
+            queries += [
+                (ASASSN_INDEX.find(ra=c.ra, dec=c.dec), {"ra": c.ra, "dec": c.dec}) for c in request.coordinates
+            ]
+        for entry, query in queries:
+            if entry is None:
+                not_found.append(query)
+                continue
+            try:
+                with phase("read"), open(entry.path, 'r') as f:
+                    lightcurves.append(json.load(f))
+            except Exception:
+                not_found.append(query)
+    
+    return {
+        "survey": survey,
+        "num_requested": num_requested,
+        "num_found": len(lightcurves),
+        "lightcurves": lightcurves,
+        "not_found": not_found
+    }
+
+
 @app.get("/health")
 def health_check():
     """ヘルスチェック"""
-    return {"status": "ok"}
+    return {"status": "ok", "neowise_store": NEOWISE_STORE.describe(), "response_cache": response_cache.stats()}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus形式のメトリクス（ルートごとのレイテンシ・ストアの読み出し時間・キャッシュのヒット率など）"""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
 
 
 if __name__ == "__main__":
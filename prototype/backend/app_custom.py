@@ -3,20 +3,56 @@
 
 作成したSQLiteデータベース（neowise_target_region.db）からデータを提供する
 フロントエンド（index.html）と互換性のあるAPI形式
+
+データは lightcurve_store のストア経由で読むため、環境変数 NEOWISE_STORE で
+Parquetデータセット（scripts/convert_to_parquet.py）、列ファイル（scripts/export_columnar.py）や
+JSONディレクトリからも配信できる
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
-import sqlite3
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+import hashlib
+import json
+import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
+from downsample import DOWNSAMPLE_METHODS, downsample as downsample_points
+from epoch_kernel import aggregate_epochs
+from lightcurve_store import (
+    NEOWISE_COLUMNS, LightcurveStore, array_to_list, build_neowise_response, lightcurve_response,
+    merge_neowise_bands, neowise_metadata, open_store
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, MetricsMiddleware, cache_collector
+from response_cache import LRUCache, ResponseCacheMiddleware
+from response_formats import columns_response, negotiate_format
+from server_timing import ServerTimingMiddleware, TimedRoute, phase
+from spatial_index import SkyIndex
+
 app = FastAPI(
     title="NEOWISE Lightcurve API (Custom SQLite)",
     description="カスタムSQLiteデータベースからライトカーブデータを提供するAPI",
     version="1.0.0"
 )
+# エンドポイントの終了時刻を記録し、Server-Timing の serialize（JSONへの変換）を分けて計測する
+app.router.route_class = TimedRoute
+
+# レスポンスキャッシュ（正規化したクエリ + DBのバージョンスタンプをキーとするLRU）
+# CORSヘッダーをキャッシュしないよう、CORSより内側に配置する
+RESPONSE_CACHE_MAX_ENTRIES = 2048
+RESPONSE_CACHE_MAX_BYTES = 128 * 1024 * 1024  # 128 MiB
+response_cache = LRUCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES)
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache, version_fn=lambda: get_db_version())
+
+# ダウンサンプリング結果のキャッシュ（天体・バンド・解像度ごと）
+downsample_cache = LRUCache(max_entries=4096, max_bytes=64 * 1024 * 1024)
+
+# エポック再集約結果のキャッシュ（フィルタ設定のハッシュ・天体ごと）
+epoch_cache = LRUCache(max_entries=16384, max_bytes=64 * 1024 * 1024)
 
 # CORS設定
 app.add_middleware(
@@ -27,14 +63,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Server-Timingヘッダー（区間ごとの時間）。キャッシュにヘッダーが保存されないようキャッシュより外側に配置する
+# 環境変数 LIGHTCURVE_PROFILING=1 のときだけ ?profile=1 でリクエストをプロファイルできる
+REQUEST_PROFILING = os.environ.get("LIGHTCURVE_PROFILING") == "1"
+app.add_middleware(ServerTimingMiddleware, profiling=REQUEST_PROFILING)
+
+# メトリクス（/metrics）。キャッシュのヒットも計測するよう最も外側に配置する
+app.add_middleware(MetricsMiddleware, registry=REGISTRY)
+REGISTRY.add_collector(cache_collector({
+    "response": response_cache,
+    "downsample": downsample_cache,
+    "epoch": epoch_cache,
+}))
+
 # SQLiteファイルパス（作成したファイルのパスに変更してください）
 # デフォルト: カレントディレクトリまたはbackendディレクトリの親に配置
 DB_PATH = None
 
 def find_database():
-    """データベースファイルを探す"""
+    """
+    データベースファイルを探す
+
+    環境変数 NEOWISE_STORE（SQLite / Parquetデータセット / 列ファイル / JSONディレクトリ）、
+    NEOWISE_DB_PATH（SQLite）があれば最優先
+    """
     global DB_PATH
     
+    for env_name in ("NEOWISE_STORE", "NEOWISE_DB_PATH"):
+        env_path = os.environ.get(env_name)
+        if not env_path:
+            continue
+        if Path(env_path).exists():
+            DB_PATH = str(Path(env_path).resolve())
+            print(f"✅ データベース（{env_name}）: {DB_PATH}")
+            return DB_PATH
+        print(f"⚠️ {env_name} のファイルが見つかりません: {env_path}")
+    
     # 検索パスの優先順位
     search_paths = [
         Path("neowise_target_region.db"),  # カレントディレクトリ
@@ -60,9 +124,16 @@ def find_database():
 # 起動時にデータベースを探す
 find_database()
 
+# 読み取り専用コネクションプールの設定（SQLiteStore）
+# immutable=1はSQLiteの変更検出を省略する（差し替えはファイルのstatで検出）
+DB_POOL_IMMUTABLE = False
+DB_POOL_MMAP_SIZE = 256 * 1024 * 1024  # 256 MiB
+DB_POOL_CACHE_SIZE_KIB = 64 * 1024  # 64 MiB
+_store: Optional[LightcurveStore] = None
+
 
-def get_db_connection():
-    """データベース接続を取得"""
+def get_store() -> LightcurveStore:
+    """データのストアを取得（DB_PATHの形式に応じてSQLite / Parquet / 列ファイル / JSON）"""
     if DB_PATH is None:
         raise HTTPException(
             status_code=500,
@@ -75,7 +146,274 @@ def get_db_connection():
             detail=f"データベースファイルが見つかりません: {DB_PATH}"
         )
     
-    return sqlite3.connect(DB_PATH)
+    global _store
+    if _store is None or _store.path != str(Path(DB_PATH).resolve()):
+        _store = open_store(
+            DB_PATH,
+            immutable=DB_POOL_IMMUTABLE,
+            mmap_size=DB_POOL_MMAP_SIZE,
+            cache_size_kib=DB_POOL_CACHE_SIZE_KIB
+        )
+    return _store
+
+
+def get_db_version():
+    """
+    データのバージョンスタンプを取得
+
+    ファイルの差し替え・更新を検出するため、SQLiteなら (inode, 更新時刻, サイズ) を返す
+    """
+    if DB_PATH is None or not Path(DB_PATH).exists():
+        return None
+    return get_store().version()
+
+
+def refresh_source_index(force: bool = False) -> SkyIndex:
+    """天体の座標から空間インデックスを構築"""
+    index = get_store().sky_index(force=force)
+    print(f"✅ 空間インデックスを構築: {len(index)} 天体")
+    return index
+
+
+def get_source_index() -> SkyIndex:
+    """座標検索用の空間インデックスを取得（データが更新されていればストアが再構築する）"""
+    return get_store().sky_index()
+
+
+# 起動時に空間インデックスを構築
+if DB_PATH:
+    refresh_source_index()
+
+
+# バッチ取得で一度に指定できる天体数の上限
+MAX_BATCH_SIZE = 1000
+
+
+class BatchCoordinate(BaseModel):
+    """バッチ取得の座標指定"""
+    ra: float
+    dec: float
+
+
+class BatchLightcurveRequest(BaseModel):
+    """バッチ取得リクエスト"""
+    source_ids: List[str] = []
+    coordinates: List[BatchCoordinate] = []
+    raw: bool = False
+    columnar: bool = False
+    max_points: Optional[int] = Field(None, ge=3)
+    downsample: str = "lttb"
+
+
+def load_neowise_data(store: LightcurveStore, source_id, raw: bool) -> pd.DataFrame:
+    """1天体分の観測データ（mjd, band, mag, mag_err）を取得（raw=Trueなら生データ、Falseならエポック集約）"""
+    return store.neowise([str(source_id)], raw).drop(columns='source_id').reset_index(drop=True)
+
+
+def validate_downsample_method(method: str):
+    """ダウンサンプリング方式の検証"""
+    if method not in DOWNSAMPLE_METHODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"未対応のdownsampleです: {method}（{', '.join(DOWNSAMPLE_METHODS)} のいずれか）"
+        )
+
+
+def downsample_band(data: pd.DataFrame, band: str, max_points: int, method: str) -> pd.DataFrame:
+    """1バンド分をmax_points点以下にダウンサンプリング（等級が欠損した点は除く）"""
+    band_data = data[(data['band'] == band) & data['mag'].notna()]
+    mjd, mag, mag_err = downsample_points(
+        band_data['mjd'].to_numpy(), band_data['mag'].to_numpy(), band_data['mag_err'].to_numpy(),
+        max_points, method
+    )
+    return pd.DataFrame({'mjd': mjd, 'band': band, 'mag': mag, 'mag_err': mag_err})
+
+
+def downsample_frame(data: pd.DataFrame, max_points: int, method: str) -> pd.DataFrame:
+    """W1/W2それぞれをmax_points点以下にダウンサンプリング"""
+    return pd.concat(
+        [downsample_band(data, band, max_points, method) for band in ['W1', 'W2']],
+        ignore_index=True
+    )
+
+
+def load_downsampled_neowise_data(store: LightcurveStore, source_id, raw: bool, max_points: int, method: str) -> pd.DataFrame:
+    """
+    ダウンサンプリング済みの観測データを取得
+    
+    結果は (DBバージョン, 天体, データ種別, バンド, 方式, 点数) ごとにキャッシュし、
+    両バンドともキャッシュにあればDBを読まない
+    """
+    version = get_db_version()
+    keys = {band: (version, str(source_id), raw, band, method, max_points) for band in ['W1', 'W2']}
+    cached = {band: downsample_cache.get(key) for band, key in keys.items()}
+    
+    if any(frame is None for frame in cached.values()):
+        data = load_neowise_data(store, source_id, raw)
+        for band, key in keys.items():
+            if cached[band] is None:
+                cached[band] = downsample_band(data, band, max_points, method)
+                downsample_cache.put(key, cached[band], int(cached[band].memory_usage(deep=True).sum()))
+    
+    return pd.concat([cached['W1'], cached['W2']], ignore_index=True)
+
+
+class EpochFilter(BaseModel):
+    """
+    エポック再集約の品質カット
+    
+    デフォルト値はingest時のデフォルトフィルタ（filter_applied='default'）と同じ
+    """
+    require_cc_flags_zero: bool = True  # cc_flags（該当バンドの文字）が'0'
+    ph_qual: str = "A"  # 許容するph_qual（該当バンドの文字）。例: "AB"
+    require_moon_masked_zero: bool = True  # moon_masked（該当バンドの文字）が'0'
+    require_sso_flg_zero: bool = True  # sso_flg == 0
+    qi_fact_min: float = 1.0  # qi_fact >= qi_fact_min
+    saa_sep_min: float = 5.0  # saa_sep >= saa_sep_min
+    sat_max: float = 0.05  # sat <= sat_max
+    rchi2_max: float = 50.0  # rchi2 <= rchi2_max
+    qual_frame_min: float = 0.0  # qual_frame > qual_frame_min
+    require_sky: bool = True  # skyが欠損していない
+    clip_sigma: float = 3.0  # σクリッピングの閾値（0以下で無効）
+    epoch_gap: float = 100.0  # エポックを区切るMJD間隔（日）
+    snr_min: float = 300.0  # エポックを採用するS/Nの下限
+    snr_fallback: float = 10.0  # snr_minを満たすエポックが無い場合の下限
+
+    def cache_key(self) -> str:
+        """フィルタ設定のハッシュ"""
+        payload = json.dumps(self.model_dump(), sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class EpochBatchRequest(BaseModel):
+    """エポック再集約のバッチリクエスト"""
+    source_ids: List[str]
+    filter: EpochFilter = EpochFilter()
+
+
+# エポック再集約に使う生データの列
+REAGGREGATE_COLUMNS = [
+    "mjd", "band", "mpro_corrected", "sigmpro", "cc_flags", "ph_qual", "moon_masked",
+    "sso_flg", "qi_fact", "saa_sep", "sat", "rchi2", "qual_frame", "sky"
+]
+
+# /api/neowise/raw で返す生データの列
+RAW_RESPONSE_COLUMNS = [
+    "mjd", "band", "mpro", "sigmpro", "mpro_corrected",
+    "cc_flags", "ph_qual", "moon_masked", "sso_flg",
+    "qi_fact", "saa_sep", "sat", "rchi2", "qual_frame"
+]
+# バイナリ形式で常にfloat64として書き出す列（文字列の列 band, cc_flags, ph_qual, moon_masked 以外）
+RAW_RESPONSE_NUMERIC_COLUMNS = [
+    col for col in RAW_RESPONSE_COLUMNS if col not in ("band", "cc_flags", "ph_qual", "moon_masked")
+]
+
+
+def quality_mask(raw: pd.DataFrame, filters: EpochFilter) -> np.ndarray:
+    """生データ（neowise_raw_observations）に品質カットを適用したマスク"""
+    is_w1 = (raw['band'] == 'W1').to_numpy()
+    
+    def band_char(col):
+        # フラグ文字列のうち該当バンドの文字（W1は0文字目、W2は1文字目）
+        values = raw[col].fillna('').astype(str)
+        return np.where(is_w1, values.str[0], values.str[1])
+    
+    mask = raw['mpro_corrected'].notna().to_numpy(copy=True)
+    if filters.require_cc_flags_zero:
+        mask &= band_char('cc_flags') == '0'
+    if filters.ph_qual:
+        mask &= np.isin(band_char('ph_qual'), list(filters.ph_qual))
+    if filters.require_moon_masked_zero:
+        mask &= band_char('moon_masked') == '0'
+    if filters.require_sso_flg_zero:
+        mask &= (raw['sso_flg'] == 0).to_numpy()
+    mask &= (raw['qi_fact'] >= filters.qi_fact_min).to_numpy()
+    mask &= (raw['saa_sep'] >= filters.saa_sep_min).to_numpy()
+    mask &= (raw['sat'] <= filters.sat_max).to_numpy()
+    mask &= (raw['rchi2'] <= filters.rchi2_max).to_numpy()
+    mask &= (raw['qual_frame'] > filters.qual_frame_min).to_numpy()
+    if filters.require_sky:
+        mask &= raw['sky'].notna().to_numpy()
+    return mask
+
+
+def _finite_or_none(values: np.ndarray) -> list:
+    """NaN・無限大をNoneに置き換えたリスト"""
+    return [v if np.isfinite(v) else None for v in values.tolist()]
+
+
+def reaggregate_epochs(store: LightcurveStore, source_ids: List[str], filters: EpochFilter) -> Dict[str, list]:
+    """
+    保存済みの生データから、指定した品質カットでエポック集約をやり直す
+    
+    全天体分の生データをストアから1回で取得し、ベクトル化カーネルで一度に集約する。
+    結果は (DBバージョン, フィルタのハッシュ, 天体) ごとにキャッシュする
+    
+    Returns:
+    --------
+    dict
+        source_id → エポックのリスト（生データが無い天体は含まない）
+    """
+    version = get_db_version()
+    filter_key = filters.cache_key()
+    results = {}
+    missing = []
+    for source_id in source_ids:
+        cached = epoch_cache.get((version, filter_key, source_id))
+        if cached is None:
+            missing.append(source_id)
+        else:
+            results[source_id] = cached
+    
+    if not missing:
+        return results
+    
+    raw = store.raw_observations(missing, REAGGREGATE_COLUMNS)
+    if raw.empty:
+        return results
+    raw['source_id'] = raw['source_id'].astype(str)
+    found = set(raw['source_id'])
+    
+    with phase("aggregate"):
+        filtered = raw[quality_mask(raw, filters)]
+        # グループ番号 = 天体番号×2 + バンド（W1=0, W2=1）
+        source_codes, source_uniques = pd.factorize(filtered['source_id'])
+        group = source_codes * 2 + (filtered['band'] != 'W1').to_numpy()
+        epochs = aggregate_epochs(
+            group,
+            filtered['mjd'].to_numpy(),
+            filtered['mpro_corrected'].to_numpy(),
+            filtered['sigmpro'].to_numpy(),
+            epoch_gap=filters.epoch_gap,
+            clip_sigma=filters.clip_sigma,
+            snr_min=filters.snr_min,
+            snr_fallback=filters.snr_fallback
+        )
+    
+    # 天体ごとのエポックリストに変換（group・mjdの昇順）
+    per_source = {source_id: [] for source_id in missing if source_id in found}
+    columns = zip(
+        epochs['group'].tolist(), epochs['epoch_id'].tolist(), epochs['mjd'].tolist(),
+        _finite_or_none(epochs['mag_mean']), _finite_or_none(epochs['mag_se']),
+        _finite_or_none(epochs['mag_lim']), epochs['n_points'].tolist(), _finite_or_none(epochs['snr'])
+    )
+    for group_id, epoch_id, mjd, mag, mag_err, mag_lim, n_points, snr in columns:
+        per_source[source_uniques[group_id // 2]].append({
+            "band": "W1" if group_id % 2 == 0 else "W2",
+            "epoch_id": epoch_id,
+            "mjd": mjd,
+            "mag": mag,
+            "mag_err": mag_err,
+            "mag_lim": mag_lim,
+            "n_points": n_points,
+            "snr": snr
+        })
+    
+    for source_id, source_epochs in per_source.items():
+        source_epochs.sort(key=lambda e: e["mjd"])
+        epoch_cache.put((version, filter_key, source_id), source_epochs, 200 * len(source_epochs) + 100)
+        results[source_id] = source_epochs
+    return results
 
 
 @app.get("/")
@@ -85,10 +423,13 @@ def root():
         "message": "NEOWISE Lightcurve API (Custom SQLite)",
         "version": "1.0.0",
         "database": DB_PATH,
+        "store": get_store().describe() if DB_PATH and Path(DB_PATH).exists() else None,
         "endpoints": {
             "neowise": "/api/lightcurve/neowise",
             "asassn": "/api/lightcurve/asassn",
+            "batch": "/api/lightcurve/{survey}/batch",
             "list": "/api/list",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
@@ -97,35 +438,27 @@ def root():
 @app.get("/api/list")
 def list_sources():
     """登録された天体一覧を取得"""
-    conn = get_db_connection()
+    store = get_store()
     
-    try:
-        # sourcesテーブルからデータを取得
-        sources_df = pd.read_sql_query("SELECT * FROM sources", conn)
-        
-        # 各ソースのエポックデータ数を取得
-        epoch_counts = pd.read_sql_query("""
-            SELECT source_id, COUNT(*) as count 
-            FROM neowise_epoch_summary 
-            GROUP BY source_id
-        """, conn)
-        
-        return {
-            "neowise_count": len(sources_df),
-            "asassn_count": 0,  # ASASSNデータはこのDBにはない
-            "neowise_sources": sources_df['source_id'].tolist()[:20],
-            "asassn_sources": []
-        }
-    finally:
-        conn.close()
+    return {
+        "neowise_count": store.count(),
+        "asassn_count": 0,  # ASASSNデータはこのDBにはない
+        "neowise_sources": store.source_ids(limit=20),
+        "asassn_sources": []
+    }
 
 
 @app.get("/api/lightcurve/neowise")
 def get_neowise_lightcurve(
+    request: Request,
     source_id: Optional[str] = None,
     ra: Optional[float] = None,
     dec: Optional[float] = None,
-    raw: bool = False
+    raw: bool = False,
+    columnar: bool = False,
+    fmt: Optional[str] = Query(None, alias="format"),
+    max_points: Optional[int] = Query(None, ge=3),
+    downsample: str = "lttb"
 ):
     """
     NEOWISEライトカーブを取得
@@ -136,118 +469,85 @@ def get_neowise_lightcurve(
     - source_id: 天体識別子（Gaia DR3 SOURCE_ID）
     - ra, dec: 座標で検索（度単位）
     - raw: True=生データ, False=エポック集約データ（デフォルト）
+    - columnar: True=observationsの代わりにcolumns（mjd[], w1_mag[], ...）で返す
+    - format: json / arrow / msgpack / binary（省略時はAcceptヘッダーで決定）
+    - max_points: 指定するとバンドごとにこの点数以下へダウンサンプリング（プロット用）
+    - downsample: ダウンサンプリング方式 lttb（デフォルト）/ minmax / epoch
     """
     if not source_id and (ra is None or dec is None):
         raise HTTPException(
             status_code=400,
             detail="source_id または (ra, dec) のいずれかを指定してください"
         )
+    validate_downsample_method(downsample)
     
-    conn = get_db_connection()
-    
-    try:
-        # 座標で検索する場合、最も近い天体を探す
-        if not source_id and ra is not None and dec is not None:
-            sources = pd.read_sql_query("SELECT * FROM sources", conn)
-            if sources.empty:
-                raise HTTPException(status_code=404, detail="データベースに天体が登録されていません")
-            
-            # 簡易的な距離計算（小角度近似）
-            sources['distance'] = ((sources['ra'] - ra)**2 + (sources['dec'] - dec)**2)**0.5
-            closest = sources.loc[sources['distance'].idxmin()]
-            
-            # 3秒角（0.00083度）以内であればマッチとみなす
-            if closest['distance'] > 0.00083:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"指定された座標(RA={ra}, Dec={dec})の近くに天体が見つかりませんでした"
-                )
-            
-            source_id = closest['source_id']
-        
-        # 天体情報を取得（source_idを文字列と整数の両方で検索）
-        source = pd.read_sql_query(
-            "SELECT * FROM sources WHERE source_id = ? OR CAST(source_id AS TEXT) = ?", 
-            conn, params=[source_id, str(source_id)]
-        )
+    fmt = negotiate_format(request.headers.get("accept"), fmt)
+    store = get_store()
+    
+    # 座標で検索する場合、最も近い天体を探す
+    if not source_id and ra is not None and dec is not None:
+        with phase("match"):
+            index = get_source_index()
+            # 空間インデックスで3秒角以内の最近傍天体を検索（角距離で判定）
+            position = index.nearest(ra, dec) if len(index) else None
+        if len(index) == 0:
+            raise HTTPException(status_code=404, detail="データベースに天体が登録されていません")
         
-        if source.empty:
+        if position is None:
             raise HTTPException(
-                status_code=404, 
-                detail=f"指定されたsource_idの天体が見つかりません: {source_id}"
+                status_code=404,
+                detail=f"指定された座標(RA={ra}, Dec={dec})の近くに天体が見つかりませんでした"
             )
         
-        source_info = source.iloc[0]
-        
-        if raw:
-            # 生データを取得（source_idを文字列と整数の両方で検索）
-            actual_source_id = source.iloc[0]['source_id']
-            data = pd.read_sql_query("""
-                SELECT mjd, band, mpro_corrected as mag, sigmpro as mag_err
-                FROM neowise_raw_observations
-                WHERE source_id = ?
-                ORDER BY mjd
-            """, conn, params=[actual_source_id])
-        else:
-            # エポック集約データを取得
-            actual_source_id = source.iloc[0]['source_id']
-            data = pd.read_sql_query("""
-                SELECT mjd_mean as mjd, band, mag_mean as mag, mag_se as mag_err
-                FROM neowise_epoch_summary
-                WHERE source_id = ?
-                ORDER BY mjd_mean
-            """, conn, params=[actual_source_id])
-        
-        # フロントエンド互換形式に変換
-        # W1とW2のデータを統合してobservations配列を作成
-        observations = []
-        
-        # W1データを取得
-        w1_data = data[data['band'] == 'W1'].reset_index(drop=True)
-        # W2データを取得
-        w2_data = data[data['band'] == 'W2'].reset_index(drop=True)
-        
-        # MJDでマージ（または個別に追加）
-        all_mjds = sorted(set(w1_data['mjd'].tolist() + w2_data['mjd'].tolist()))
-        
-        for mjd in all_mjds:
-            w1_row = w1_data[w1_data['mjd'] == mjd]
-            w2_row = w2_data[w2_data['mjd'] == mjd]
-            
-            obs = {"mjd": mjd}
-            
-            if not w1_row.empty:
-                obs["w1_mag"] = float(w1_row['mag'].iloc[0]) if pd.notna(w1_row['mag'].iloc[0]) else None
-                obs["w1_err"] = float(w1_row['mag_err'].iloc[0]) if pd.notna(w1_row['mag_err'].iloc[0]) else None
-            else:
-                obs["w1_mag"] = None
-                obs["w1_err"] = None
-            
-            if not w2_row.empty:
-                obs["w2_mag"] = float(w2_row['mag'].iloc[0]) if pd.notna(w2_row['mag'].iloc[0]) else None
-                obs["w2_err"] = float(w2_row['mag_err'].iloc[0]) if pd.notna(w2_row['mag_err'].iloc[0]) else None
-            else:
-                obs["w2_mag"] = None
-                obs["w2_err"] = None
-            
-            # W1またはW2のいずれかにデータがある場合のみ追加
-            if obs["w1_mag"] is not None or obs["w2_mag"] is not None:
-                observations.append(obs)
-        
-        # allwise_cntrを取得
-        allwise_id = str(source_info.get('allwise_cntr', '')) if pd.notna(source_info.get('allwise_cntr', None)) else ''
-        
-        return {
-            "source_id": str(source_id),
-            "ra": float(source_info['ra']),
-            "dec": float(source_info['dec']),
-            "allwise_id": allwise_id,
-            "num_observations": len(observations),
-            "observations": observations
-        }
-        
-    finally:
-        conn.close()
+        source_id = index.ids[position]
+    
+    if not raw and max_points is None:
+        # 結合済みのライトカーブを保存しているストア（ColumnarStore）は、
+        # memmapのスライスをそのままレスポンスに書き出す（SQL・pandasを通らない）
+        found = store.lightcurve_arrays(str(source_id))
+        if found is not None:
+            source_info, arrays = found
+            metadata = neowise_metadata(source_id, source_info, len(arrays['mjd']))
+            if fmt != "json":
+                with phase("serialize"):
+                    return columns_response(arrays, fmt, metadata, NEOWISE_COLUMNS)
+            with phase("merge"):
+                return lightcurve_response(
+                    metadata, {col: array_to_list(values) for col, values in arrays.items()}, columnar
+                )
+    
+    # 天体情報を取得
+    source = store.sources([str(source_id)])
+    
+    if source.empty:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"指定されたsource_idの天体が見つかりません: {source_id}"
+        )
+    
+    source_info = source.iloc[0]
+    
+    actual_source_id = source_info['source_id']
+    if max_points is not None:
+        with phase("downsample"):
+            data = load_downsampled_neowise_data(store, actual_source_id, raw, max_points, downsample)
+    else:
+        data = load_neowise_data(store, actual_source_id, raw)
+    
+    if fmt != "json":
+        # バイナリ形式は結合済みの列をそのまま書き出す
+        with phase("merge"):
+            merged = merge_neowise_bands(data)
+        with phase("serialize"):
+            return columns_response(
+                {col: merged[col].to_numpy() for col in NEOWISE_COLUMNS},
+                fmt,
+                neowise_metadata(source_id, source_info, len(merged)),
+                NEOWISE_COLUMNS
+            )
+    
+    with phase("merge"):
+        return build_neowise_response(source_id, source_info, data, columnar)
 
 
 @app.get("/api/lightcurve/asassn")
@@ -264,99 +564,268 @@ def get_asassn_lightcurve(
     # ASASSNデータはこのDBにはないので、空のデータを返す
     # エラーではなく、空のデータとして返す（フロントエンドの並行取得に対応）
     
-    conn = get_db_connection()
+    store = get_store()
     
-    try:
-        # source_idが指定されている場合、その天体情報を取得
-        if source_id:
-            source = pd.read_sql_query(
-                "SELECT * FROM sources WHERE source_id = ? OR CAST(source_id AS TEXT) = ?", 
-                conn, params=[source_id, str(source_id)]
-            )
-            
-            if not source.empty:
-                source_info = source.iloc[0]
-                return {
-                    "source_id": str(source_id),
-                    "ra": float(source_info['ra']),
-                    "dec": float(source_info['dec']),
-                    "gaia_id": str(source_id),
-                    "num_observations": 0,
-                    "observations": []
-                }
-        
-        # 座標検索の場合
-        if ra is not None and dec is not None:
-            sources = pd.read_sql_query("SELECT * FROM sources", conn)
-            if not sources.empty:
-                sources['distance'] = ((sources['ra'] - ra)**2 + (sources['dec'] - dec)**2)**0.5
-                closest = sources.loc[sources['distance'].idxmin()]
-                
-                if closest['distance'] <= 0.00083:
-                    return {
-                        "source_id": str(closest['source_id']),
-                        "ra": float(closest['ra']),
-                        "dec": float(closest['dec']),
-                        "gaia_id": str(closest['source_id']),
-                        "num_observations": 0,
-                        "observations": []
-                    }
+    # source_idが指定されている場合、その天体情報を取得
+    if source_id:
+        source = store.sources([str(source_id)])
         
+        if not source.empty:
+            source_info = source.iloc[0]
+            return {
+                "source_id": str(source_id),
+                "ra": float(source_info['ra']),
+                "dec": float(source_info['dec']),
+                "gaia_id": str(source_id),
+                "num_observations": 0,
+                "observations": []
+            }
+    
+    # 座標検索の場合
+    if ra is not None and dec is not None:
+        with phase("match"):
+            index = get_source_index()
+            position = index.nearest(ra, dec)
+        if position is not None:
+            return {
+                "source_id": str(index.ids[position]),
+                "ra": float(index.ra[position]),
+                "dec": float(index.dec[position]),
+                "gaia_id": str(index.ids[position]),
+                "num_observations": 0,
+                "observations": []
+            }
+    
+    raise HTTPException(
+        status_code=404,
+        detail="ASASSNデータはこのデータベースには含まれていません"
+    )
+
+
+@app.post("/api/lightcurve/{survey}/batch")
+def get_lightcurves_batch(survey: str, request: BatchLightcurveRequest):
+    """
+    複数天体のライトカーブを1回のリクエストでまとめて取得
+    
+    source_idと座標（3秒角以内の最近傍）を混在して指定でき、
+    天体情報と観測データはそれぞれストアから1回で取得する
+    
+    Parameters:
+    - survey: neowise または asassn
+    - source_ids: 天体識別子のリスト
+    - coordinates: 座標（{ra, dec}）のリスト
+    - raw, columnar, max_points, downsample: 単体取得APIと同じ
+    """
+    if survey not in ("neowise", "asassn"):
+        raise HTTPException(status_code=404, detail=f"未対応のサーベイです: {survey}")
+    validate_downsample_method(request.downsample)
+    
+    num_requested = len(request.source_ids) + len(request.coordinates)
+    if num_requested == 0:
+        raise HTTPException(status_code=400, detail="source_ids または coordinates を指定してください")
+    if num_requested > MAX_BATCH_SIZE:
         raise HTTPException(
-            status_code=404,
-            detail="ASASSNデータはこのデータベースには含まれていません"
+            status_code=400,
+            detail=f"一度に取得できる天体数は{MAX_BATCH_SIZE}までです（指定数: {num_requested}）"
         )
-        
-    finally:
-        conn.close()
+    
+    store = get_store()
+    
+    # 座標を空間インデックスでsource_idに解決
+    requested = [(source_id, source_id) for source_id in request.source_ids]
+    not_found = []
+    if request.coordinates:
+        with phase("match"):
+            index = get_source_index()
+            positions = index.nearest_many(
+                [c.ra for c in request.coordinates], [c.dec for c in request.coordinates]
+            )
+        for coord, position in zip(request.coordinates, positions):
+            if position < 0:
+                not_found.append({"ra": coord.ra, "dec": coord.dec})
+            else:
+                requested.append((str(index.ids[position]), {"ra": coord.ra, "dec": coord.dec}))
+    
+    # 天体情報を一括取得
+    id_list = sorted({str(source_id) for source_id, _ in requested})
+    sources = store.sources(id_list)
+    
+    # 観測データを一括取得
+    groups = {}
+    if survey == "neowise" and not sources.empty:
+        data = store.neowise(list(sources.index), request.raw)
+        with phase("merge"):
+            groups = {source_id: group for source_id, group in data.groupby('source_id', sort=False)}
+    
+    empty = pd.DataFrame(columns=['mjd', 'band', 'mag', 'mag_err'])
+    lightcurves = []
+    for source_id, query in requested:
+        if source_id not in sources.index:
+            not_found.append(query)
+            continue
+        source_info = sources.loc[source_id]
+        if survey == "neowise":
+            data = groups.get(source_id, empty)
+            if request.max_points is not None:
+                with phase("downsample"):
+                    data = downsample_frame(data, request.max_points, request.downsample)
+            with phase("merge"):
+                lightcurves.append(build_neowise_response(source_id, source_info, data, request.columnar))
+        else:
+            # ASASSNデータはこのDBにはないので、天体情報のみ返す
+            lightcurves.append({
+                "source_id": source_id,
+                "ra": float(source_info['ra']),
+                "dec": float(source_info['dec']),
+                "gaia_id": source_id,
+                "num_observations": 0,
+                "observations": []
+            })
+    
+    return {
+        "survey": survey,
+        "num_requested": num_requested,
+        "num_found": len(lightcurves),
+        "lightcurves": lightcurves,
+        "not_found": not_found
+    }
 
 
 @app.get("/api/neowise/raw/{source_id}")
-def get_neowise_raw_data(source_id: str):
+def get_neowise_raw_data(
+    request: Request,
+    source_id: str,
+    fmt: Optional[str] = Query(None, alias="format")
+):
     """
     NEOWISE生データを取得（フィルタリング用）
     
     Parameters:
     - source_id: 天体識別子
+    - format: json / arrow / msgpack / binary（省略時はAcceptヘッダーで決定）
     """
-    conn = get_db_connection()
-    
-    try:
-        data = pd.read_sql_query("""
-            SELECT mjd, band, mpro, sigmpro, mpro_corrected,
-                   cc_flags, ph_qual, moon_masked, sso_flg,
-                   qi_fact, saa_sep, sat, rchi2, qual_frame
-            FROM neowise_raw_observations
-            WHERE source_id = ?
-            ORDER BY mjd
-        """, conn, params=[source_id])
-        
-        if data.empty:
-            raise HTTPException(
-                status_code=404, 
-                detail=f"生データが見つかりません: {source_id}"
+    fmt = negotiate_format(request.headers.get("accept"), fmt)
+    store = get_store()
+    
+    data = store.raw_observations([source_id], RAW_RESPONSE_COLUMNS)
+    data = data.drop(columns='source_id').reset_index(drop=True)
+    
+    if data.empty:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"生データが見つかりません: {source_id}"
+        )
+    
+    with phase("serialize"):
+        if fmt != "json":
+            return columns_response(
+                {col: data[col].to_numpy() for col in data.columns},
+                fmt,
+                {"source_id": source_id, "count": len(data)},
+                RAW_RESPONSE_NUMERIC_COLUMNS
             )
-        
-        return {
-            "source_id": source_id,
-            "count": len(data),
-            "data": data.to_dict(orient='records')
-        }
-        
-    finally:
-        conn.close()
+        records = data.to_dict(orient='records')
+    
+    return {
+        "source_id": source_id,
+        "count": len(data),
+        "data": records
+    }
+
+
+@app.get("/api/neowise/epochs/{source_id}")
+def get_neowise_epochs(source_id: str, filters: EpochFilter = Depends()):
+    """
+    指定した品質カットでエポック集約をやり直したライトカーブを取得
+    
+    保存済みの生データ（neowise_raw_observations）から再計算するため、
+    IRSAからの再取得は不要。カットは全てクエリパラメータで指定する（EpochFilter参照）
+    """
+    results = reaggregate_epochs(get_store(), [source_id], filters)
+    
+    if source_id not in results:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"生データが見つかりません: {source_id}"
+        )
+    
+    return {
+        "source_id": source_id,
+        "filter_hash": filters.cache_key(),
+        "filter": filters.model_dump(),
+        "num_epochs": len(results[source_id]),
+        "epochs": results[source_id]
+    }
+
+
+@app.post("/api/neowise/epochs")
+def get_neowise_epochs_batch(request: EpochBatchRequest):
+    """
+    複数天体のエポック集約を、同じ品質カットでまとめてやり直す
+    """
+    if len(request.source_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一度に取得できる天体数は{MAX_BATCH_SIZE}までです（指定数: {len(request.source_ids)}）"
+        )
+    
+    results = reaggregate_epochs(get_store(), request.source_ids, request.filter)
+    
+    return {
+        "filter_hash": request.filter.cache_key(),
+        "filter": request.filter.model_dump(),
+        "num_found": len(results),
+        "results": [
+            {"source_id": source_id, "num_epochs": len(results[source_id]), "epochs": results[source_id]}
+            for source_id in request.source_ids if source_id in results
+        ],
+        "not_found": [source_id for source_id in request.source_ids if source_id not in results]
+    }
+
+
+@app.post("/api/admin/reload")
+def reload_database():
+    """
+    DBファイル差し替え後にストア（コネクションプール・開いているファイル）と空間インデックスを再構築
+    
+    ファイルの差し替えは自動でも検出されるが、明示的に再接続させたい場合に使用する
+    """
+    store = get_store()
+    store.reload()
+    response_cache.clear()
+    downsample_cache.clear()
+    epoch_cache.clear()
+    index = refresh_source_index(force=True)
+    return {
+        "status": "reloaded",
+        "sources": len(index),
+        "store": store.describe()
+    }
 
 
 @app.get("/health")
 def health_check():
     """ヘルスチェック"""
+    store = get_store().describe() if DB_PATH and Path(DB_PATH).exists() else {}
     return {
         "status": "ok",
         "database": DB_PATH,
-        "database_exists": Path(DB_PATH).exists() if DB_PATH else False
+        "database_exists": Path(DB_PATH).exists() if DB_PATH else False,
+        "store": store.get("type"),
+        "schema_version": store.get("schema_version"),
+        "pool": store.get("pool"),
+        "response_cache": response_cache.stats(),
+        "downsample_cache": downsample_cache.stats(),
+        "epoch_cache": epoch_cache.stats()
     }
 
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus形式のメトリクス（ルートごとのレイテンシ・SQLの文ごとの所要時間・キャッシュのヒット率など）"""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
     print("=" * 60)
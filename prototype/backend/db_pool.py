@@ -0,0 +1,134 @@
+"""
+読み取り専用SQLiteコネクションプール
+
+スレッドごとに1本の読み取り専用コネクションを保持し、リクエスト間で再利用する。
+ページキャッシュやスキーマ解析結果を捨てずに済むため、毎回connectするより高速。
+
+DBファイルが差し替えられた場合（inode・更新時刻・サイズの変化）や
+recycle()が呼ばれた場合は世代番号を進め、各スレッドが次回取得時に再接続する。
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+def file_version(path: str) -> Optional[Tuple[int, int, int]]:
+    """ファイルのバージョンスタンプ (inode, 更新時刻, サイズ) を返す（存在しなければNone）"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class ReadOnlyConnectionPool:
+    """
+    スレッドごとの読み取り専用コネクションプール
+
+    Parameters:
+    -----------
+    db_path : str
+        データベースファイルのパス
+    immutable : bool
+        Trueの場合immutable=1で開く（SQLiteによる変更検出・ロックを省略）。
+        差し替えはファイルのバージョンスタンプで検出する
+    mmap_size : int
+        PRAGMA mmap_size（バイト）
+    cache_size_kib : int
+        PRAGMA cache_size（KiB単位）
+    """
+
+    def __init__(self, db_path: str, immutable: bool = False,
+                 mmap_size: int = 256 * 1024 * 1024, cache_size_kib: int = 64 * 1024):
+        self.db_path = str(Path(db_path).resolve())
+        self.immutable = immutable
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._version = file_version(self.db_path)
+
+        # 統計情報
+        self._open_connections = 0
+        self._opened_total = 0
+        self._reused_total = 0
+        self._recycles = 0
+        self._last_recycle = None
+
+    def _uri(self) -> str:
+        uri = Path(self.db_path).as_uri() + "?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        return uri
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._uri(), uri=True)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {-int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _close_local(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            with self._lock:
+                self._open_connections -= 1
+
+    def get(self) -> sqlite3.Connection:
+        """現在のスレッド用のコネクションを取得（必要なら再接続）"""
+        version = file_version(self.db_path)
+        if version != self._version:
+            # DBファイルが差し替えられた
+            self.recycle(version)
+
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.generation == self._generation:
+            with self._lock:
+                self._reused_total += 1
+            return conn
+
+        self._close_local()
+        conn = self._connect()
+        self._local.conn = conn
+        self._local.generation = self._generation
+        with self._lock:
+            self._open_connections += 1
+            self._opened_total += 1
+        return conn
+
+    def recycle(self, version=None):
+        """
+        プールを破棄して次回取得時に再接続させる
+
+        各スレッドのコネクションは、そのスレッドが次にget()した時点で閉じられる
+        """
+        with self._lock:
+            self._generation += 1
+            self._version = version if version is not None else file_version(self.db_path)
+            self._recycles += 1
+            self._last_recycle = time.time()
+
+    def stats(self) -> dict:
+        """プールの統計情報"""
+        with self._lock:
+            return {
+                "database": self.db_path,
+                "immutable": self.immutable,
+                "mmap_size": self.mmap_size,
+                "cache_size_kib": self.cache_size_kib,
+                "generation": self._generation,
+                "open_connections": self._open_connections,
+                "opened_total": self._opened_total,
+                "reused_total": self._reused_total,
+                "recycles": self._recycles,
+                "last_recycle": self._last_recycle,
+            }
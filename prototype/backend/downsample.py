@@ -0,0 +1,146 @@
+"""
+ライトカーブのダウンサンプリング（プロット用）
+
+プロットの横幅は数百ピクセル程度しかないため、数千点の生データを
+max_points点以下に間引いてから返す。いずれの方式もNumPyで処理する。
+
+- lttb   : Largest-Triangle-Three-Buckets。形状を保つ点を選び、全体の最大・最小も必ず残す
+- minmax : 時間で等分したビンごとに最小・最大の点を残す（極値を保存）
+- epoch  : 時間で等分したビンごとに平均する。誤差は伝搬誤差と標準誤差の大きい方
+
+lttb・minmaxは元の観測点をそのまま選ぶため、誤差棒もその点の値が保存される。
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax", "epoch")
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """
+    LTTBで選んだ点のインデックスを返す（xは昇順であること）
+
+    先頭と末尾の点は常に含まれる
+    """
+    num = len(x)
+    if n >= num or n < 3:
+        return np.arange(num)
+
+    # 先頭と末尾を除いた点を n-2 個のバケットに分割
+    edges = np.floor(np.linspace(1, num - 1, n - 1)).astype(np.int64)
+    selected = np.empty(n, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = num - 1
+
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        # 次のバケットの平均点（最後のバケットの次は末尾の点）
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = num - 1, num
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # 前回選んだ点・次バケットの平均点と作る三角形の面積が最大の点を選ぶ
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+def _time_bins(x: np.ndarray, nbins: int) -> np.ndarray:
+    """xの範囲を等分したビン番号（xは昇順、結果も非減少）"""
+    edges = np.linspace(x[0], x[-1], nbins + 1)
+    return np.clip(np.searchsorted(edges, x, side="right") - 1, 0, nbins - 1)
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """時間ビンごとに最小・最大の点のインデックスを返す（xは昇順であること）"""
+    num = len(x)
+    if n >= num:
+        return np.arange(num)
+
+    bin_id = _time_bins(x, max(n // 2, 1))
+    # ビン内でyの昇順に並べ、各ビンの先頭=最小・末尾=最大を取る
+    order = np.lexsort((y, bin_id))
+    starts = np.flatnonzero(np.r_[True, bin_id[1:] != bin_id[:-1]])
+    ends = np.r_[starts[1:] - 1, num - 1]
+    return np.unique(np.concatenate([order[starts], order[ends]]))
+
+
+def epoch_bin(x: np.ndarray, y: np.ndarray, err: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """時間ビンごとに平均した (x, y, err) を返す（xは昇順であること）"""
+    if n >= len(x):
+        return x, y, err
+
+    bin_id = _time_bins(x, n)
+    counts = np.bincount(bin_id, minlength=n).astype(np.float64)
+    nonempty = counts > 0
+    counts = counts[nonempty]
+
+    mean_x = np.bincount(bin_id, weights=x, minlength=n)[nonempty] / counts
+    mean_y = np.bincount(bin_id, weights=y, minlength=n)[nonempty] / counts
+
+    # 誤差: 各点の誤差の伝搬と、ビン内のばらつきの標準誤差（ddof=1）の大きい方
+    err = np.nan_to_num(err, nan=0.0)
+    propagated = np.sqrt(np.bincount(bin_id, weights=err**2, minlength=n)[nonempty]) / counts
+    sum_sq = np.bincount(bin_id, weights=(y - np.repeat(mean_y, counts.astype(np.int64)))**2, minlength=n)[nonempty]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        standard_error = np.where(counts > 1, np.sqrt(sum_sq / (counts - 1) / counts), 0.0)
+    return mean_x, mean_y, np.maximum(propagated, standard_error)
+
+
+def downsample(x, y, err, max_points: int, method: str = "lttb") -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    1バンド分のライトカーブをmax_points点以下に間引く
+
+    Parameters:
+    -----------
+    x, y, err : array-like
+        MJD・等級・等級誤差（yが欠損の点は事前に除外しておくこと）
+    max_points : int
+        出力する最大点数
+    method : str
+        'lttb', 'minmax', 'epoch' のいずれか
+
+    Returns:
+    --------
+    tuple
+        (x, y, err) のNumPy配列（xの昇順）
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unknown downsample method: {method}")
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    err = np.asarray(err, dtype=np.float64)
+
+    order = np.argsort(x, kind="stable")
+    x, y, err = x[order], y[order], err[order]
+    if len(x) <= max_points:
+        return x, y, err
+
+    if method == "epoch":
+        return epoch_bin(x, y, err, max_points)
+
+    if method == "minmax":
+        indices = minmax_indices(x, y, max_points)
+    else:
+        # 全体の最大・最小を必ず残すため、その2点分を空けておく
+        indices = lttb_indices(x, y, max(max_points - 2, 3))
+        indices = np.unique(np.concatenate([indices, [np.argmin(y), np.argmax(y)]]))
+        if len(indices) > max_points:
+            # max_pointsが3〜4点ではLTTBの点と最大・最小が収まらないため、
+            # 最小・最大 → 先頭・末尾 → LTTBの点 の優先順で max_points 点を選ぶ
+            candidates = np.concatenate([[np.argmin(y), np.argmax(y), 0, len(x) - 1], lttb_indices(x, y, max_points)])
+            _, first = np.unique(candidates, return_index=True)
+            indices = np.sort(candidates[np.sort(first)[:max_points]])
+    return x[indices], y[indices], err[indices]
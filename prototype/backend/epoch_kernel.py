@@ -0,0 +1,251 @@
+"""
+エポック集約カーネル（ベクトル化版）
+
+品質フィルタ通過後の観測点を、グループ（天体×バンド）ごとに
+3σクリッピング → エポック分割（MJDの間隔が epoch_gap 日以上で区切る）
+→ S/N判定 → エポック平均 の順に集約する。
+
+scripts/neowise_to_sqlite.py の _aggregate_band_with_default_filter と同じ手順を、
+全グループ分まとめて並べ替え済み配列上のセグメントごとの集計で計算する。
+Pythonのループやgroupby().agg()のラムダを使わないため、多数の天体を一度に処理できる。
+
+丸めた結果（小数点以下4桁）まで元の関数と一致させるため、和は元の関数と同じ順序で足す:
+pandasの groupby().sum()・mean() はKahanの補正加算、Series.sum()・std() とnumpyの np.sum は
+pairwise summation。NEOWISEの等級は小数点以下3桁なので、エポック平均は4桁目の丸めの
+境界に乗りやすく、足す順序が違うだけで丸めた結果が変わる。
+"""
+
+from typing import Dict
+
+import numpy as np
+
+
+def _segment_starts(flags: np.ndarray) -> np.ndarray:
+    """区切りフラグ（先頭要素はTrue）からセグメント開始位置を返す"""
+    return np.flatnonzero(flags)
+
+
+def _segment_ids(starts: np.ndarray, length: int) -> np.ndarray:
+    """セグメント開始位置から各要素のセグメント番号を返す"""
+    counts = np.diff(np.r_[starts, length])
+    return np.repeat(np.arange(len(starts)), counts)
+
+
+def _count_descending(starts: np.ndarray, counts: np.ndarray):
+    """セグメントを長い順に並べ替える（k番目の要素を持つセグメントが先頭から連続するように）"""
+    order = np.argsort(-counts, kind="stable")
+    return order, starts[order], counts[order]
+
+
+def _active(counts_desc: np.ndarray, k: int) -> int:
+    """長い順のセグメントのうち、k番目（0始まり）の要素を持つものの数"""
+    return int(np.searchsorted(-counts_desc, -k, side="left"))
+
+
+def _sequential_sum(values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """セグメントごとに先頭から順に足した和"""
+    order, starts, counts = _count_descending(starts, counts)
+    total = np.zeros(len(starts))
+    for k in range(int(counts[0]) if len(counts) else 0):
+        m = _active(counts, k)
+        total[:m] += values[starts[:m] + k]
+    result = np.empty(len(starts))
+    result[order] = total
+    return result
+
+
+def _block_sum(values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """8〜128要素のセグメントの和（8本のアキュムレータで足してから残りを順に足す）"""
+    order, starts, counts = _count_descending(starts, counts)
+    lanes = np.arange(8)
+    acc = values[starts[:, None] + lanes]
+    full = counts - counts % 8
+    for offset in range(8, int(full[0]), 8):
+        m = _active(full, offset)
+        acc[:m] += values[starts[:m, None] + offset + lanes]
+    total = ((acc[:, 0] + acc[:, 1]) + (acc[:, 2] + acc[:, 3])) + ((acc[:, 4] + acc[:, 5]) + (acc[:, 6] + acc[:, 7]))
+    for k in range(7):
+        rest = full + k < counts
+        total[rest] += values[starts[rest] + full[rest] + k]
+    result = np.empty(len(starts))
+    result[order] = total
+    return result
+
+
+def _pairwise_sum(values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    セグメントごとの和（np.sum・Series.sum() と同じpairwise summationの順序）
+
+    numpyは8要素未満なら先頭から順に、128要素以下なら8本のアキュムレータで足し、
+    それより長ければ8の倍数で半分に分けて再帰的に足す
+    """
+    result = np.zeros(len(starts))
+    small = counts < 8
+    if small.any():
+        result[small] = _sequential_sum(values, starts[small], counts[small])
+    block = (counts >= 8) & (counts <= 128)
+    if block.any():
+        result[block] = _block_sum(values, starts[block], counts[block])
+    large = counts > 128
+    if large.any():
+        half = counts[large] // 2
+        half -= half % 8
+        result[large] = (_pairwise_sum(values, starts[large], half)
+                         + _pairwise_sum(values, starts[large] + half, counts[large] - half))
+    return result
+
+
+def _kahan_sum(values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """セグメントごとの和（pandasの groupby().sum()・mean() と同じKahanの補正加算）"""
+    order, starts, counts = _count_descending(starts, counts)
+    total = np.zeros(len(starts))
+    compensation = np.zeros(len(starts))
+    for k in range(int(counts[0]) if len(counts) else 0):
+        m = _active(counts, k)
+        y = values[starts[:m] + k] - compensation[:m]
+        t = total[:m] + y
+        c = (t - total[:m]) - y
+        # 無限大を足すと補正値がNaNになる（pandasと同じく0に戻す）
+        compensation[:m] = np.where(np.isnan(c), 0.0, c)
+        total[:m] = t
+    result = np.empty(len(starts))
+    result[order] = total
+    return result
+
+
+def _variance(values: np.ndarray, starts: np.ndarray, counts: np.ndarray, seg: np.ndarray) -> np.ndarray:
+    """セグメントごとの不偏分散（Series.std() と同じ: 平均とのずれの2乗和を n-1 で割る）"""
+    mean = _pairwise_sum(values, starts, counts) / counts
+    sq_dev = _pairwise_sum((mean[seg] - values)**2, starts, counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sq_dev / (counts - 1)
+
+
+def aggregate_epochs(
+    group: np.ndarray,
+    mjd: np.ndarray,
+    mag: np.ndarray,
+    mag_err: np.ndarray,
+    epoch_gap: float = 100.0,
+    clip_sigma: float = 3.0,
+    snr_min: float = 300.0,
+    snr_fallback: float = 10.0,
+    sort_by_mjd: bool = True,
+) -> Dict[str, np.ndarray]:
+    """
+    グループごとのエポック集約
+
+    Parameters:
+    -----------
+    group : np.ndarray of int
+        各観測点のグループ番号（天体×バンド）
+    mjd, mag, mag_err : np.ndarray
+        品質フィルタ・ゼロポイント補正済みの観測点（magが欠損の点は除外しておくこと）
+    epoch_gap : float
+        エポックを区切るMJDの間隔（日）
+    clip_sigma : float
+        グループ内の平均±clip_sigma×標準偏差の外側を除外（0以下で無効）
+    snr_min : float
+        エポックを採用するS/Nの下限
+    snr_fallback : float
+        グループ内にsnr_minを満たすエポックが無い場合に使う下限
+    sort_by_mjd : bool
+        グループ内をMJDで並べ替えるか（Falseなら入力順のままエポックを区切る。
+        neowise_to_sqlite.py と同じく、IRSAから受け取った順に mjd.diff() を取る場合）
+
+    Returns:
+    --------
+    dict
+        group, epoch_id, mjd, mag_mean, mag_se, n_points, snr, mag_lim の配列
+        （groupの昇順、グループ内はエポックの順。epoch_idはグループ内で0から振り直した番号）
+    """
+    group = np.asarray(group, dtype=np.int64)
+    mjd = np.asarray(mjd, dtype=np.float64)
+    mag = np.asarray(mag, dtype=np.float64)
+    mag_err = np.asarray(mag_err, dtype=np.float64)
+
+    empty = {
+        "group": np.empty(0, dtype=np.int64),
+        "epoch_id": np.empty(0, dtype=np.int64),
+        "mjd": np.empty(0),
+        "mag_mean": np.empty(0),
+        "mag_se": np.empty(0),
+        "n_points": np.empty(0, dtype=np.int64),
+        "snr": np.empty(0),
+        "mag_lim": np.empty(0),
+    }
+    if len(mjd) == 0:
+        return empty
+
+    # グループ→MJDの順に並べ替え（同一MJDは入力順を保つ）
+    if sort_by_mjd:
+        order = np.lexsort((mjd, group))
+    else:
+        order = np.argsort(group, kind="stable")
+    group, mjd, mag, mag_err = group[order], mjd[order], mag[order], mag_err[order]
+
+    # 1. グループごとの3σクリッピング（標準偏差はddof=1、0またはNaNならクリップしない）
+    if clip_sigma > 0:
+        starts = _segment_starts(np.r_[True, group[1:] != group[:-1]])
+        counts = np.diff(np.r_[starts, len(mag)])
+        seg = _segment_ids(starts, len(mag))
+        mean = _pairwise_sum(mag, starts, counts) / counts
+        std = np.sqrt(_variance(mag, starts, counts, seg))
+        no_clip = ~(std > 0)  # std == 0 または NaN
+        lower = (mean - clip_sigma * std)[seg]
+        upper = (mean + clip_sigma * std)[seg]
+        keep = no_clip[seg] | ((mag >= lower) & (mag <= upper))
+        group, mjd, mag, mag_err = group[keep], mjd[keep], mag[keep], mag_err[keep]
+        if len(mjd) == 0:
+            return empty
+
+    # 2. フラックス計算
+    flux = 10**(-0.4 * mag)
+    flux_error = flux * (10**(0.4 * mag_err) - 1)
+    flux_error_sq = np.nan_to_num(flux_error**2, nan=0.0)
+
+    # 3. エポック分割（グループの境界、またはMJD間隔がepoch_gap以上）
+    new_group = np.r_[True, group[1:] != group[:-1]]
+    new_epoch = new_group | np.r_[True, np.diff(mjd) >= epoch_gap]
+    epoch_starts = _segment_starts(new_epoch)
+    epoch_seg = _segment_ids(epoch_starts, len(mjd))
+    n_points = np.diff(np.r_[epoch_starts, len(mjd)])
+    epoch_group = group[epoch_starts]
+
+    # グループ内のエポック番号（0から）
+    group_first_epoch = np.maximum.accumulate(np.where(new_group[epoch_starts], np.arange(len(epoch_starts)), 0))
+    epoch_id = np.arange(len(epoch_starts)) - group_first_epoch
+
+    # 4. エポックごとの集計
+    flux_sum = _kahan_sum(flux, epoch_starts, n_points)
+    flux_error_sq_sum = _pairwise_sum(flux_error_sq, epoch_starts, n_points)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        snr = flux_sum / np.sqrt(flux_error_sq_sum)
+
+    # 5. S/N判定（グループ内にsnr_minを満たすエポックが無ければsnr_fallbackに緩和）
+    group_starts = _segment_starts(np.r_[True, epoch_group[1:] != epoch_group[:-1]])
+    group_has_good = np.maximum.reduceat((snr >= snr_min).astype(np.int8), group_starts).astype(bool)
+    threshold = np.where(group_has_good, snr_min, snr_fallback)[_segment_ids(group_starts, len(snr))]
+    good = snr >= threshold
+
+    # 6. エポック平均
+    mjd_mean = _kahan_sum(mjd, epoch_starts, n_points) / n_points
+    mag_mean = _kahan_sum(mag, epoch_starts, n_points) / n_points
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mag_se = np.where(
+            n_points > 1, np.sqrt(_variance(mag, epoch_starts, n_points, epoch_seg)) / np.sqrt(n_points), 0.0
+        )
+        flux_mean = flux_sum / n_points
+        ratio = (flux_mean - np.sqrt(flux_error_sq_sum) / n_points) / flux_mean
+        mag_lim = -2.5 * np.log10(ratio)
+
+    return {
+        "group": epoch_group[good],
+        "epoch_id": epoch_id[good],
+        "mjd": mjd_mean[good],
+        "mag_mean": mag_mean[good],
+        "mag_se": mag_se[good],
+        "n_points": n_points[good],
+        "snr": snr[good],
+        "mag_lim": mag_lim[good],
+    }
@@ -0,0 +1,965 @@
+"""
+ライトカーブデータの保存形式（ストア）の共通インターフェース
+
+app.py（天体ごとのJSON）と app_custom.py（SQLite）は、同じ形のデータ
+（天体情報 + 観測・エポックの縦持ちの表）を保存形式ごとの読み方で読んでいた。
+LightcurveStore はこの読み出しを共通化し、どちらのAPIも任意の保存形式から配信できるようにする。
+
+- SQLiteStore: neowise_to_sqlite.py のDB（v1）と migrate_neowise_db.py で変換したDB（v2）
+- JSONStore: data/neowise の天体ごとのJSON（観測点のみで、生データ・フラグは持たない）
+- ParquetStore: scripts/convert_to_parquet.py で作成する、HEALPixピクセルで分割したParquetデータセット
+- ColumnarStore: scripts/export_columnar.py で作成する、列ごとの平坦なファイル + 天体ごとのオフセット
+  （numpy.memmapで読む。ライトカーブ1天体分はファイルのスライスそのもの）
+
+open_store() はパスから保存形式を判別する
+（ファイル → SQLite、manifest.json があるディレクトリ → manifest の format で Parquet / 列ファイル、
+それ以外のディレクトリ → JSON）。
+
+読み出し（SQLiteはSQLの文ごと）の所要時間・行数は metrics.py のヒストグラムに記録する（/metrics）。
+
+どのストアも、観測・エポックは v1 の列名（source_id, mjd, band='W1'/'W2', ...）で
+source_id・MJDの昇順に返し、天体情報は source_id をインデックスとするDataFrameで返す。
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from db_pool import ReadOnlyConnectionPool, file_version
+from metrics import observe_query
+from spatial_index import SkyIndex
+
+# pyarrowは利用可能な場合のみインポート（ParquetStoreで使用）
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# 天体情報の列
+SOURCE_COLUMNS = ["source_id", "ra", "dec", "allwise_cntr"]
+
+# 生データ（neowise_raw_observations）の列（source_idを除く）
+RAW_COLUMNS = [
+    "mjd", "band", "mpro", "sigmpro", "cc_flags", "ph_qual", "moon_masked", "sso_flg",
+    "qi_fact", "saa_sep", "sat", "rchi2", "qual_frame", "sky", "scan_id", "mpro_corrected"
+]
+
+# エポック集約（neowise_epoch_summary）の列（source_idを除く）
+EPOCH_COLUMNS = ["band", "epoch_id", "mjd_mean", "mag_mean", "mag_se", "mag_lim", "n_points", "snr", "filter_applied"]
+
+# NEOWISEライトカーブのレスポンス列
+NEOWISE_COLUMNS = ["mjd", "w1_mag", "w1_err", "w2_mag", "w2_err"]
+
+# epoch_mjd_integral() でmjd_meanの型を調べる天体数
+EPOCH_DTYPE_SAMPLE = 100
+
+# ファイルインデックスの差分更新間隔（秒）
+INDEX_REFRESH_INTERVAL = 10.0
+
+# Parquetデータセットの構成（scripts/convert_to_parquet.py が作成）
+PARQUET_MANIFEST = "manifest.json"
+PARQUET_SOURCES = "sources.parquet"
+PARQUET_TABLES = {"raw": "raw", "epoch": "epochs"}
+PARQUET_FORMAT = "neowise-lightcurves-parquet"
+
+# 列ファイルのデータセットの構成（scripts/export_columnar.py が作成、manifest.json はParquetと同じ名前）
+COLUMNAR_FORMAT = "neowise-lightcurves-columnar"
+COLUMNAR_SOURCES = "sources"
+COLUMNAR_TABLES = {"raw": "raw", "epoch": "epochs", "lightcurve": "lightcurve"}
+COLUMNAR_OFFSETS = "offsets"
+COLUMNAR_SUFFIX = ".bin"
+# 整数列の欠損値、辞書符号化した文字列列の欠損値
+COLUMNAR_INT_MISSING = np.iinfo(np.int64).min
+COLUMNAR_CODE_MISSING = -1
+
+
+def merge_neowise_bands(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    バンド別の観測データ（mjd, band, mag, mag_err）をMJDで外部結合し、
+    1行1MJDのW1/W2横持ち形式に変換する
+
+    同一バンド・同一MJDの重複は最初の行を採用し、W1/W2の両方が欠損した行は除外する
+    """
+    bands = []
+    for band in ['W1', 'W2']:
+        prefix = band.lower()
+        band_data = data.loc[data['band'] == band, ['mjd', 'mag', 'mag_err']].drop_duplicates('mjd')
+        bands.append(band_data.rename(columns={'mag': f'{prefix}_mag', 'mag_err': f'{prefix}_err'}))
+
+    merged = bands[0].merge(bands[1], on='mjd', how='outer').sort_values('mjd', kind='stable')
+    merged = merged[merged['w1_mag'].notna() | merged['w2_mag'].notna()]
+    return merged.reset_index(drop=True)[NEOWISE_COLUMNS]
+
+
+def frame_to_columns(frame: pd.DataFrame) -> dict:
+    """DataFrameを列ごとのリスト（NaNはNone）に変換"""
+    return {
+        col: frame[col].astype(object).where(frame[col].notna(), None).tolist()
+        for col in frame.columns
+    }
+
+
+def array_to_list(values: np.ndarray) -> list:
+    """float配列をリスト（NaNはNone）に変換（frame_to_columnsの1列分と同じ結果）"""
+    missing = np.isnan(values)
+    if not missing.any():
+        return values.tolist()
+    values = values.astype(object)
+    values[missing] = None
+    return values.tolist()
+
+
+def neowise_metadata(source_id, source_info, num_observations: int) -> dict:
+    """レスポンスの天体情報部分（source_id, ra, dec, allwise_id, num_observations）"""
+    # allwise_cntrを取得
+    allwise_id = str(source_info.get('allwise_cntr', '')) if pd.notna(source_info.get('allwise_cntr', None)) else ''
+
+    return {
+        "source_id": str(source_id),
+        "ra": float(source_info['ra']),
+        "dec": float(source_info['dec']),
+        "allwise_id": allwise_id,
+        "num_observations": num_observations
+    }
+
+
+def build_neowise_response(source_id, source_info, data: pd.DataFrame, columnar: bool = False) -> dict:
+    """
+    1天体分の観測データ（mjd, band, mag, mag_err）からフロントエンド互換のレスポンスを作成
+    """
+    # W1とW2のデータをMJDで外部結合してobservations配列を作成
+    merged = merge_neowise_bands(data)
+    return lightcurve_response(neowise_metadata(source_id, source_info, len(merged)), frame_to_columns(merged), columnar)
+
+
+def lightcurve_response(metadata: dict, columns: dict, columnar: bool = False) -> dict:
+    """天体情報と結合済みの列（NEOWISE_COLUMNS → リスト）からフロントエンド互換のレスポンスを作成"""
+    response = dict(metadata)
+    if columnar:
+        # 列指向形式（行ごとのdictを作らない）
+        response["columns"] = columns
+    else:
+        response["observations"] = [
+            dict(zip(NEOWISE_COLUMNS, values)) for values in zip(*(columns[c] for c in NEOWISE_COLUMNS))
+        ]
+    return response
+
+
+def _empty_frame(columns: Sequence[str]) -> pd.DataFrame:
+    return pd.DataFrame({col: pd.Series(dtype=object) for col in columns})
+
+
+def _source_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """天体情報のDataFrameを正規化（source_idは文字列のインデックス、allwise_cntrは欠損を許す整数）"""
+    frame = frame[SOURCE_COLUMNS].copy()
+    frame['source_id'] = frame['source_id'].astype(str)
+    if pd.api.types.is_numeric_dtype(frame['allwise_cntr']):
+        frame['allwise_cntr'] = frame['allwise_cntr'].astype('Int64')
+    return frame.drop_duplicates('source_id').set_index('source_id', drop=False)
+
+
+class LightcurveStore:
+    """
+    ライトカーブのストアの基底クラス
+
+    サブクラスは version, source_ids, count, positions, sources, raw_observations,
+    epoch_summary を実装する。座標検索用の空間インデックスはバージョンごとにキャッシュする
+    """
+
+    kind = "base"
+    # 生データ（フラグ付きの観測）を持つか
+    has_raw = True
+
+    def __init__(self, path):
+        self.path = str(Path(path).resolve())
+        self._sky: Optional[SkyIndex] = None
+        self._sky_version = None
+        self._sky_lock = threading.Lock()
+
+    def version(self) -> Hashable:
+        """データのバージョンスタンプ（内容が変わると変化する。キャッシュのキー）"""
+        raise NotImplementedError
+
+    def source_ids(self, limit: Optional[int] = None) -> List[str]:
+        """登録された天体のsource_id（source_idの昇順、limitが指定されれば先頭limit件）"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        """登録された天体数"""
+        raise NotImplementedError
+
+    def positions(self) -> pd.DataFrame:
+        """全天体の (source_id, ra, dec)"""
+        raise NotImplementedError
+
+    def sources(self, source_ids: Sequence[str]) -> pd.DataFrame:
+        """指定した天体の情報（SOURCE_COLUMNS、インデックスはsource_id。見つからない天体は含まない）"""
+        raise NotImplementedError
+
+    def raw_observations(self, source_ids: Sequence[str], columns: Sequence[str] = RAW_COLUMNS) -> pd.DataFrame:
+        """指定した天体の生データ（source_id + columns、source_id・mjdの昇順）"""
+        raise NotImplementedError
+
+    def epoch_summary(self, source_ids: Sequence[str], columns: Sequence[str] = EPOCH_COLUMNS) -> pd.DataFrame:
+        """指定した天体のエポック集約（source_id + columns、source_id・mjd_meanの昇順）"""
+        raise NotImplementedError
+
+    def epoch_mjd_integral(self) -> bool:
+        """
+        エポックの平均MJD（mjd_mean）を整数で持つか（SQLiteはINTEGER列、JSONは小数）
+
+        変換スクリプトが入力と同じ型で書き出すために使う（先頭の天体のエポックの型で判定する）
+        """
+        frame = self.epoch_summary(self.source_ids(limit=EPOCH_DTYPE_SAMPLE), ["mjd_mean"])
+        return pd.api.types.is_integer_dtype(frame["mjd_mean"])
+
+    def neowise(self, source_ids: Sequence[str], raw: bool) -> pd.DataFrame:
+        """
+        ライトカーブ用の観測データ（source_id, mjd, band, mag, mag_err）
+
+        raw=Trueなら生データ（補正後の等級）、Falseならエポック集約
+        """
+        if raw:
+            data = self.raw_observations(source_ids, ["mjd", "band", "mpro_corrected", "sigmpro"])
+            data = data.rename(columns={"mpro_corrected": "mag", "sigmpro": "mag_err"})
+        else:
+            data = self.epoch_summary(source_ids, ["mjd_mean", "band", "mag_mean", "mag_se"])
+            data = data.rename(columns={"mjd_mean": "mjd", "mag_mean": "mag", "mag_se": "mag_err"})
+        return data[["source_id", "mjd", "band", "mag", "mag_err"]]
+
+    def sky_index(self, force: bool = False) -> SkyIndex:
+        """座標検索用の空間インデックス（データが更新されていれば再構築）"""
+        version = self.version()
+        with self._sky_lock:
+            if force or self._sky is None or self._sky_version != version:
+                frame = self.positions()
+                self._sky = SkyIndex(frame['source_id'].astype(str).tolist(), frame['ra'], frame['dec'])
+                self._sky_version = version
+            return self._sky
+
+    def find(self, source_id: Optional[str] = None, ra: Optional[float] = None,
+             dec: Optional[float] = None) -> Optional[str]:
+        """source_idまたは座標（3秒角以内の最近傍）で天体を検索し、保存されているsource_idを返す"""
+        if source_id:
+            found = self.sources([str(source_id)])
+            return None if found.empty else str(found.index[0])
+        if ra is not None and dec is not None:
+            index = self.sky_index()
+            position = index.nearest(ra, dec)
+            if position is not None:
+                return str(index.ids[position])
+        return None
+
+    def file_path(self, source_id: str) -> Optional[Path]:
+        """天体のライトカーブをそのまま配信できるファイル（無ければNone）"""
+        return None
+
+    def lightcurve_arrays(self, source_id: str) -> Optional[Tuple[dict, Dict[str, np.ndarray]]]:
+        """
+        W1/W2を結合済みのライトカーブ（エポック集約）を保存しているストアなら、
+        (天体情報, NEOWISE_COLUMNS → 配列) を返す（それ以外のストア・見つからない天体はNone）
+        """
+        return None
+
+    def lightcurves(self, source_ids: Sequence[str]) -> Dict[str, dict]:
+        """
+        フロントエンド互換のライトカーブ（エポック集約）をまとめて作成
+
+        Returns:
+        --------
+        dict
+            source_id → レスポンス（見つからない天体は含まない）
+        """
+        source_ids = [str(source_id) for source_id in source_ids]
+        sources = self.sources(source_ids)
+        if sources.empty:
+            return {}
+        data = self.neowise(list(sources.index), raw=False)
+        groups = {source_id: group for source_id, group in data.groupby('source_id', sort=False)}
+        empty = _empty_frame(['mjd', 'band', 'mag', 'mag_err'])
+        return {
+            source_id: build_neowise_response(source_id, sources.loc[source_id], groups.get(source_id, empty))
+            for source_id in source_ids if source_id in sources.index
+        }
+
+    def describe(self) -> dict:
+        """ストアの種類・パスなど（/health 用）"""
+        return {"type": self.kind, "path": self.path, "has_raw": self.has_raw}
+
+    def reload(self):
+        """データの差し替え後に、開いているファイル・キャッシュを捨てる"""
+        with self._sky_lock:
+            self._sky = None
+            self._sky_version = None
+
+
+# ---------------------------------------------------------------------------
+# SQLite
+# ---------------------------------------------------------------------------
+
+# スキーマのバージョン（PRAGMA user_version）ごとの観測・エポックのテーブル式
+# v2（migrate_neowise_db.py で変換したDB）は整数のsource_key・バンドを持つため、
+# v1と同じ列（source_id, band='W1'/'W2', ...）を返すサブクエリで読む。
+# SQLiteはこのサブクエリを平坦化するので、source_idの条件は
+# sourcesの一意インデックス → 観測テーブルの主キー (source_key, band, mjd) の範囲検索になる
+SCHEMA_V2 = 2
+_V2_BAND = "CASE {alias}.band WHEN 1 THEN 'W1' WHEN 2 THEN 'W2' END"
+NEOWISE_TABLES = {
+    0: {
+        "raw": "neowise_raw_observations",
+        "epoch": "neowise_epoch_summary",
+    },
+    SCHEMA_V2: {
+        "raw": f"""(
+            SELECT s.source_id AS source_id, r.mjd AS mjd, {_V2_BAND.format(alias='r')} AS band,
+                   r.mpro AS mpro, r.sigmpro AS sigmpro, r.cc_flags AS cc_flags, r.ph_qual AS ph_qual,
+                   r.moon_masked AS moon_masked, r.sso_flg AS sso_flg, r.qi_fact AS qi_fact,
+                   r.saa_sep AS saa_sep, r.sat AS sat, r.rchi2 AS rchi2, r.qual_frame AS qual_frame,
+                   r.sky AS sky, r.scan_id AS scan_id, r.mpro_corrected AS mpro_corrected
+            FROM neowise_raw_observations r JOIN sources s ON s.id = r.source_key
+        )""",
+        "epoch": f"""(
+            SELECT s.source_id AS source_id, {_V2_BAND.format(alias='e')} AS band, e.epoch_id AS epoch_id,
+                   e.mjd_mean AS mjd_mean, e.mag_mean AS mag_mean, e.mag_se AS mag_se, e.mag_lim AS mag_lim,
+                   e.n_points AS n_points, e.snr AS snr, e.filter_applied AS filter_applied
+            FROM neowise_epoch_summary e JOIN sources s ON s.id = e.source_key
+        )""",
+    },
+}
+
+
+class SQLiteStore(LightcurveStore):
+    """
+    neowise_to_sqlite.py / migrate_neowise_db.py のSQLiteデータベース
+
+    スレッドごとの読み取り専用コネクション（ReadOnlyConnectionPool）で読む。
+    スキーマ（v1/v2）は PRAGMA user_version で判別し、DBのバージョンスタンプごとにキャッシュする
+
+    Parameters:
+    -----------
+    db_path : str
+        データベースファイルのパス
+    immutable, mmap_size, cache_size_kib :
+        ReadOnlyConnectionPool の設定
+    """
+
+    kind = "sqlite"
+
+    def __init__(self, db_path, immutable: bool = False,
+                 mmap_size: int = 256 * 1024 * 1024, cache_size_kib: int = 64 * 1024):
+        super().__init__(db_path)
+        self.pool = ReadOnlyConnectionPool(
+            self.path, immutable=immutable, mmap_size=mmap_size, cache_size_kib=cache_size_kib
+        )
+        self._schema_version = None
+        self._schema_version_stamp = None
+
+    def connection(self):
+        """スレッドごとの読み取り専用コネクション（closeしないこと）"""
+        return self.pool.get()
+
+    def version(self) -> Hashable:
+        return file_version(self.path)
+
+    def schema_version(self) -> int:
+        """DBのスキーマのバージョン（PRAGMA user_version、v1は0）"""
+        stamp = self.version()
+        if self._schema_version is None or self._schema_version_stamp != stamp:
+            self._schema_version = self.connection().execute("PRAGMA user_version").fetchone()[0]
+            self._schema_version_stamp = stamp
+        return self._schema_version
+
+    def table(self, kind: str) -> str:
+        """観測（raw）・エポック（epoch）のテーブル式（どのスキーマでもv1の列名で読める）"""
+        version = self.schema_version()
+        if version not in NEOWISE_TABLES:
+            raise ValueError(f"unsupported database schema (user_version={version})")
+        return NEOWISE_TABLES[version][kind]
+
+    def source_ids(self, limit: Optional[int] = None) -> List[str]:
+        start = time.perf_counter()
+        rows = self.connection().execute(
+            "SELECT source_id FROM sources ORDER BY source_id LIMIT ?", (-1 if limit is None else limit,)
+        ).fetchall()
+        observe_query(self.kind, "source_ids", start, len(rows))
+        return [str(row[0]) for row in rows]
+
+    def count(self) -> int:
+        start = time.perf_counter()
+        count = self.connection().execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+        observe_query(self.kind, "count", start, 1)
+        return count
+
+    def positions(self) -> pd.DataFrame:
+        start = time.perf_counter()
+        frame = pd.read_sql_query("SELECT source_id, ra, dec FROM sources", self.connection())
+        observe_query(self.kind, "positions", start, len(frame))
+        return frame
+
+    def sources(self, source_ids: Sequence[str]) -> pd.DataFrame:
+        # json_eachでIDリストを1パラメータとして渡す
+        start = time.perf_counter()
+        frame = pd.read_sql_query("""
+            SELECT source_id, ra, dec, allwise_cntr FROM sources
+            WHERE source_id IN (SELECT value FROM json_each(?))
+        """, self.connection(), params=[json.dumps([str(s) for s in source_ids])])
+        observe_query(self.kind, "sources", start, len(frame))
+        return _source_frame(frame)
+
+    def _read(self, kind: str, source_ids: Sequence[str], columns: Sequence[str], mjd_column: str) -> pd.DataFrame:
+        start = time.perf_counter()
+        frame = pd.read_sql_query(f"""
+            SELECT source_id, {', '.join(columns)}
+            FROM {self.table(kind)}
+            WHERE source_id IN (SELECT value FROM json_each(?))
+            ORDER BY source_id, {mjd_column}
+        """, self.connection(), params=[json.dumps([str(s) for s in source_ids])])
+        observe_query(self.kind, kind, start, len(frame))
+        frame['source_id'] = frame['source_id'].astype(str)
+        return frame
+
+    def raw_observations(self, source_ids: Sequence[str], columns: Sequence[str] = RAW_COLUMNS) -> pd.DataFrame:
+        return self._read("raw", source_ids, columns, "mjd")
+
+    def epoch_summary(self, source_ids: Sequence[str], columns: Sequence[str] = EPOCH_COLUMNS) -> pd.DataFrame:
+        return self._read("epoch", source_ids, columns, "mjd_mean")
+
+    def describe(self) -> dict:
+        return dict(super().describe(), schema_version=self.schema_version(), pool=self.pool.stats())
+
+    def reload(self):
+        super().reload()
+        self.pool.recycle()
+        self._schema_version = None
+
+
+# ---------------------------------------------------------------------------
+# JSON（天体ごとのファイル）
+# ---------------------------------------------------------------------------
+
+class IndexEntry(NamedTuple):
+    """ファイルインデックスのエントリ"""
+    source_id: str
+    ra: Optional[float]
+    dec: Optional[float]
+    path: Path
+    size: int
+    mtime_ns: int
+
+
+class LightcurveFileIndex:
+    """
+    ライトカーブJSONファイルのインメモリインデックス
+
+    起動時にディレクトリを一度だけ走査して (source_id, ra, dec, path, size) を保持する。
+    以降は一定間隔ごとに差分更新し、追加・変更されたファイルのみを読み直す。
+    検索時は、一致したファイルを返すまでディスクにアクセスしない。
+    """
+
+    def __init__(self, data_dir: Path, refresh_interval: float = INDEX_REFRESH_INTERVAL):
+        self.data_dir = data_dir
+        self.refresh_interval = refresh_interval
+        self.entries: Dict[str, IndexEntry] = {}
+        self._sky = SkyIndex([], [], [])
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        # 内容が変化するたびに増えるバージョン番号
+        self.version = 0
+        self.refresh()
+
+    def refresh(self):
+        """ディレクトリを走査し、追加・変更・削除されたファイルを反映"""
+        with self._lock:
+            entries: Dict[str, IndexEntry] = {}
+            changed = False
+
+            if self.data_dir.exists():
+                with os.scandir(self.data_dir) as it:
+                    for dir_entry in it:
+                        if not dir_entry.name.endswith(".json") or not dir_entry.is_file():
+                            continue
+                        source_id = dir_entry.name[:-len(".json")]
+                        st = dir_entry.stat()
+                        current = self.entries.get(source_id)
+                        if current is not None and current.size == st.st_size and current.mtime_ns == st.st_mtime_ns:
+                            entries[source_id] = current
+                            continue
+
+                        # 新規または変更されたファイルのみ読み込む
+                        file_ra, file_dec = None, None
+                        try:
+                            with open(dir_entry.path, 'r') as f:
+                                data = json.load(f)
+                            file_ra = data.get('ra')
+                            file_dec = data.get('dec')
+                        except Exception:
+                            pass
+                        entries[source_id] = IndexEntry(
+                            source_id, file_ra, file_dec, Path(dir_entry.path), st.st_size, st.st_mtime_ns
+                        )
+                        changed = True
+
+            if changed or entries.keys() != self.entries.keys():
+                # source_ids() が他のストアと同じくsource_idの昇順になるよう並べておく
+                entries = dict(sorted(entries.items()))
+                located = [e for e in entries.values() if e.ra is not None and e.dec is not None]
+                self._sky = SkyIndex(
+                    [e.source_id for e in located], [e.ra for e in located], [e.dec for e in located]
+                )
+                self.entries = entries
+                self.version += 1
+
+            self._last_refresh = time.monotonic()
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+
+    def current_version(self) -> int:
+        """必要なら差分更新してからバージョン番号を返す"""
+        self._maybe_refresh()
+        return self.version
+
+    def sky_index(self) -> SkyIndex:
+        """座標検索用の空間インデックス（必要なら差分更新してから返す）"""
+        self._maybe_refresh()
+        return self._sky
+
+    def find(self, source_id: str = None, ra: float = None, dec: float = None) -> Optional[IndexEntry]:
+        """
+        source_idまたは座標（最近傍、3秒角以内）でエントリを検索
+        """
+        self._maybe_refresh()
+
+        if source_id:
+            entry = self.entries.get(source_id)
+            if entry is None and (self.data_dir / f"{source_id}.json").exists():
+                # 前回の走査以降に追加されたファイル
+                self.refresh()
+                entry = self.entries.get(source_id)
+            return entry
+
+        if ra is not None and dec is not None:
+            sky = self._sky
+            position = sky.nearest(ra, dec)
+            if position is not None:
+                return self.entries.get(sky.ids[position])
+
+        return None
+
+
+class JSONStore(LightcurveStore):
+    """
+    天体ごとのJSON（data/neowise/{source_id}.json、READMEのNEOWISEデータ形式）
+
+    observations（mjd, w1_mag, w1_err, w2_mag, w2_err）をエポック集約として扱う。
+    生データ・フラグは持たないため、raw_observations は常に空
+    """
+
+    kind = "json"
+    has_raw = False
+
+    def __init__(self, data_dir, refresh_interval: float = INDEX_REFRESH_INTERVAL):
+        super().__init__(data_dir)
+        self.index = LightcurveFileIndex(Path(data_dir), refresh_interval)
+
+    def version(self) -> Hashable:
+        return self.index.current_version()
+
+    def source_ids(self, limit: Optional[int] = None) -> List[str]:
+        ids = list(self.index.entries)
+        return ids if limit is None else ids[:limit]
+
+    def count(self) -> int:
+        return len(self.index.entries)
+
+    def positions(self) -> pd.DataFrame:
+        sky = self.index.sky_index()
+        return pd.DataFrame({'source_id': sky.ids, 'ra': sky.ra, 'dec': sky.dec})
+
+    def sky_index(self, force: bool = False) -> SkyIndex:
+        if force:
+            self.index.refresh()
+        return self.index.sky_index()
+
+    def find(self, source_id: Optional[str] = None, ra: Optional[float] = None,
+             dec: Optional[float] = None) -> Optional[str]:
+        entry = self.index.find(source_id, ra, dec)
+        return entry.source_id if entry else None
+
+    def file_path(self, source_id: str) -> Optional[Path]:
+        entry = self.index.find(source_id=source_id)
+        return entry.path if entry else None
+
+    def documents(self, source_ids: Sequence[str]) -> Dict[str, dict]:
+        """指定した天体のJSONをそのまま読み込む（読めないファイルは含まない）"""
+        start = time.perf_counter()
+        documents = {}
+        for source_id in source_ids:
+            entry = self.index.find(source_id=str(source_id))
+            if entry is None:
+                continue
+            try:
+                with open(entry.path, 'r') as f:
+                    documents[entry.source_id] = json.load(f)
+            except Exception:
+                continue
+        observe_query(self.kind, "documents", start, len(documents))
+        return documents
+
+    def sources(self, source_ids: Sequence[str]) -> pd.DataFrame:
+        rows = [
+            (source_id, doc.get('ra'), doc.get('dec'), doc.get('allwise_id') or None)
+            for source_id, doc in self.documents(source_ids).items()
+        ]
+        return _source_frame(pd.DataFrame(rows, columns=SOURCE_COLUMNS))
+
+    def raw_observations(self, source_ids: Sequence[str], columns: Sequence[str] = RAW_COLUMNS) -> pd.DataFrame:
+        return _empty_frame(["source_id"] + list(columns))
+
+    def epoch_summary(self, source_ids: Sequence[str], columns: Sequence[str] = EPOCH_COLUMNS) -> pd.DataFrame:
+        rows = []
+        for source_id, doc in self.documents(source_ids).items():
+            for epoch_id, obs in enumerate(doc.get('observations', [])):
+                for band in ['W1', 'W2']:
+                    mag = obs.get(f'{band.lower()}_mag')
+                    if mag is None:
+                        continue
+                    rows.append((source_id, band, epoch_id, obs['mjd'], mag, obs.get(f'{band.lower()}_err'),
+                                 None, None, None, None))
+        frame = pd.DataFrame(rows, columns=["source_id"] + EPOCH_COLUMNS)
+        frame = frame.sort_values(['source_id', 'mjd_mean'], kind='stable').reset_index(drop=True)
+        return frame[["source_id"] + list(columns)]
+
+    def lightcurves(self, source_ids: Sequence[str]) -> Dict[str, dict]:
+        # 保存されているJSONをそのまま返す
+        return self.documents(source_ids)
+
+    def reload(self):
+        super().reload()
+        self.index.refresh()
+
+
+# ---------------------------------------------------------------------------
+# Parquet（HEALPixピクセルで分割したデータセット）
+# ---------------------------------------------------------------------------
+
+class ParquetStore(LightcurveStore):
+    """
+    HEALPixピクセル（NESTED方式）で分割したParquetデータセット（scripts/convert_to_parquet.py で作成）
+
+        manifest.json                           nside・行数など（最後に書かれる。バージョンスタンプ）
+        sources.parquet                         天体情報 + healpix
+        raw/healpix=<pixel>/part-0.parquet      生データ（source_id・mjdの昇順）
+        epochs/healpix=<pixel>/part-0.parquet   エポック集約（source_id・mjd_meanの昇順）
+
+    天体情報は開いたときにメモリに読み込み、source_idからピクセルを引く。
+    観測の読み出しは、該当ピクセルのファイル（フラグメント）だけからなる pyarrow.dataset に
+    (source_id ∈ 天体) のフィルタを渡し、行グループの統計値（source_idの最小・最大）で読み飛ばす。
+    （データセット全体に healpix のフィルタを渡すと、全ピクセルのパーティション式を毎回評価するため遅い）
+    """
+
+    kind = "parquet"
+
+    def __init__(self, path):
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("ParquetStore requires pyarrow (pip install pyarrow)")
+        super().__init__(path)
+        self._lock = threading.Lock()
+        self._loaded_version = None
+        self._open()
+
+    def _open(self):
+        root = Path(self.path)
+        with open(root / PARQUET_MANIFEST) as f:
+            self.manifest = json.load(f)
+        self.nside = self.manifest["nside"]
+        self.has_raw = self.manifest.get("has_raw", True)
+
+        sources = pq.read_table(root / PARQUET_SOURCES).to_pandas()
+        self._pixels = pd.Series(sources['healpix'].to_numpy(), index=sources['source_id'].astype(str))
+        self._sources = _source_frame(sources)
+
+        # ピクセル → フラグメント（ファイル）
+        partitioning = ds.partitioning(pa.schema([("healpix", pa.int32())]), flavor="hive")
+        self._datasets = {}
+        self._fragments = {}
+        for kind, name in PARQUET_TABLES.items():
+            if (root / name).is_dir():
+                dataset = ds.dataset(root / name, format="parquet", partitioning=partitioning)
+                self._datasets[kind] = dataset
+                self._fragments[kind] = {
+                    ds.get_partition_keys(fragment.partition_expression)["healpix"]: fragment
+                    for fragment in dataset.get_fragments()
+                }
+        self._loaded_version = file_version(str(root / PARQUET_MANIFEST))
+
+    def version(self) -> Hashable:
+        version = file_version(str(Path(self.path) / PARQUET_MANIFEST))
+        if version != self._loaded_version and version is not None:
+            # 変換し直された（manifest.jsonが書き換えられた）場合は開き直す
+            with self._lock:
+                if version != self._loaded_version:
+                    self._open()
+        return version
+
+    def source_ids(self, limit: Optional[int] = None) -> List[str]:
+        ids = self._sources.index
+        return list(ids if limit is None else ids[:limit])
+
+    def count(self) -> int:
+        return len(self._sources)
+
+    def positions(self) -> pd.DataFrame:
+        return self._sources[['source_id', 'ra', 'dec']].reset_index(drop=True)
+
+    def sources(self, source_ids: Sequence[str]) -> pd.DataFrame:
+        return self._sources[self._sources.index.isin([str(s) for s in source_ids])]
+
+    def _read(self, kind: str, source_ids: Sequence[str], columns: Sequence[str], mjd_column: str) -> pd.DataFrame:
+        start = time.perf_counter()
+        ids = [str(s) for s in source_ids]
+        pixels = self._pixels.reindex(ids).dropna()
+        fragments = self._fragments.get(kind, {})
+        selected = [fragments[p] for p in np.unique(pixels.to_numpy()).astype(int).tolist() if p in fragments]
+        if not selected:
+            return _empty_frame(["source_id"] + list(columns))
+
+        dataset = self._datasets[kind]
+        subset = ds.FileSystemDataset(selected, dataset.schema, dataset.format, dataset.filesystem)
+        table = subset.to_table(columns=["source_id"] + list(columns),
+                                filter=ds.field("source_id").isin(list(pixels.index)))
+        frame = table.to_pandas()
+        # ファイル内はsource_id・MJDの昇順。ピクセルをまたぐ場合のみ並べ直す
+        if len(selected) > 1:
+            frame = frame.sort_values(["source_id", mjd_column], kind="stable").reset_index(drop=True)
+        observe_query(self.kind, kind, start, len(frame))
+        return frame
+
+    def raw_observations(self, source_ids: Sequence[str], columns: Sequence[str] = RAW_COLUMNS) -> pd.DataFrame:
+        return self._read("raw", source_ids, columns, "mjd")
+
+    def epoch_summary(self, source_ids: Sequence[str], columns: Sequence[str] = EPOCH_COLUMNS) -> pd.DataFrame:
+        return self._read("epoch", source_ids, columns, "mjd_mean")
+
+    def describe(self) -> dict:
+        return dict(super().describe(), nside=self.nside, pixels=int(self._pixels.nunique()))
+
+    def reload(self):
+        super().reload()
+        with self._lock:
+            self._open()
+
+
+# ---------------------------------------------------------------------------
+# 列ファイル（numpy.memmap）
+# ---------------------------------------------------------------------------
+
+def _map_column(path: Path, dtype: str, rows: int) -> np.ndarray:
+    """列ファイルを読み取り専用でメモリマップする（0行のファイルはmmapできないので空配列）"""
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+
+class ColumnarStore(LightcurveStore):
+    """
+    列ごとの平坦なファイルと天体ごとのオフセットからなるデータセット（scripts/export_columnar.py で作成）
+
+        manifest.json                       列の型・行数など（最後に書かれる。バージョンスタンプ）
+        sources/source_id.bin               source_id（固定長バイト列、昇順）
+        sources/{ra,dec,allwise_cntr}.bin   天体情報（source_idの順）
+        sources/input_order.bin             入力の順（/api/list の順）に並べた天体の位置
+        <table>/offsets.bin                 天体ごとの行の範囲（int64、天体数 + 1）
+        <table>/<column>.bin                列（リトルエンディアンの固定長）
+
+    table は raw（生データ）、epochs（エポック集約）、lightcurve（W1/W2をMJDで結合済みのライトカーブ）。
+    どのテーブルも天体の行は連続していて、天体 i の行は offsets[i]:offsets[i + 1]。
+    文字列の列は辞書符号化（int32のコード、辞書は <column>.categories.json）、
+    整数列の欠損は COLUMNAR_INT_MISSING で表す。
+
+    全ファイルを numpy.memmap で開き、1天体の読み出しは source_id の二分探索とスライスだけで、
+    SQLite・pandasを通らない。ページはOSのページキャッシュに載るため、
+    複数のuvicornワーカーが同じデータを1つのコピーで共有する（プロセスごとのメモリを消費しない）。
+    """
+
+    kind = "columnar"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._lock = threading.Lock()
+        self._loaded_version = None
+        self._open()
+
+    def _open(self):
+        root = Path(self.path)
+        with open(root / PARQUET_MANIFEST) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != COLUMNAR_FORMAT:
+            raise ValueError(f"not a columnar lightcurve dataset: {self.path}")
+        self.manifest = manifest
+        self.has_raw = manifest.get("has_raw", True)
+        num_sources = manifest["sources"]
+
+        columns = {}
+        categories = {}
+        for table, specs in manifest["columns"].items():
+            rows = num_sources if table == COLUMNAR_SOURCES else manifest["rows"][table]
+            columns[table] = {}
+            categories[table] = {}
+            for name, spec in specs.items():
+                columns[table][name] = _map_column(root / table / f"{name}{COLUMNAR_SUFFIX}", spec["dtype"], rows)
+                if "categories" in spec:
+                    with open(root / table / spec["categories"]) as f:
+                        # 末尾のNoneはコード -1（COLUMNAR_CODE_MISSING）で引かれる
+                        categories[table][name] = np.array(json.load(f) + [None], dtype=object)
+            if table != COLUMNAR_SOURCES:
+                columns[table][COLUMNAR_OFFSETS] = _map_column(
+                    root / table / f"{COLUMNAR_OFFSETS}{COLUMNAR_SUFFIX}", "<i8", num_sources + 1
+                )
+        self._columns = columns
+        self._categories = categories
+        self._ids = columns[COLUMNAR_SOURCES]["source_id"]
+        self._input_order = columns[COLUMNAR_SOURCES]["input_order"]
+        self._loaded_version = file_version(str(root / PARQUET_MANIFEST))
+
+    def version(self) -> Hashable:
+        version = file_version(str(Path(self.path) / PARQUET_MANIFEST))
+        if version != self._loaded_version and version is not None:
+            # 書き出し直された（manifest.jsonが書き換えられた）場合は開き直す
+            with self._lock:
+                if version != self._loaded_version:
+                    self._open()
+        return version
+
+    def _positions(self, source_ids: Sequence[str]) -> np.ndarray:
+        """source_idのソート済み配列での位置（見つからない天体は除き、昇順・重複なし）"""
+        if len(self._ids) == 0 or len(source_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        # 固定長（self._ids.dtype）に変換すると長いsource_idが切り詰められて別の天体に一致するため、
+        # 列の幅より長いsource_idは見つからない天体として除く
+        width = self._ids.dtype.itemsize
+        keys = np.array([key for key in (str(s).encode() for s in source_ids) if len(key) <= width],
+                        dtype=self._ids.dtype)
+        if len(keys) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self._ids, keys), len(self._ids) - 1)
+        return np.unique(positions[self._ids[positions] == keys])
+
+    def _decode(self, table: str, name: str, values: np.ndarray) -> np.ndarray:
+        """列ファイルの値をAPIの値に戻す（辞書符号化 → 文字列、整数の欠損 → NaN、バイト列 → 文字列）"""
+        if name in self._categories[table]:
+            return self._categories[table][name][values]
+        if values.dtype.kind == "i":
+            missing = values == COLUMNAR_INT_MISSING
+            if missing.any():
+                values = values.astype(np.float64)
+                values[missing] = np.nan
+            return values
+        if values.dtype.kind == "S":
+            return np.array([v.decode() if v else None for v in values.tolist()], dtype=object)
+        return values
+
+    def source_ids(self, limit: Optional[int] = None) -> List[str]:
+        order = self._input_order if limit is None else self._input_order[:limit]
+        return [source_id.decode() for source_id in self._ids[order].tolist()]
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def _source_columns(self, positions: np.ndarray, names: Sequence[str]) -> dict:
+        table = self._columns[COLUMNAR_SOURCES]
+        return {name: self._decode(COLUMNAR_SOURCES, name, table[name][positions]) for name in names}
+
+    def positions(self) -> pd.DataFrame:
+        return pd.DataFrame(self._source_columns(np.asarray(self._input_order), ['source_id', 'ra', 'dec']))
+
+    def sources(self, source_ids: Sequence[str]) -> pd.DataFrame:
+        frame = pd.DataFrame(self._source_columns(self._positions(source_ids), SOURCE_COLUMNS))
+        return _source_frame(frame)
+
+    def _read(self, table: str, source_ids: Sequence[str], columns: Sequence[str]) -> pd.DataFrame:
+        start = time.perf_counter()
+        positions = self._positions(source_ids)
+        data = self._columns[COLUMNAR_TABLES[table]]
+        offsets = data[COLUMNAR_OFFSETS]
+        starts = offsets[positions]
+        counts = offsets[positions + 1] - starts
+        # 天体ごとの行の範囲を連結した行番号（ソート済みの位置なのでsource_id・MJDの昇順になる）
+        rows = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        frame = {"source_id": np.repeat(self._source_columns(positions, ["source_id"])["source_id"], counts)}
+        for name in columns:
+            frame[name] = self._decode(COLUMNAR_TABLES[table], name, data[name][rows])
+        observe_query(self.kind, table, start, len(rows))
+        return pd.DataFrame(frame, columns=["source_id"] + list(columns))
+
+    def raw_observations(self, source_ids: Sequence[str], columns: Sequence[str] = RAW_COLUMNS) -> pd.DataFrame:
+        return self._read("raw", source_ids, columns)
+
+    def epoch_summary(self, source_ids: Sequence[str], columns: Sequence[str] = EPOCH_COLUMNS) -> pd.DataFrame:
+        return self._read("epoch", source_ids, columns)
+
+    def lightcurve_arrays(self, source_id: str) -> Optional[Tuple[dict, Dict[str, np.ndarray]]]:
+        start = time.perf_counter()
+        positions = self._positions([source_id])
+        if len(positions) == 0:
+            return None
+        position = int(positions[0])
+        source_info = {name: values[0] for name, values in self._source_columns(positions, SOURCE_COLUMNS).items()}
+        data = self._columns[COLUMNAR_TABLES["lightcurve"]]
+        first, end = int(data[COLUMNAR_OFFSETS][position]), int(data[COLUMNAR_OFFSETS][position + 1])
+        observe_query(self.kind, "lightcurve", start, end - first)
+        # memmapのスライス（コピーしない）
+        return source_info, {name: data[name][first:end] for name in NEOWISE_COLUMNS}
+
+    def lightcurves(self, source_ids: Sequence[str]) -> Dict[str, dict]:
+        # 結合済みのライトカーブをそのまま読む（pandasの結合を通らない）
+        results = {}
+        for source_id in source_ids:
+            found = self.lightcurve_arrays(str(source_id))
+            if found is None:
+                continue
+            source_info, arrays = found
+            metadata = neowise_metadata(source_id, source_info, len(arrays["mjd"]))
+            results[str(source_id)] = lightcurve_response(
+                metadata, {name: array_to_list(values) for name, values in arrays.items()}
+            )
+        return results
+
+    def describe(self) -> dict:
+        return dict(super().describe(), sources=self.count(), rows=self.manifest["rows"])
+
+    def reload(self):
+        super().reload()
+        with self._lock:
+            self._open()
+
+
+def open_store(path, **sqlite_options) -> LightcurveStore:
+    """
+    パスから保存形式を判別してストアを開く
+
+    ファイル → SQLiteStore（sqlite_optionsを渡す）、manifest.json があるディレクトリ →
+    manifest の format に応じて ColumnarStore / ParquetStore、それ以外のディレクトリ → JSONStore
+    """
+    path = Path(path)
+    if path.is_dir():
+        if (path / PARQUET_MANIFEST).exists():
+            with open(path / PARQUET_MANIFEST) as f:
+                manifest_format = json.load(f).get("format")
+            if manifest_format == COLUMNAR_FORMAT:
+                return ColumnarStore(path)
+            return ParquetStore(path)
+        return JSONStore(path)
+    if path.exists():
+        return SQLiteStore(path, **sqlite_options)
+    raise FileNotFoundError(f"lightcurve store not found: {path}")
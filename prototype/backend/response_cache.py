@@ -0,0 +1,223 @@
+"""
+レスポンスキャッシュと条件付きGET
+
+GETリクエストのレスポンスを「正規化したクエリ + データのバージョンスタンプ」を
+キーとしてLRUキャッシュに保持する。キャッシュはエントリ数とバイト数の両方で上限を持つ。
+
+レスポンスには本文のハッシュから作った強いETagを付与し、
+If-None-Matchが一致すれば本文なしの304を返す。
+データ（DBファイルやデータディレクトリ）が更新されるとバージョンスタンプが変わるため、
+古いエントリは参照されなくなり、LRUで追い出される。
+リクエストに Cache-Control: no-cache があればキャッシュを引かずに作り直す（結果は格納する）。
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from server_timing import record as record_phase
+
+
+class LRUCache:
+    """
+    エントリ数とバイト数で上限を持つスレッドセーフなLRUキャッシュ
+
+    Parameters:
+    -----------
+    max_entries : int
+        最大エントリ数
+    max_bytes : int
+        値の合計サイズの上限（バイト）
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, Tuple[object, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value, size: int):
+        # 上限を超える単一の値はキャッシュしない
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+def make_etag(body: bytes) -> str:
+    """本文のハッシュから強いETagを作成"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Matchヘッダーがetagに一致するか"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+# レスポンス形式や圧縮に影響するため、キャッシュキーに含めるリクエストヘッダー
+VARY_HEADERS = (b"accept", b"accept-encoding")
+
+# キャッシュしない（転送しない）レスポンスヘッダー
+_SKIP_HEADERS = {b"content-length", b"etag"}
+
+
+class ResponseCacheMiddleware:
+    """
+    GETレスポンスをキャッシュし、ETag・If-None-Matchに対応するASGIミドルウェア
+
+    Parameters:
+    -----------
+    app : ASGI app
+    cache : LRUCache
+        レスポンスを保持するキャッシュ
+    version_fn : callable
+        データのバージョンスタンプを返す関数（変化するとキャッシュが無効になる）
+    path_prefix : str
+        キャッシュ対象とするパスの接頭辞
+    """
+
+    def __init__(self, app, cache: LRUCache, version_fn: Callable[[], Hashable], path_prefix: str = "/api/"):
+        self.app = app
+        self.cache = cache
+        self.version_fn = version_fn
+        self.path_prefix = path_prefix
+
+    def _cache_key(self, scope) -> tuple:
+        # クエリパラメータは並べ替えて正規化する
+        query = urlencode(sorted(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)))
+        headers = dict(scope["headers"])
+        vary = tuple(headers.get(name, b"") for name in VARY_HEADERS)
+        return (scope["path"], query, vary, self.version_fn())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        request_headers = dict(scope["headers"])
+        if_none_match = request_headers.get(b"if-none-match", b"").decode("latin-1")
+        key = self._cache_key(scope)
+        no_cache = b"no-cache" in request_headers.get(b"cache-control", b"").lower()
+        cached = None if no_cache else self.cache.get(key)
+        lookup_time = time.perf_counter() - start
+        if cached is not None:
+            headers, body, etag = cached
+            record_phase("cache", lookup_time, "hit")
+            await self._send_cached(send, headers, body, etag, if_none_match)
+            return
+
+        # 下流のレスポンスを受け取り、200ならキャッシュに格納する
+        # 下流が自分でETagを付けた場合（ファイル配信など）はキャッシュせずにそのまま流す
+        start_message = {}
+        body_parts = []
+        passthrough = False
+
+        async def capture(message):
+            nonlocal passthrough
+            if message["type"] == "http.response.start":
+                start_message.update(message)
+                etag = dict(message.get("headers", [])).get(b"etag")
+                if etag is not None:
+                    passthrough = True
+                    if message.get("status") == 200 and etag_matches(if_none_match, etag.decode("latin-1")):
+                        headers = [(k, v) for k, v in message["headers"]
+                                   if k.lower() not in (b"content-length", b"content-type")]
+                        await send({"type": "http.response.start", "status": 304, "headers": headers})
+                        await send({"type": "http.response.body", "body": b""})
+                        start_message["not_modified"] = True
+                        return
+                    await send(message)
+                return
+            if passthrough:
+                # 304を返した場合は本文を捨てる
+                if not start_message.get("not_modified"):
+                    await send(message)
+                return
+            if message["type"] == "http.response.body":
+                body_parts.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                body = b"".join(body_parts)
+                headers = [(k, v) for k, v in start_message.get("headers", []) if k.lower() not in _SKIP_HEADERS]
+                status = start_message.get("status", 200)
+                if status != 200:
+                    await send({"type": "http.response.start", "status": status,
+                                "headers": headers + [(b"content-length", str(len(body)).encode())]})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                if not any(k.lower() == b"vary" for k, _ in headers):
+                    headers.append((b"vary", b"Accept, Accept-Encoding"))
+                store_start = time.perf_counter()
+                etag = make_etag(body)
+                self.cache.put(key, (headers, body, etag), len(body))
+                record_phase("cache", lookup_time + time.perf_counter() - store_start, "miss")
+                await self._send_cached(send, headers, body, etag, if_none_match)
+                return
+            await send(message)
+
+        await self.app(scope, receive, capture)
+
+    @staticmethod
+    async def _send_cached(send, headers, body: bytes, etag: str, if_none_match: str):
+        etag_header = (b"etag", etag.encode("latin-1"))
+        if etag_matches(if_none_match, etag):
+            # 304では本文を送らず、Content-Typeも省略する
+            not_modified_headers = [(k, v) for k, v in headers if k.lower() != b"content-type"]
+            await send({"type": "http.response.start", "status": 304, "headers": not_modified_headers + [etag_header]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": headers + [etag_header, (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
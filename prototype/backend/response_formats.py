@@ -0,0 +1,206 @@
+"""
+ライトカーブレスポンスのバイナリ形式
+
+`format=`パラメータまたはAcceptヘッダーで以下の形式を選択できる:
+
+- json    : application/json（デフォルト）
+- arrow   : application/vnd.apache.arrow.stream（Arrow IPCストリーム、要pyarrow）
+- msgpack : application/msgpack（要msgpack）
+- binary  : application/octet-stream（数値列はリトルエンディアンfloat64、文字列の列はint8のコードにして連結した生配列）
+
+いずれのバイナリ形式も、クエリ結果の列（NumPy配列）をそのまま書き出し、
+行ごとのPythonオブジェクトは作らない。
+"""
+
+import json
+from typing import Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+# pyarrow・msgpackは利用可能な場合のみインポート
+try:
+    import pyarrow as pa
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "msgpack": "application/msgpack",
+    "binary": "application/octet-stream",
+}
+
+# binary形式の文字列の列（band, cc_flags, ...）のコード。欠損は BINARY_CODE_MISSING
+BINARY_CODE_DTYPE = np.dtype("i1")
+BINARY_CODE_MISSING = -1
+BINARY_MAX_CATEGORIES = 127
+
+# Acceptヘッダーの値 → 形式名
+ACCEPT_FORMATS = {
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/octet-stream": "binary",
+    "application/json": "json",
+}
+
+
+def negotiate_format(accept: Optional[str], fmt: Optional[str] = None) -> str:
+    """
+    レスポンス形式を決定する
+
+    `format=`パラメータが指定されていればそれを優先し、
+    無ければAcceptヘッダーを先頭から順に見て最初に対応する形式を選ぶ
+    """
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in MEDIA_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"未対応のformatです: {fmt}（json, arrow, msgpack, binary のいずれか）"
+            )
+    else:
+        fmt = "json"
+        for part in (accept or "").split(","):
+            media_type = part.split(";")[0].strip().lower()
+            if media_type in ACCEPT_FORMATS:
+                fmt = ACCEPT_FORMATS[media_type]
+                break
+
+    if fmt == "arrow" and not ARROW_AVAILABLE:
+        raise HTTPException(status_code=406, detail="Arrow形式にはpyarrowが必要です")
+    if fmt == "msgpack" and not MSGPACK_AVAILABLE:
+        raise HTTPException(status_code=406, detail="MessagePack形式にはmsgpackが必要です")
+    return fmt
+
+
+def _encode_categories(name: str, values: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+    """
+    文字列の列をint8のコードと辞書（出現順）に変換（欠損はBINARY_CODE_MISSING）
+
+    文字列以外の値を含む列や、種類がBINARY_MAX_CATEGORIESを超える列は406を返す
+    """
+    codes = np.empty(len(values), dtype=BINARY_CODE_DTYPE)
+    lookup: Dict[str, int] = {}
+    for i, value in enumerate(values.tolist()):
+        if value is None or (isinstance(value, float) and value != value):
+            codes[i] = BINARY_CODE_MISSING
+            continue
+        if not isinstance(value, str):
+            raise HTTPException(
+                status_code=406,
+                detail=f"binary形式に変換できない列です: {name}（arrow または msgpack を使ってください）"
+            )
+        code = lookup.get(value)
+        if code is None:
+            if len(lookup) >= BINARY_MAX_CATEGORIES:
+                raise HTTPException(
+                    status_code=406,
+                    detail=f"列 {name} の値が{BINARY_MAX_CATEGORIES}種類を超えるためbinary形式に変換できません"
+                           "（arrow または msgpack を使ってください）"
+                )
+            code = lookup[value] = len(lookup)
+        codes[i] = code
+    return codes, list(lookup)
+
+
+def _binary_columns(columns: Dict[str, np.ndarray]) -> Tuple[Dict[str, np.ndarray], Dict[str, List[str]]]:
+    """
+    binary形式で書き出す列と、文字列の列の辞書を返す
+
+    数値列はリトルエンディアンfloat64（欠損値はNaN）、文字列の列はint8のコード。
+    各列が要素のサイズの倍数の位置から始まるよう、float64の列を先に並べる
+    """
+    numeric = {}
+    coded = {}
+    categories = {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype.kind in "biuf":
+            numeric[name] = values.astype("<f8", copy=False)
+        elif values.dtype.kind in "OUS":
+            if values.dtype.kind == "S":
+                values = values.astype(str)
+            coded[name], categories[name] = _encode_categories(name, values)
+        else:
+            raise HTTPException(
+                status_code=406,
+                detail=f"binary形式に変換できない列です: {name}（arrow または msgpack を使ってください）"
+            )
+    return dict(numeric, **coded), categories
+
+
+def columns_response(columns: Dict[str, np.ndarray], fmt: str, metadata: dict,
+                     float_columns: Collection[str] = ()) -> Response:
+    """
+    列データをバイナリ形式のレスポンスに変換
+
+    Parameters:
+    -----------
+    columns : dict
+        列名 → NumPy配列（全列同じ長さ）
+    fmt : str
+        negotiate_format() で決定した形式（json以外）
+    metadata : dict
+        天体情報などのメタデータ（source_id, ra, decなど）
+    float_columns : collection of str
+        常にfloat64（欠損値はNaN）で書き出す数値の列。0行の結果やNoneを含む列はobject型の配列になるため、
+        ストア・行数によって型（msgpackでは文字列のリストになる）が変わらないようにする
+    """
+    columns = {
+        name: np.asarray(values, dtype="<f8") if name in float_columns else values
+        for name, values in columns.items()
+    }
+    num_rows = len(next(iter(columns.values()))) if columns else 0
+
+    if fmt == "arrow":
+        table = pa.table({name: np.asarray(values) for name, values in columns.items()})
+        table = table.replace_schema_metadata({"metadata": json.dumps(metadata)})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(content=sink.getvalue().to_pybytes(), media_type=MEDIA_TYPES[fmt])
+
+    if fmt == "msgpack":
+        # 数値列は型情報付きの生バイト列、文字列の列は文字列のリストとして格納する
+        packed_columns = {}
+        for name, values in columns.items():
+            values = np.asarray(values)
+            if values.dtype.kind in "biuf":
+                values = values.astype(values.dtype.newbyteorder("<"), copy=False)
+                packed_columns[name] = {"dtype": values.dtype.str, "data": values.tobytes()}
+            else:
+                packed_columns[name] = [None if v is None else str(v) for v in values.tolist()]
+        payload = dict(metadata, num_rows=num_rows, columns=packed_columns)
+        return Response(content=msgpack.packb(payload, use_bin_type=True), media_type=MEDIA_TYPES[fmt])
+
+    if fmt == "binary":
+        # 列を X-Columns の順に連結（各列 num_rows × X-Dtypes の型。float64の列が先、文字列のコードの列が後）
+        # 列（memmapのスライスでもよい）を確保済みのバッファに直接書き込み、中間のbytesを作らない
+        encoded, categories = _binary_columns(columns)
+        buffer = bytearray(sum(values.dtype.itemsize for values in encoded.values()) * num_rows)
+        offset = 0
+        for values in encoded.values():
+            size = values.dtype.itemsize * num_rows
+            np.frombuffer(buffer, dtype=values.dtype, count=num_rows, offset=offset)[:] = values
+            offset += size
+        body = memoryview(buffer)
+        headers = {
+            "X-Columns": ",".join(encoded),
+            "X-Dtypes": ",".join(values.dtype.str for values in encoded.values()),
+            "X-Rows": str(num_rows),
+            "X-Categories": json.dumps(categories, ensure_ascii=True),
+            "X-Metadata": json.dumps(metadata, ensure_ascii=True),
+        }
+        return Response(content=body, media_type=MEDIA_TYPES[fmt], headers=headers)
+
+    raise ValueError(f"Unsupported binary format: {fmt}")
@@ -0,0 +1,334 @@
+"""
+Server-Timingヘッダーとリクエスト単位のサンプリングプロファイル
+
+ServerTimingMiddleware はリクエストごとの計測（RequestTimings）をコンテキスト変数に置き、
+応答に Server-Timing ヘッダーを付ける。処理の区間は phase() / record() で記録する:
+
+    match      座標の最近傍検索
+    db         ストアの読み出し（SQLなど。metrics.observe_query が記録する）
+    merge      W1/W2のMJD結合・観測ごとのループなど、レスポンスの組み立て
+    downsample ダウンサンプリング
+    aggregate  エポックの再集約
+    read       JSONファイルの読み込み
+    serialize  JSONへの変換・バイナリ形式の書き出し（エンドポイントの戻り値からレスポンス開始まで）
+    cache      レスポンスキャッシュ（desc="hit" / "miss"）
+    total      ミドルウェアに入ってからレスポンス開始まで
+
+区間は入れ子にでき、内側の区間の時間は外側の区間から差し引く（各区間の合計は total 以下になる）。
+計測のない場所（スクリプトなど）では phase() / record() は何もしない。
+
+profiling=True の場合、クエリに ?profile=1 を付けたリクエストは実行中のスレッドを
+PROFILE_INTERVAL 秒ごとにサンプリングし、レスポンスの代わりに折り畳んだスタック
+（flamegraph.pl / speedscope の collapsed 形式）と区間ごとの時間を返す（?profile=folded ならテキスト）。
+"""
+
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode
+
+# FastAPIは利用可能な場合のみインポート（TimedRouteで使用。計測の記録だけならスクリプトからも使える）
+try:
+    from fastapi.routing import APIRoute
+    FASTAPI_AVAILABLE = True
+except ImportError:
+    FASTAPI_AVAILABLE = False
+
+# プロファイルのサンプリング間隔（秒）とスタックの深さの上限
+PROFILE_INTERVAL = 0.001
+PROFILE_MAX_DEPTH = 128
+
+# プロファイルを要求するクエリパラメータ
+PROFILE_PARAM = "profile"
+PROFILE_JSON_VALUES = ("1", "true", "json")
+PROFILE_FOLDED_VALUE = "folded"
+
+_current: ContextVar[Optional["RequestTimings"]] = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """1リクエスト分の区間ごとの時間（秒）"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.descriptions: Dict[str, str] = {}
+        # エンドポイントを実行しているスレッド（プロファイルのサンプリング対象）
+        self.thread_id = threading.get_ident()
+        self.endpoint_end: Optional[float] = None
+        self._stack: List[str] = []
+        self._after_endpoint = 0.0
+
+    def add(self, name: str, seconds: float, description: Optional[str] = None):
+        """区間の時間を加算し、実行中の外側の区間から差し引く"""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if description is not None:
+            self.descriptions[name] = description
+        if self._stack:
+            parent = self._stack[-1]
+            self.phases[parent] = self.phases.get(parent, 0.0) - seconds
+        elif self.endpoint_end is not None:
+            self._after_endpoint += seconds
+
+    def finish(self) -> float:
+        """レスポンス開始時に呼ぶ。エンドポイントの戻り値からの時間を serialize に加え、total を返す"""
+        now = time.perf_counter()
+        if self.endpoint_end is not None:
+            self.phases["serialize"] = (self.phases.get("serialize", 0.0)
+                                        + now - self.endpoint_end - self._after_endpoint)
+            self.endpoint_end = None
+        return now - self.start
+
+    def header(self, total: float) -> bytes:
+        """Server-Timingヘッダーの値（ミリ秒）"""
+        entries = []
+        for name, seconds in self.phases.items():
+            entry = f"{name};dur={max(seconds, 0.0) * 1000:.3f}"
+            if name in self.descriptions:
+                entry += f';desc="{self.descriptions[name]}"'
+            entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(entries).encode("latin-1")
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """処理中のリクエストの計測（リクエストの外ではNone）"""
+    return _current.get()
+
+
+def record(name: str, seconds: float, description: Optional[str] = None):
+    """計測済みの区間を記録（リクエストの外では何もしない）"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, description)
+
+
+@contextmanager
+def phase(name: str):
+    """with の中の時間を区間 name として記録"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    timings._stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings._stack.pop()
+        timings.add(name, time.perf_counter() - start)
+
+
+def _timed_endpoint(endpoint):
+    """エンドポイントの終了時刻（serialize の開始）と実行スレッドを記録するラッパー"""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                timings = _current.get()
+                if timings is not None:
+                    timings.endpoint_end = time.perf_counter()
+        return wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        # 同期のエンドポイントはスレッドプールで動くので、サンプリング対象をこのスレッドに切り替える
+        timings = _current.get()
+        if timings is None:
+            return endpoint(*args, **kwargs)
+        caller = timings.thread_id
+        timings.thread_id = threading.get_ident()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            timings.endpoint_end = time.perf_counter()
+            timings.thread_id = caller
+    return wrapper
+
+
+if FASTAPI_AVAILABLE:
+    class TimedRoute(APIRoute):
+        """
+        エンドポイントの終了時刻を記録するルート（app.router.route_class に設定する）
+
+        エンドポイントの戻り値をJSONに変換する時間（FastAPIのjsonable_encoder・レスポンスの描画）を
+        serialize として分けて計測するために使う
+        """
+
+        def __init__(self, path: str, endpoint, **kwargs):
+            super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+
+def _frame_label(code, labels: dict) -> str:
+    label = labels.get(code)
+    if label is None:
+        label = labels[code] = f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+    return label
+
+
+class StackSampler:
+    """
+    リクエストを実行中のスレッドのスタックを一定間隔で数えるサンプリングプロファイラ
+
+    対象のスレッドは RequestTimings.thread_id（同期エンドポイントの実行中はスレッドプールのスレッド）。
+    イベントループが待機しているだけのサンプル（selectors）は数えない
+    """
+
+    def __init__(self, timings: RequestTimings, interval: float = PROFILE_INTERVAL):
+        self.timings = timings
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.timings.thread_id)
+            if frame is None or frame.f_code.co_filename.endswith("selectors.py"):
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(_frame_label(frame.f_code, self._labels))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        """collapsed 形式（1行に "呼び出し元;...;関数 サンプル数"）"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ServerTimingMiddleware:
+    """
+    区間ごとの時間を Server-Timing ヘッダーで返すASGIミドルウェア
+
+    Timing-Allow-Origin も付けるため、別オリジンのフロントエンドからも
+    PerformanceResourceTiming.serverTiming で読める。
+    レスポンスキャッシュにヘッダーが保存されないよう、キャッシュより外側に配置する
+
+    Parameters:
+    -----------
+    app : ASGI app
+    profiling : bool
+        Trueなら ?profile=1 / ?profile=folded でリクエストをプロファイルする（本番では無効にしておく）
+    """
+
+    def __init__(self, app, profiling: bool = False):
+        self.app = app
+        self.profiling = profiling
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = self._profile_mode(scope) if self.profiling else None
+        if profile is not None:
+            await self._profile(scope, receive, send, profile)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [
+                    (b"server-timing", timings.header(timings.finish())),
+                    (b"timing-allow-origin", b"*"),
+                ]
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+
+    @staticmethod
+    def _profile_mode(scope) -> Optional[str]:
+        query = scope.get("query_string", b"")
+        if PROFILE_PARAM.encode() not in query:
+            return None
+        for name, value in parse_qsl(query.decode("latin-1"), keep_blank_values=True):
+            if name == PROFILE_PARAM:
+                value = value.lower()
+                if value == PROFILE_FOLDED_VALUE:
+                    return PROFILE_FOLDED_VALUE
+                return "json" if value in PROFILE_JSON_VALUES else None
+        return None
+
+    async def _profile(self, scope, receive, send, mode: str):
+        """profile パラメータを除いたリクエストを実行してプロファイルし、結果を返す（元のレスポンスは捨てる）"""
+        params = [(name, value) for name, value in parse_qsl(scope["query_string"].decode("latin-1"),
+                                                             keep_blank_values=True) if name != PROFILE_PARAM]
+        # レスポンスキャッシュを使わずに実行させる
+        headers = [(k, v) for k, v in scope["headers"] if k != b"cache-control"] + [(b"cache-control", b"no-cache")]
+        scope = dict(scope, query_string=urlencode(params).encode("latin-1"), headers=headers)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        sampler = StackSampler(timings)
+        status = 500
+        total = None
+
+        async def discard(message):
+            nonlocal status, total
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = timings.finish()
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            sampler.stop()
+            _current.reset(token)
+        if total is None:
+            total = timings.finish()
+
+        if mode == PROFILE_FOLDED_VALUE:
+            body = sampler.folded().encode()
+            content_type = b"text/plain; charset=utf-8"
+        else:
+            body = json.dumps({
+                "path": scope["path"],
+                "query": scope["query_string"].decode("latin-1"),
+                "status": status,
+                "duration_ms": total * 1000,
+                "server_timing": {name: max(seconds, 0.0) * 1000 for name, seconds in timings.phases.items()},
+                "interval_ms": sampler.interval * 1000,
+                "samples": sampler.samples,
+                "folded": sampler.folded(),
+            }).encode()
+            content_type = b"application/json"
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode()),
+                (b"cache-control", b"no-store"),
+                (b"server-timing", timings.header(total)),
+                (b"timing-allow-origin", b"*"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,181 @@
+"""
+天体座標の空間インデックス
+
+座標(ra, dec)を単位ベクトルに変換してk-d木（scipy.spatial.cKDTree）を構築し、
+最近傍天体をO(log n)で検索する。
+scipyが利用できない環境では、赤緯でソートした配列の二分探索にフォールバックする。
+
+どちらの方式でも、マッチ判定は真の角距離で行う
+（RAの0/360度の折り返しとcos(dec)の効果を考慮済み）。
+
+healpix_nest() は座標をHEALPixのピクセル番号（NESTED方式）に変換する
+（Parquetストアの分割キー。healpyに依存しないNumPy実装）。
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+
+# scipyは利用可能な場合のみインポート
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# 3秒角（0.00083度）以内であればマッチとみなす
+MATCH_RADIUS_DEG = 0.00083
+
+
+def radec_to_unit_vectors(ra, dec) -> np.ndarray:
+    """RA/Dec（度）を単位球上の3次元ベクトル（N×3）に変換"""
+    ra_rad = np.radians(np.asarray(ra, dtype=np.float64))
+    dec_rad = np.radians(np.asarray(dec, dtype=np.float64))
+    cos_dec = np.cos(dec_rad)
+    return np.column_stack([
+        cos_dec * np.cos(ra_rad),
+        cos_dec * np.sin(ra_rad),
+        np.sin(dec_rad),
+    ])
+
+
+def angular_separation_deg(ra1, dec1, ra2, dec2) -> np.ndarray:
+    """2点間の角距離（度）をhaversine公式で計算"""
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (ra1, dec1, ra2, dec2))
+    sin_ddec = np.sin((dec2 - dec1) / 2)
+    sin_dra = np.sin((ra2 - ra1) / 2)
+    a = sin_ddec**2 + np.cos(dec1) * np.cos(dec2) * sin_dra**2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))))
+
+
+def _spread_bits(values: np.ndarray, order: int) -> np.ndarray:
+    """ビットを1つおきに配置する（NESTED方式のピクセル番号でx・yを交互に並べる）"""
+    result = np.zeros_like(values)
+    for bit in range(order):
+        result |= ((values >> bit) & 1) << (2 * bit)
+    return result
+
+
+def healpix_nest(ra, dec, nside: int) -> np.ndarray:
+    """
+    座標（度）をHEALPixのピクセル番号（NESTED方式）に変換
+
+    healpy.ang2pix(nside, ra, dec, nest=True, lonlat=True) と同じ値を返す
+    （HEALPix C++ の loc2pix と同じ計算）。nsideは2のべき乗
+    """
+    order = int(nside).bit_length() - 1
+    if nside < 1 or 1 << order != nside:
+        raise ValueError(f"nside must be a power of 2: {nside}")
+
+    z = np.sin(np.radians(np.asarray(dec, dtype=np.float64)))
+    tt = np.mod(np.radians(np.asarray(ra, dtype=np.float64)) / (np.pi / 2), 4.0)
+    za = np.abs(z)
+    face = np.empty(z.shape, dtype=np.int64)
+    ix = np.empty(z.shape, dtype=np.int64)
+    iy = np.empty(z.shape, dtype=np.int64)
+
+    # 赤道帯（|z| <= 2/3）
+    eq = za <= 2.0 / 3.0
+    temp1 = nside * (0.5 + tt[eq])
+    temp2 = nside * (z[eq] * 0.75)
+    jp = (temp1 - temp2).astype(np.int64)  # 右上がりの境界線の番号
+    jm = (temp1 + temp2).astype(np.int64)  # 右下がりの境界線の番号
+    ifp = jp >> order
+    ifm = jm >> order
+    face[eq] = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix[eq] = jm & (nside - 1)
+    iy[eq] = nside - (jp & (nside - 1)) - 1
+
+    # 極冠（|z| > 2/3）
+    polar = ~eq
+    ntt = np.minimum(3, tt[polar].astype(np.int64))
+    tp = tt[polar] - ntt
+    tmp = nside * np.sqrt(3 * (1 - za[polar]))
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1.0 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z[polar] >= 0
+    face[polar] = np.where(north, ntt, ntt + 8)
+    ix[polar] = np.where(north, nside - jm - 1, jp)
+    iy[polar] = np.where(north, nside - jp - 1, jm)
+
+    return (face << (2 * order)) + _spread_bits(ix, order) + (_spread_bits(iy, order) << 1)
+
+
+class SkyIndex:
+    """
+    天体座標の最近傍検索インデックス
+
+    Parameters:
+    -----------
+    ids : sequence
+        天体の識別子（source_idなど）
+    ra, dec : sequence of float
+        座標（度単位）
+    """
+
+    def __init__(self, ids: Sequence, ra: Sequence[float], dec: Sequence[float]):
+        self.ids = np.asarray(ids, dtype=object)
+        self.ra = np.asarray(ra, dtype=np.float64)
+        self.dec = np.asarray(dec, dtype=np.float64)
+
+        if SCIPY_AVAILABLE and len(self.ids) > 0:
+            self._tree = cKDTree(radec_to_unit_vectors(self.ra, self.dec))
+        else:
+            self._tree = None
+            # フォールバック: 赤緯でソートして帯状領域を二分探索する
+            self._dec_order = np.argsort(self.dec, kind='stable')
+            self._dec_sorted = self.dec[self._dec_order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def nearest(self, ra: float, dec: float, radius_deg: float = MATCH_RADIUS_DEG) -> Optional[int]:
+        """
+        半径radius_deg以内で最も近い天体の位置（インデックス）を返す
+
+        見つからない場合はNone
+        """
+        positions = self.nearest_many([ra], [dec], radius_deg)
+        return int(positions[0]) if positions[0] >= 0 else None
+
+    def nearest_many(self, ra: Sequence[float], dec: Sequence[float],
+                     radius_deg: float = MATCH_RADIUS_DEG) -> np.ndarray:
+        """
+        複数座標の最近傍天体の位置をまとめて検索
+
+        Returns:
+        --------
+        np.ndarray
+            各座標に対応する位置（半径内に天体が無い場合は-1）
+        """
+        ra = np.asarray(ra, dtype=np.float64)
+        dec = np.asarray(dec, dtype=np.float64)
+        result = np.full(len(ra), -1, dtype=np.int64)
+        if len(self.ids) == 0 or len(ra) == 0:
+            return result
+
+        if self._tree is not None:
+            # 角距離θに対応する単位球上の弦の長さ 2*sin(θ/2)
+            chord = 2 * np.sin(np.radians(radius_deg) / 2)
+            _, positions = self._tree.query(radec_to_unit_vectors(ra, dec), k=1, distance_upper_bound=chord)
+            found = positions < len(self.ids)
+            result[found] = positions[found]
+        else:
+            for i, (q_ra, q_dec) in enumerate(zip(ra, dec)):
+                lo = np.searchsorted(self._dec_sorted, q_dec - radius_deg, side='left')
+                hi = np.searchsorted(self._dec_sorted, q_dec + radius_deg, side='right')
+                if lo == hi:
+                    continue
+                candidates = self._dec_order[lo:hi]
+                separation = angular_separation_deg(q_ra, q_dec, self.ra[candidates], self.dec[candidates])
+                best = int(np.argmin(separation))
+                if separation[best] <= radius_deg:
+                    result[i] = candidates[best]
+
+        # k-d木の弦長判定と境界で一致させるため、最終判定は角距離で行う
+        matched = result >= 0
+        if matched.any():
+            separation = angular_separation_deg(ra[matched], dec[matched],
+                                                self.ra[result[matched]], self.dec[result[matched]])
+            result[np.flatnonzero(matched)[separation > radius_deg]] = -1
+        return result
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+ライトカーブのストアをHEALPix分割のParquetデータセットに変換
+
+SQLiteのDB（v1 / v2）またはJSONディレクトリ（data/neowise）を読み、
+backend/lightcurve_store.py の ParquetStore が読む形式で書き出す:
+
+    <output>/manifest.json                           nside・行数など（最後に書く）
+    <output>/sources.parquet                         天体情報 + healpix（入力と同じ順）
+    <output>/raw/healpix=<pixel>/part-0.parquet      生データ（source_id・mjdの昇順）
+    <output>/epochs/healpix=<pixel>/part-0.parquet   エポック集約（source_id・mjd_meanの昇順）
+
+ピクセルは天体の座標のHEALPix（NESTED方式）。1ピクセル = 1ファイルで、
+ファイル内はsource_idの昇順なので、行グループの統計値（最小・最大）で天体を絞り込める。
+入力の読み出しにはAPIと同じストア（lightcurve_store.open_store）を使う。
+
+pyarrowが必要（pip install pyarrow）。
+
+使用方法:
+    python convert_to_parquet.py --input neowise.db --output neowise_parquet
+    python convert_to_parquet.py --input ../data/neowise --output neowise_json_parquet
+    python convert_to_parquet.py --input synthetic_1m.db --output synthetic_1m_parquet --nside 32
+"""
+
+import argparse
+import json
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# pyarrowは利用可能な場合のみインポート
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# APIと同じストア・HEALPixの実装を使う
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.append(str(BACKEND_DIR))
+from lightcurve_store import (  # noqa: E402
+    EPOCH_COLUMNS, PARQUET_FORMAT, PARQUET_MANIFEST, PARQUET_SOURCES, PARQUET_TABLES, RAW_COLUMNS, open_store
+)
+from spatial_index import healpix_nest  # noqa: E402
+
+DEFAULT_NSIDE = 16  # 3072ピクセル（1ピクセル約3.7度）
+DEFAULT_ROW_GROUP_SIZE = 16384
+DEFAULT_COMPRESSION = 'zstd'
+
+# 1回にストアから読み込む天体数の目安（ピクセル単位でまとめる）
+READ_CHUNK_SOURCES = 2000
+
+# 列の型（ピクセルごとのファイルでスキーマを揃える）
+COLUMN_TYPES = {
+    'source_id': 'string', 'mjd': 'float64', 'band': 'string', 'mpro': 'float64', 'sigmpro': 'float64',
+    'cc_flags': 'string', 'ph_qual': 'string', 'moon_masked': 'string', 'sso_flg': 'int64',
+    'qi_fact': 'float64', 'saa_sep': 'float64', 'sat': 'float64', 'rchi2': 'float64',
+    'qual_frame': 'float64', 'sky': 'float64', 'scan_id': 'string', 'mpro_corrected': 'float64',
+    'epoch_id': 'int64', 'mjd_mean': 'float64', 'mag_mean': 'float64', 'mag_se': 'float64',
+    'mag_lim': 'float64', 'n_points': 'int64', 'snr': 'float64', 'filter_applied': 'string',
+    'ra': 'float64', 'dec': 'float64', 'allwise_cntr': 'int64', 'healpix': 'int32',
+}
+
+
+def dataset_column_types(store) -> dict:
+    """
+    データセット全体で使う列の型
+
+    mjd_meanは入力と同じ型にする（SQLiteのINTEGER列は整数のまま書き、
+    APIのレスポンス・ETagがSQLiteから配信した場合と同じになるようにする）
+    """
+    return dict(COLUMN_TYPES, mjd_mean='int64' if store.epoch_mjd_integral() else 'float64')
+
+
+def frame_to_table(frame, columns, column_types: dict = COLUMN_TYPES) -> 'pa.Table':
+    """DataFrameを固定のスキーマのArrowテーブルに変換（型が推論と違う列もキャストする）"""
+    fields = []
+    arrays = []
+    for col in columns:
+        values = frame[col]
+        column_type = column_types[col]
+        if col == 'allwise_cntr' and not pd.api.types.is_numeric_dtype(values):
+            # JSONストアはAllWISEの名称（'J...'）を持つ
+            column_type = 'string'
+        if column_type == 'string':
+            values = values.astype(object).where(values.notna(), None)
+        fields.append((col, pa.type_for_alias(column_type)))
+        arrays.append(pa.array(values, type=fields[-1][1], from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def pixel_chunks(pixels: np.ndarray, source_ids: np.ndarray):
+    """ピクセル順に、READ_CHUNK_SOURCES天体程度ずつ (ピクセル→source_id配列) のまとまりを返す"""
+    order = np.argsort(pixels, kind='stable')
+    unique, starts = np.unique(pixels[order], return_index=True)
+    bounds = list(starts) + [len(order)]
+    chunk = {}
+    size = 0
+    for i, pixel in enumerate(unique):
+        ids = source_ids[order[bounds[i]:bounds[i + 1]]]
+        chunk[int(pixel)] = ids
+        size += len(ids)
+        if size >= READ_CHUNK_SOURCES:
+            yield chunk
+            chunk, size = {}, 0
+    if chunk:
+        yield chunk
+
+
+def _concat(parts):
+    return parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+
+
+def write_pixel(output: Path, name: str, pixel: int, frame, columns, mjd_column: str,
+                row_group_size: int, compression: str, column_types: dict = COLUMN_TYPES) -> int:
+    if frame.empty:
+        return 0
+    frame = frame.sort_values(['source_id', mjd_column], kind='stable')
+    directory = output / name / f"healpix={pixel}"
+    directory.mkdir(parents=True, exist_ok=True)
+    pq.write_table(frame_to_table(frame, columns, column_types), directory / "part-0.parquet",
+                   row_group_size=row_group_size, compression=compression)
+    return len(frame)
+
+
+def convert(input_path: str, output_path: str, nside: int = DEFAULT_NSIDE,
+            row_group_size: int = DEFAULT_ROW_GROUP_SIZE, compression: str = DEFAULT_COMPRESSION) -> dict:
+    """
+    ストアをParquetデータセットに変換
+
+    Returns:
+    --------
+    dict
+        manifest.json に書いた内容
+    """
+    start_time = time.time()
+    store = open_store(input_path)
+    output = Path(output_path)
+    output.mkdir(parents=True, exist_ok=True)
+
+    # 天体情報（入力と同じ順） + ピクセル
+    source_ids = store.source_ids()
+    sources = store.sources(source_ids).loc[source_ids].reset_index(drop=True)
+    sources['healpix'] = healpix_nest(sources['ra'].to_numpy(), sources['dec'].to_numpy(), nside).astype(np.int32)
+    pq.write_table(frame_to_table(sources, ['source_id', 'ra', 'dec', 'allwise_cntr', 'healpix']),
+                   output / PARQUET_SOURCES, compression=compression)
+    num_pixels = sources['healpix'].nunique()
+    print(f"Converting {len(sources)} sources in {num_pixels} HEALPix pixels (nside={nside}) "
+          f"from {store.kind} store {input_path}...")
+
+    raw_columns = ['source_id'] + RAW_COLUMNS
+    epoch_columns = ['source_id'] + EPOCH_COLUMNS
+    column_types = dataset_column_types(store)
+    rows = {'raw': 0, 'epoch': 0}
+    done = 0
+    for chunk in pixel_chunks(sources['healpix'].to_numpy(), sources['source_id'].to_numpy(dtype=object)):
+        chunk_ids = [source_id for ids in chunk.values() for source_id in ids]
+        raw = store.raw_observations(chunk_ids, RAW_COLUMNS) if store.has_raw else None
+        epochs = store.epoch_summary(chunk_ids, EPOCH_COLUMNS)
+        raw_groups = dict(tuple(raw.groupby('source_id', sort=False))) if raw is not None and not raw.empty else {}
+        epoch_groups = dict(tuple(epochs.groupby('source_id', sort=False))) if not epochs.empty else {}
+
+        for pixel, ids in chunk.items():
+            if store.has_raw:
+                parts = [raw_groups[s] for s in ids if s in raw_groups]
+                if parts:
+                    rows['raw'] += write_pixel(output, PARQUET_TABLES['raw'], pixel, _concat(parts), raw_columns,
+                                               'mjd', row_group_size, compression)
+            parts = [epoch_groups[s] for s in ids if s in epoch_groups]
+            if parts:
+                rows['epoch'] += write_pixel(output, PARQUET_TABLES['epoch'], pixel, _concat(parts), epoch_columns,
+                                             'mjd_mean', row_group_size, compression, column_types)
+        done += len(chunk_ids)
+        print(f"  {done}/{len(sources)} sources, {rows['raw']} raw rows, {rows['epoch']} epoch rows "
+              f"({time.time() - start_time:.1f} s)")
+
+    manifest = {
+        "format": PARQUET_FORMAT,
+        "format_version": 1,
+        "healpix_scheme": "nested",
+        "nside": nside,
+        "has_raw": store.has_raw,
+        "input": str(Path(input_path).resolve()),
+        "input_type": store.kind,
+        "sources": len(sources),
+        "pixels": int(num_pixels),
+        "rows": rows,
+        "row_group_size": row_group_size,
+        "compression": compression,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    # manifest.jsonは最後に書く（ParquetStoreのバージョンスタンプ）
+    with open(output / PARQUET_MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    size = sum(p.stat().st_size for p in output.rglob('*') if p.is_file())
+    print("\n=== Summary ===")
+    print(f"Dataset saved to: {output_path}")
+    print(f"Sources: {len(sources)} in {num_pixels} pixels")
+    print(f"Rows: {rows['raw']} raw, {rows['epoch']} epoch")
+    print(f"Size: {size / 1024 ** 2:.1f} MiB")
+    print(f"Total time: {time.time() - start_time:.1f} seconds")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite / JSONのライトカーブをHEALPix分割のParquetデータセットに変換')
+    parser.add_argument('--input', '-i', type=str, required=True,
+                        help='SQLiteのDB（v1/v2）またはJSONディレクトリ（data/neowise）')
+    parser.add_argument('--output', '-o', type=str, required=True, help='出力ディレクトリ')
+    parser.add_argument('--nside', type=int, default=DEFAULT_NSIDE,
+                        help=f'HEALPixのnside（2のべき乗、デフォルト: {DEFAULT_NSIDE}）')
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE,
+                        help=f'Parquetの行グループの行数（デフォルト: {DEFAULT_ROW_GROUP_SIZE}）')
+    parser.add_argument('--compression', type=str, default=DEFAULT_COMPRESSION,
+                        choices=['zstd', 'snappy', 'gzip', 'none'], help='圧縮方式')
+    parser.add_argument('--force', action='store_true', help='出力先のデータセットがあれば削除して作り直す')
+    args = parser.parse_args()
+
+    if not PYARROW_AVAILABLE:
+        print("Error: convert_to_parquet.py requires pyarrow (pip install pyarrow)")
+        return
+    if args.nside < 1 or args.nside & (args.nside - 1):
+        parser.error('--nside must be a power of 2')
+
+    output = Path(args.output)
+    if output.exists() and any(output.iterdir()):
+        if not args.force:
+            print(f"Error: {args.output} is not empty (use --force to overwrite)")
+            return
+        if not (output / PARQUET_MANIFEST).exists():
+            # 誤って別のディレクトリを消さないよう、データセット以外は削除しない
+            print(f"Error: {args.output} is not a Parquet dataset created by this script")
+            return
+        shutil.rmtree(output)
+
+    convert(args.input, args.output, args.nside, args.row_group_size, args.compression)
+
+
+if __name__ == "__main__":
+    main()
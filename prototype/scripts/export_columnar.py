@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+ライトカーブのストアを列ファイル（numpy.memmapで読む平坦なファイル）に書き出す
+
+SQLiteのDB（v1 / v2）、Parquetデータセット、JSONディレクトリを読み、
+backend/lightcurve_store.py の ColumnarStore が読む形式で書き出す:
+
+    <output>/manifest.json                      列の型・行数など（最後に書く）
+    <output>/sources/<column>.bin               天体情報（source_idの昇順）+ input_order
+    <output>/raw/offsets.bin, <column>.bin      生データ（neowise_raw_observations）
+    <output>/epochs/offsets.bin, <column>.bin   エポック集約（neowise_epoch_summary）
+    <output>/lightcurve/offsets.bin, <column>.bin
+                                                W1/W2をMJDで結合済みのライトカーブ（mjd, w1_mag, w1_err, w2_mag, w2_err）
+
+天体は source_id の昇順に並べ、どのテーブルも天体の行を連続して書く（天体 i の行は offsets[i]:offsets[i + 1]）。
+lightcurve は /api/lightcurve/neowise（エポック集約）のレスポンスと同じ結合をあらかじめ行ったもので、
+配信時は1天体分のスライスをそのままレスポンスに書き出す。
+文字列の列（band, cc_flags, ph_qual, ...）は辞書符号化してint32で保存する。
+
+書き出し先を作り直す場合（--force）はディレクトリを削除してから書くため、
+配信中のワーカーが開いている古いファイルはそのまま読め、manifest.json の更新で新しいファイルに切り替わる。
+
+使用方法:
+    python export_columnar.py --input neowise.db --output neowise_columnar
+    python export_columnar.py --input synthetic_1m_v2.db --output synthetic_1m_columnar
+    python export_columnar.py --input ../data/neowise --output neowise_json_columnar
+"""
+
+import argparse
+import json
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# APIと同じストアを使う
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.append(str(BACKEND_DIR))
+from lightcurve_store import (  # noqa: E402
+    COLUMNAR_CODE_MISSING, COLUMNAR_FORMAT, COLUMNAR_INT_MISSING, COLUMNAR_OFFSETS, COLUMNAR_SOURCES,
+    COLUMNAR_SUFFIX, COLUMNAR_TABLES, EPOCH_COLUMNS, NEOWISE_COLUMNS, PARQUET_MANIFEST, RAW_COLUMNS, open_store
+)
+
+# 1回にストアから読み込む天体数
+READ_CHUNK_SOURCES = 2000
+
+# 列の型（'category' は辞書符号化する文字列の列）
+COLUMN_TYPES = {
+    'mjd': '<f8', 'band': 'category', 'mpro': '<f8', 'sigmpro': '<f8', 'cc_flags': 'category',
+    'ph_qual': 'category', 'moon_masked': 'category', 'sso_flg': '<i8', 'qi_fact': '<f8', 'saa_sep': '<f8',
+    'sat': '<f8', 'rchi2': '<f8', 'qual_frame': '<f8', 'sky': '<f8', 'scan_id': 'category',
+    'mpro_corrected': '<f8', 'epoch_id': '<i8', 'mjd_mean': '<f8', 'mag_mean': '<f8', 'mag_se': '<f8',
+    'mag_lim': '<f8', 'n_points': '<i8', 'snr': '<f8', 'filter_applied': 'category',
+    'w1_mag': '<f8', 'w1_err': '<f8', 'w2_mag': '<f8', 'w2_err': '<f8',
+}
+
+TABLE_COLUMNS = {
+    'raw': RAW_COLUMNS,
+    'epoch': EPOCH_COLUMNS,
+    'lightcurve': NEOWISE_COLUMNS,
+}
+
+
+def encode_integers(values) -> np.ndarray:
+    """整数列を<i8に変換（欠損はCOLUMNAR_INT_MISSING）"""
+    values = pd.to_numeric(pd.Series(values), errors='coerce')
+    missing = values.isna().to_numpy()
+    encoded = np.full(len(values), COLUMNAR_INT_MISSING, dtype='<i8')
+    encoded[~missing] = values[~missing].astype(np.int64).to_numpy()
+    return encoded
+
+
+def encode_bytes(values) -> np.ndarray:
+    """文字列の列を固定長バイト列に変換（欠損は空のバイト列）"""
+    return np.array([b'' if pd.isna(v) else str(v).encode() for v in values], dtype=bytes)
+
+
+class ColumnWriter:
+    """1列分のファイルへの追記（辞書符号化の辞書も保持する）"""
+
+    def __init__(self, path: Path, column_type: str):
+        self.path = path
+        self.column_type = column_type
+        self.file = open(path, 'wb')
+        self.categories = []
+        self.codes = {}
+
+    def append(self, values):
+        if self.column_type == 'category':
+            values = pd.Series(values, dtype=object)
+            present = values.notna().to_numpy()
+            keys = values[present].astype(str)
+            for key in pd.unique(keys[~keys.isin(list(self.codes))]):
+                self.codes[key] = len(self.categories)
+                self.categories.append(key)
+            encoded = np.full(len(values), COLUMNAR_CODE_MISSING, dtype='<i4')
+            encoded[present] = keys.map(self.codes).to_numpy(dtype=np.int32)
+        elif self.column_type == '<i8':
+            encoded = encode_integers(values)
+        else:
+            encoded = np.asarray(values, dtype=self.column_type)
+        self.file.write(encoded.tobytes())
+
+    def close(self) -> dict:
+        """ファイルを閉じ、manifest.json に書く列の情報を返す"""
+        self.file.close()
+        if self.column_type != 'category':
+            return {"dtype": self.column_type}
+        categories = f"{self.path.stem}.categories.json"
+        with open(self.path.parent / categories, 'w') as f:
+            json.dump(self.categories, f)
+        return {"dtype": "<i4", "categories": categories}
+
+
+def table_column_types(store) -> dict:
+    """
+    テーブルごとの列の型
+
+    エポックの平均MJD（epoch の mjd_mean、lightcurve の mjd）は入力と同じ型にする
+    （SQLiteのINTEGER列は整数のまま書き、APIのレスポンス・ETagがSQLiteから配信した場合と同じになるようにする）
+    """
+    mjd_type = '<i8' if store.epoch_mjd_integral() else '<f8'
+    return {
+        'raw': COLUMN_TYPES,
+        'epoch': dict(COLUMN_TYPES, mjd_mean=mjd_type),
+        'lightcurve': dict(COLUMN_TYPES, mjd=mjd_type),
+    }
+
+
+class TableWriter:
+    """1テーブル分（オフセット + 列ファイル）の書き出し"""
+
+    def __init__(self, directory: Path, columns, column_types: dict = COLUMN_TYPES):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.columns = list(columns)
+        self.writers = {col: ColumnWriter(directory / f"{col}{COLUMNAR_SUFFIX}", column_types[col])
+                        for col in self.columns}
+        self.offsets = open(directory / f"{COLUMNAR_OFFSETS}{COLUMNAR_SUFFIX}", 'wb')
+        self.offsets.write(np.zeros(1, dtype='<i8').tobytes())
+        self.rows = 0
+
+    def append(self, chunk_ids: pd.Index, frame: pd.DataFrame):
+        """chunk_ids（source_idの昇順）の天体の行を、天体ごとに連続するように追記"""
+        position = chunk_ids.get_indexer(frame['source_id'].astype(str))
+        # 元の順（天体内はMJDの昇順）を保ったまま天体の順に並べる
+        order = np.argsort(position, kind='stable')
+        counts = np.bincount(position, minlength=len(chunk_ids))
+        for col in self.columns:
+            self.writers[col].append(frame[col].to_numpy()[order])
+        self.offsets.write((self.rows + np.cumsum(counts)).astype('<i8').tobytes())
+        self.rows += int(counts.sum())
+
+    def close(self) -> dict:
+        self.offsets.close()
+        return {col: writer.close() for col, writer in self.writers.items()}
+
+
+def merge_lightcurves(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    複数天体のエポック集約（source_id, mjd, band, mag, mag_err）をまとめてW1/W2横持ちに結合
+
+    天体ごとに lightcurve_store.merge_neowise_bands を呼んだ結果を連結したものと同じ
+    （同一バンド・同一MJDの重複は最初の行、W1/W2の両方が欠損した行は除外、天体内はMJDの昇順）
+    """
+    bands = []
+    for band in ['W1', 'W2']:
+        prefix = band.lower()
+        band_data = data.loc[data['band'] == band, ['source_id', 'mjd', 'mag', 'mag_err']]
+        band_data = band_data.drop_duplicates(['source_id', 'mjd'])
+        bands.append(band_data.rename(columns={'mag': f'{prefix}_mag', 'mag_err': f'{prefix}_err'}))
+
+    merged = bands[0].merge(bands[1], on=['source_id', 'mjd'], how='outer')
+    merged = merged.sort_values(['source_id', 'mjd'], kind='stable')
+    merged = merged[merged['w1_mag'].notna() | merged['w2_mag'].notna()]
+    return merged.reset_index(drop=True)[['source_id'] + NEOWISE_COLUMNS]
+
+
+def write_sources(output: Path, sources: pd.DataFrame) -> dict:
+    """天体情報をsource_idの昇順で書き出し、manifest.json に書く列の情報を返す"""
+    directory = output / COLUMNAR_SOURCES
+    directory.mkdir(parents=True, exist_ok=True)
+    source_ids = encode_bytes(sources['source_id'])
+    order = np.argsort(source_ids, kind='stable')
+    # 入力のk番目の天体のソート済み配列での位置（source_ids() の順）
+    input_order = np.empty(len(order), dtype='<i8')
+    input_order[order] = np.arange(len(order))
+
+    allwise = sources['allwise_cntr']
+    numeric_allwise = pd.api.types.is_numeric_dtype(allwise) or allwise.isna().all()
+    columns = {
+        'source_id': source_ids[order],
+        'ra': sources['ra'].to_numpy(dtype='<f8')[order],
+        'dec': sources['dec'].to_numpy(dtype='<f8')[order],
+        # JSONストアはAllWISEの名称（'J...'）を持つ
+        'allwise_cntr': (encode_integers(allwise) if numeric_allwise else encode_bytes(allwise))[order],
+        'input_order': input_order,
+    }
+    specs = {}
+    for name, values in columns.items():
+        values.tofile(directory / f"{name}{COLUMNAR_SUFFIX}")
+        specs[name] = {"dtype": values.dtype.str}
+    return specs
+
+
+def export(input_path: str, output_path: str) -> dict:
+    """
+    ストアを列ファイルに書き出す
+
+    Returns:
+    --------
+    dict
+        manifest.json に書いた内容
+    """
+    start_time = time.time()
+    store = open_store(input_path)
+    output = Path(output_path)
+    output.mkdir(parents=True, exist_ok=True)
+
+    source_ids = store.source_ids()
+    sources = store.sources(source_ids).loc[source_ids].reset_index(drop=True)
+    columns = {COLUMNAR_SOURCES: write_sources(output, sources)}
+    sorted_ids = sorted(sources['source_id'].astype(str), key=str.encode)
+    print(f"Exporting {len(sorted_ids)} sources from {store.kind} store {input_path}...")
+
+    tables = [name for name in TABLE_COLUMNS if name != 'raw' or store.has_raw]
+    column_types = table_column_types(store)
+    writers = {name: TableWriter(output / COLUMNAR_TABLES[name], TABLE_COLUMNS[name], column_types[name])
+               for name in tables}
+    for start in range(0, len(sorted_ids), READ_CHUNK_SOURCES):
+        chunk = sorted_ids[start:start + READ_CHUNK_SOURCES]
+        chunk_ids = pd.Index(chunk)
+        if 'raw' in writers:
+            writers['raw'].append(chunk_ids, store.raw_observations(chunk, RAW_COLUMNS))
+        epochs = store.epoch_summary(chunk, EPOCH_COLUMNS)
+        writers['epoch'].append(chunk_ids, epochs)
+        lightcurve = epochs.rename(columns={'mjd_mean': 'mjd', 'mag_mean': 'mag', 'mag_se': 'mag_err'})
+        writers['lightcurve'].append(chunk_ids, merge_lightcurves(lightcurve))
+        print(f"  {start + len(chunk)}/{len(sorted_ids)} sources, "
+              + ", ".join(f"{writer.rows} {name} rows" for name, writer in writers.items())
+              + f" ({time.time() - start_time:.1f} s)")
+
+    rows = {COLUMNAR_TABLES[name]: writer.rows for name, writer in writers.items()}
+    for name, writer in writers.items():
+        columns[COLUMNAR_TABLES[name]] = writer.close()
+
+    manifest = {
+        "format": COLUMNAR_FORMAT,
+        "format_version": 1,
+        "has_raw": store.has_raw,
+        "input": str(Path(input_path).resolve()),
+        "input_type": store.kind,
+        "sources": len(sorted_ids),
+        "rows": rows,
+        "columns": columns,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    # manifest.jsonは最後に書く（ColumnarStoreのバージョンスタンプ）
+    with open(output / PARQUET_MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    size = sum(p.stat().st_size for p in output.rglob('*') if p.is_file())
+    print("\n=== Summary ===")
+    print(f"Dataset saved to: {output_path}")
+    print(f"Sources: {len(sorted_ids)}")
+    print("Rows: " + ", ".join(f"{count} {name}" for name, count in rows.items()))
+    print(f"Size: {size / 1024 ** 2:.1f} MiB")
+    print(f"Total time: {time.time() - start_time:.1f} seconds")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite / Parquet / JSONのライトカーブをmemmap用の列ファイルに書き出す')
+    parser.add_argument('--input', '-i', type=str, required=True,
+                        help='SQLiteのDB（v1/v2）、Parquetデータセット、またはJSONディレクトリ（data/neowise）')
+    parser.add_argument('--output', '-o', type=str, required=True, help='出力ディレクトリ')
+    parser.add_argument('--force', action='store_true', help='出力先のデータセットがあれば削除して作り直す')
+    args = parser.parse_args()
+
+    output = Path(args.output)
+    if output.exists() and any(output.iterdir()):
+        if not args.force:
+            print(f"Error: {args.output} is not empty (use --force to overwrite)")
+            return
+        if not (output / PARQUET_MANIFEST).exists():
+            # 誤って別のディレクトリを消さないよう、データセット以外は削除しない
+            print(f"Error: {args.output} is not a dataset created by this script")
+            return
+        shutil.rmtree(output)
+
+    export(args.input, args.output)
+
+
+if __name__ == "__main__":
+    main()
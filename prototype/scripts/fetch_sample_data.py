@@ -4,8 +4,16 @@
 
 BrightKg_WISE_unique.csvから100個の星を選び、
 NEOWISEとASASSNのライトカーブデータを取得してJSONで保存する
+
+--irsa-url（または環境変数 IRSA_URL）でNEOWISEの問い合わせ先を変更できる。
+ローカルのスタンドイン（mock_irsa_server.py）で計測する場合に使用（astroquery 0.4.7以降）。
+
+使用方法:
+    python fetch_sample_data.py
+    python fetch_sample_data.py --num-stars 20 --irsa-url http://127.0.0.1:8765 --skip-asassn
 """
 
+import argparse
 import pandas as pd
 import json
 import os
@@ -32,6 +40,21 @@ except ImportError:
 
 import numpy as np
 
+# 本物のIRSA（--irsa-url / IRSA_URL の既定値）
+DEFAULT_IRSA_URL = "https://irsa.ipac.caltech.edu"
+
+
+def use_irsa_url(irsa_url):
+    """
+    NEOWISEの問い合わせ先（astroqueryのIrsa.query_region）を変更
+    
+    query_regionはTAPで実行されるため、TAPサービスのURLを差し替える
+    """
+    if NEOWISE_AVAILABLE and irsa_url.rstrip('/') != DEFAULT_IRSA_URL:
+        Irsa.tap_url = irsa_url.rstrip('/') + '/TAP'
+        Irsa._tap = None  # 作成済みのTAPServiceを破棄して新しいURLで作り直させる
+        print(f"IRSA TAP URL set to {Irsa.tap_url}")
+
 
 def select_sample_stars(catalog_path, num_stars=100):
     """
@@ -76,7 +99,7 @@ def fetch_neowise_data(ra, dec, source_id):
         )
         
         if table is None or len(table) == 0:
-            print(f"    No NEOWISE data found")
+            print("    No NEOWISE data found")
             return None
         
         # データを整形
@@ -123,7 +146,7 @@ def fetch_asassn_data(ra, dec, source_id, gaia_id=None):
         )
         
         if lcs is None or len(lcs) == 0:
-            print(f"    No ASASSN data found")
+            print("    No ASASSN data found")
             return None
         
         # ライトカーブデータを整形
@@ -210,8 +233,22 @@ def main():
     # パスの設定
     script_dir = Path(__file__).parent
     project_dir = script_dir.parent.parent
-    catalog_path = project_dir / "BrightKg_WISE_unique.csv"
-    output_dir = script_dir.parent / "data"
+    
+    parser = argparse.ArgumentParser(description='NEOWISE/ASASSNのサンプルデータを取得してJSONで保存')
+    parser.add_argument('--catalog', type=str, default=str(project_dir / "BrightKg_WISE_unique.csv"),
+                        help='天体カタログ（CSV）')
+    parser.add_argument('--output-dir', type=str, default=str(script_dir.parent / "data"),
+                        help='出力ディレクトリ（neowise/ と asassn/ を作る）')
+    parser.add_argument('--num-stars', type=int, default=100, help='取得する星の数（デフォルト: 100）')
+    parser.add_argument('--irsa-url', type=str, default=os.environ.get('IRSA_URL', DEFAULT_IRSA_URL),
+                        help='IRSAのURL（環境変数 IRSA_URL でも指定可、ローカルのスタンドインを使う場合に指定）')
+    parser.add_argument('--delay', type=float, default=0.5, help='星ごとの待ち時間（秒、レート制限対策）')
+    parser.add_argument('--skip-asassn', action='store_true', help='ASASSNのデータを取得しない')
+    args = parser.parse_args()
+    
+    catalog_path = Path(args.catalog)
+    output_dir = Path(args.output_dir)
+    use_irsa_url(args.irsa_url)
     
     print("="*60)
     print("NEOWISE/ASASSN Sample Data Fetcher")
@@ -224,7 +261,7 @@ def main():
     asassn_dir.mkdir(parents=True, exist_ok=True)
     
     # サンプル星を選択
-    sample_stars = select_sample_stars(catalog_path, num_stars=100)
+    sample_stars = select_sample_stars(catalog_path, num_stars=args.num_stars)
     
     # 各星のデータを取得
     neowise_count = 0
@@ -256,7 +293,7 @@ def main():
             neowise_count += 1
         
         # ASASSN データ取得
-        asassn_data = fetch_asassn_data(ra, dec, source_id, gaia_id)
+        asassn_data = None if args.skip_asassn else fetch_asassn_data(ra, dec, source_id, gaia_id)
         if asassn_data and len(asassn_data) > 0:
             output_file = asassn_dir / f"{source_id}.json"
             with open(output_file, 'w') as f:
@@ -271,10 +308,10 @@ def main():
             asassn_count += 1
         
         # レート制限対策
-        time.sleep(0.5)
+        time.sleep(args.delay)
     
     print("\n" + "="*60)
-    print(f"Data fetching completed!")
+    print("Data fetching completed!")
     print(f"NEOWISE: {neowise_count} files saved to {neowise_dir}")
     print(f"ASASSN: {asassn_count} files saved to {asassn_dir}")
     print("="*60)
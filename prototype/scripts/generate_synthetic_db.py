@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+大規模な合成NEOWISEデータベースの生成（配信側のベンチマーク用）
+
+neowise_to_sqlite.py と同じスキーマ（sources / neowise_raw_observations /
+neowise_epoch_summary）で、N天体分の合成データを書き出す。
+app_custom.py をそのまま本番規模のDBで動かすためのもので、天体は全天に一様に分布する。
+
+ケイデンスはNEOWISEに合わせて約半年ごとのエポック、1エポックあたり10〜20回の観測（W1・W2）。
+等級は天体ごとの基準等級・変光（正弦波）・観測誤差から作る。
+生データはIRSAのテーブル（neowiser_p1bs_psd）と同じ列で作り、保存する行とエポック集約データは
+ingestの compute_source_rows() と同じ関数（EPOCH_KERNELS など）で計算する
+（デフォルトフィルタ → ゼロポイント補正 → 3σクリッピング → S/N判定）。
+ゼロポイント補正には、スキャンごとの合成の補正テーブルを使う。
+
+10⁶天体（既定で約6億行の生データ、数十GB）まで対応する。天体をchunkごとにまとめて
+ベクトル演算で作り、エポックはchunkごとに1回の集約で計算して、executemanyで挿入する。
+インデックスは挿入後にまとめて作成する。
+
+使用方法:
+    python generate_synthetic_db.py --sources 10000 --output synthetic_10k.db
+    python generate_synthetic_db.py --sources 1000000 --output synthetic_1m.db --chunk-size 5000
+    python generate_synthetic_db.py --sources 100000 --output epochs_only.db --no-raw
+"""
+
+import argparse
+import contextlib
+import io
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from neowise_to_sqlite import (
+    BATCH_EPOCH_KERNELS, DEFAULT_EPOCH_KERNEL, EPOCH_INSERT_SQL, EPOCH_KERNELS, RAW_INSERT_SQL,
+    create_neowise_database, epoch_summary_rows, raw_observation_rows
+)
+from zero_point import ZeroPointIndex
+
+MAX_SOURCES = 10 ** 6
+
+# NEOWISE（2013年12月〜2024年8月）：約半年ごとに同じ領域を観測
+FIRST_MJD = 56650.0
+EPOCH_INTERVAL_DAYS = 182.6
+DEFAULT_EPOCHS = 22
+DEFAULT_VISITS_MIN = 10
+DEFAULT_VISITS_MAX = 20
+
+# 1エポックの観測期間（日）
+EPOCH_WINDOW_DAYS = 1.5
+
+# W2が欠損する観測の割合
+W2_MISSING_RATE = 0.03
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# スキャンID（'12345a' 形式）。約1.5時間ごとに1スキャンとし、同じ時刻の観測は同じスキャンになる
+SCANS_PER_DAY = 16
+_scan_ids = np.array(
+    [f"{(i // 4) % 90000 + 10000:05d}{'abrs'[i % 4]}" for i in range(360000)], dtype=object
+)
+
+# 合成のゼロポイント補正値（w1dmag / w2dmag）の標準偏差
+ZP_DMAG_SIGMA = 0.003
+
+SOURCE_INSERT_SQL = '''
+    INSERT INTO sources (source_id, ra, dec, allwise_cntr)
+    VALUES (?, ?, ?, ?)
+'''
+
+
+def _flag_strings(rng: np.random.Generator, n: int, width: int, values: str, p: list) -> list:
+    """cc_flags（'0000'）・ph_qual（'AA'）のような固定長のフラグ文字列"""
+    codes = rng.choice(np.array(list(values)), p=p, size=(n, width))
+    return codes.view(f'<U{width}').ravel().tolist()
+
+
+def synthetic_zero_point_index(seed: int) -> ZeroPointIndex:
+    """_scan_idsの全スキャンの合成のゼロポイント補正テーブル（全観測が適用範囲に入る）"""
+    rng = np.random.default_rng([seed, MAX_SOURCES])  # chunkの乱数（[seed, 開始位置]）と重ならない
+    return ZeroPointIndex.from_frame(pd.DataFrame({
+        'scan_id': _scan_ids,
+        'mjd': FIRST_MJD - 1,
+        'w1dmag': np.round(rng.normal(0, ZP_DMAG_SIGMA, len(_scan_ids)), 4),
+        'w2dmag': np.round(rng.normal(0, ZP_DMAG_SIGMA, len(_scan_ids)), 4),
+    }))
+
+
+def generate_chunk(
+    rng: np.random.Generator,
+    source_ids: np.ndarray,
+    epochs: int,
+    visits_min: int,
+    visits_max: int,
+    zp_index: ZeroPointIndex,
+    with_raw: bool = True,
+    epoch_kernel: str = DEFAULT_EPOCH_KERNEL
+):
+    """
+    chunk分の天体について sources / raw / epoch の行を作る
+
+    IRSAのテーブルと同じ列の生データを作り、compute_source_rows() と同じ関数
+    （EPOCH_KERNELS / BATCH_EPOCH_KERNELS、raw_observation_rows()、epoch_summary_rows()）で行を作る。
+    天体ごとに compute_source_rows() を呼ぶとpandasの処理が天体数だけ繰り返されるため、chunk単位で呼ぶ
+
+    Returns:
+    --------
+    tuple
+        (sourcesの行, neowise_raw_observationsの行, neowise_epoch_summaryの行)
+    """
+    n = len(source_ids)
+    ids = source_ids.astype(str).astype(object)
+
+    # 全天に一様に分布
+    ra = np.round(rng.uniform(0, 360, n), 6).tolist()
+    dec = np.round(np.degrees(np.arcsin(rng.uniform(-1, 1, n))), 6).tolist()
+    allwise_cntr = rng.integers(10 ** 12, 10 ** 13, n)
+
+    # 天体ごとの明るさ・色・変光
+    w1_base = rng.uniform(7.5, 15.0, n)
+    w2_base = w1_base - rng.normal(0.15, 0.2, n)
+    amplitude = rng.exponential(0.05, n)
+    period = rng.uniform(50, 2000, n)
+    phase = rng.uniform(0, 2 * np.pi, n)
+    offset = rng.uniform(0, 60, n)  # 天体ごとのエポック開始のずれ（日）
+
+    # 観測（天体 → エポック → 観測 の順に並ぶ）
+    visits = rng.integers(visits_min, visits_max + 1, size=(n, epochs))
+    src = np.repeat(np.arange(n), visits.sum(axis=1))
+    epoch = np.repeat(np.tile(np.arange(epochs), n), visits.ravel())
+    total = len(src)
+    mjd = FIRST_MJD + offset[src] + EPOCH_INTERVAL_DAYS * epoch + rng.uniform(0, EPOCH_WINDOW_DAYS, total)
+    # エポック内をMJD順に
+    order = np.lexsort((mjd, epoch, src))
+    src, epoch, mjd = src[order], epoch[order], mjd[order]
+
+    variation = amplitude[src] * np.sin(2 * np.pi * mjd / period[src] + phase[src])
+    table = {'mjd': mjd}
+    for band, base in (('W1', w1_base), ('W2', w2_base)):
+        band_lower = band.lower()
+        sigma = np.round(np.clip(0.012 + 0.004 * 10 ** (0.4 * (base[src] - 11)), 0.005, 0.3), 3)
+        mag = np.round(base[src] + variation + rng.normal(0, 1, total) * sigma, 3)
+        if band == 'W2':
+            missing = rng.random(total) < W2_MISSING_RATE
+            mag[missing] = np.nan
+            sigma[missing] = np.nan
+        table[f'{band_lower}mpro'] = mag
+        table[f'{band_lower}sigmpro'] = sigma
+
+    # IRSAのテーブル（neowiser_p1bs_psd）と同じ列。フラグはW1・W2で1つの文字列
+    table_df = pd.DataFrame({
+        **table,
+        'cc_flags': _flag_strings(rng, total, 4, '0hdp', [0.9, 0.05, 0.03, 0.02]),
+        'ph_qual': _flag_strings(rng, total, 2, 'ABC', [0.9, 0.08, 0.02]),
+        'moon_masked': _flag_strings(rng, total, 2, '01', [0.92, 0.08]),
+        'sso_flg': rng.choice([0, 1], p=[0.98, 0.02], size=total),
+        'qi_fact': rng.choice([1.0, 0.5, 0.0], p=[0.85, 0.12, 0.03], size=total),
+        'saa_sep': np.round(rng.uniform(-30, 150, total), 3),
+        'w1sat': rng.choice([0.0, 0.05, 0.2], p=[0.93, 0.05, 0.02], size=total),
+        'w2sat': rng.choice([0.0, 0.05, 0.2], p=[0.93, 0.05, 0.02], size=total),
+        'w1rchi2': np.round(rng.gamma(2.0, 1.0, total), 3),
+        'w2rchi2': np.round(rng.gamma(2.0, 1.0, total), 3),
+        'qual_frame': rng.choice([0.0, 5.0, 10.0], p=[0.03, 0.12, 0.85], size=total),
+        'w1sky': np.round(rng.uniform(450, 750, total), 3),
+        'w2sky': np.round(rng.uniform(450, 750, total), 3),
+        'scan_id': _scan_ids[((mjd - FIRST_MJD) * SCANS_PER_DAY).astype(np.int64) % len(_scan_ids)],
+        'allwise_cntr': allwise_cntr[src],
+    })
+
+    source_rows = list(zip(ids.tolist(), ra, dec, allwise_cntr.tolist()))
+    raw_rows = raw_observation_rows(table_df, ids[src], zp_index) if with_raw else []
+
+    # エポック集約（ingestと同じ実装。まとめて集約できるカーネルはchunk全体を1回で集約する）
+    counts = np.bincount(src, minlength=n)
+    bounds = np.r_[0, np.cumsum(counts)]
+    aggregate_batch = BATCH_EPOCH_KERNELS.get(epoch_kernel)
+    # 集約カーネルの天体ごとの出力（"Found N good epochs ..."）は表示しない
+    with contextlib.redirect_stdout(io.StringIO()):
+        if aggregate_batch is not None:
+            results = aggregate_batch(table_df, ids.tolist(), counts.tolist(), zp_index)
+        else:
+            aggregate = EPOCH_KERNELS[epoch_kernel]
+            results = {
+                source_id: aggregate(table_df.iloc[bounds[i]:bounds[i + 1]].reset_index(drop=True), source_id, zp_index)
+                for i, source_id in enumerate(ids)
+            }
+
+    epoch_rows = []
+    for band_index, band in enumerate(['W1', 'W2']):
+        frames = [(source_id, results[source_id][band_index]) for source_id in ids]
+        frames = [(source_id, frame) for source_id, frame in frames if not frame.empty]
+        if frames:
+            result = pd.concat([frame for _, frame in frames], ignore_index=True)
+            band_ids = np.repeat([source_id for source_id, _ in frames], [len(frame) for _, frame in frames])
+            epoch_rows.extend(epoch_summary_rows(result, band_ids, band))
+
+    return source_rows, raw_rows, epoch_rows
+
+
+def generate_database(
+    output: str,
+    num_sources: int,
+    epochs: int = DEFAULT_EPOCHS,
+    visits_min: int = DEFAULT_VISITS_MIN,
+    visits_max: int = DEFAULT_VISITS_MAX,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    seed: int = 0,
+    with_raw: bool = True,
+    epoch_kernel: str = DEFAULT_EPOCH_KERNEL
+):
+    """
+    合成データベースを作成
+
+    Parameters:
+    -----------
+    output : str
+        出力するSQLiteファイルのパス（既存のファイルは置き換える）
+    num_sources : int
+        天体数（最大10⁶）
+    epochs : int
+        1天体あたりのエポック数
+    visits_min, visits_max : int
+        1エポックあたりの観測回数の範囲
+    chunk_size : int
+        1回にまとめて作成・挿入する天体数
+    seed : int
+        乱数シード（同じシードなら同じDB）
+    with_raw : bool
+        生データ（neowise_raw_observations）も作成するか
+    epoch_kernel : str
+        エポック集約の実装（EPOCH_KERNELSのキー、結果は同一）
+    """
+    if not 0 < num_sources <= MAX_SOURCES:
+        raise ValueError(f"num_sources must be between 1 and {MAX_SOURCES}")
+
+    path = Path(output)
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        Path(str(path) + suffix).unlink(missing_ok=True)
+
+    conn = create_neowise_database(output)
+    # インデックスは挿入後に作る（同じ定義で作り直すためスキーマは変わらない）
+    index_sql = [sql for (sql,) in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+    )]
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall():
+        conn.execute(f'DROP INDEX {name}')
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')  # 256 MiB
+
+    # Gaia DR3風の19桁のsource_id（昇順に挿入）
+    rng = np.random.default_rng(seed)
+    source_ids = np.sort(rng.choice(9 * 10 ** 17, size=num_sources, replace=False) + 10 ** 18)
+
+    print(f"Generating {num_sources} sources x {epochs} epochs x {visits_min}-{visits_max} visits "
+          f"({'raw + epochs' if with_raw else 'epochs only'}) -> {output}")
+    start_time = time.time()
+    num_raw = num_epoch = 0
+    zp_index = synthetic_zero_point_index(seed)
+
+    for start in range(0, num_sources, chunk_size):
+        chunk_rng = np.random.default_rng([seed, start])
+        source_rows, raw_rows, epoch_rows = generate_chunk(
+            chunk_rng, source_ids[start:start + chunk_size], epochs, visits_min, visits_max, zp_index,
+            with_raw, epoch_kernel
+        )
+        with conn:
+            conn.executemany(SOURCE_INSERT_SQL, source_rows)
+            conn.executemany(RAW_INSERT_SQL, raw_rows)
+            conn.executemany(EPOCH_INSERT_SQL, epoch_rows)
+        num_raw += len(raw_rows)
+        num_epoch += len(epoch_rows)
+
+        done = min(start + chunk_size, num_sources)
+        elapsed = time.time() - start_time
+        print(f"  {done}/{num_sources} sources, {num_raw} raw rows, {num_epoch} epoch rows "
+              f"({(num_raw + num_epoch) / max(elapsed, 1e-9):.0f} rows/sec)", flush=True)
+
+    print("Creating indexes...")
+    for sql in index_sql:
+        conn.execute(sql)
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.close()
+
+    elapsed = time.time() - start_time
+    print("\n=== Summary ===")
+    print(f"Database saved to: {output} ({path.stat().st_size / 1024 ** 2:.1f} MiB)")
+    print(f"Sources: {num_sources}")
+    print(f"Rows in neowise_raw_observations: {num_raw}")
+    print(f"Rows in neowise_epoch_summary: {num_epoch}")
+    print(f"Total time: {elapsed:.1f} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成NEOWISEデータベースを作成（配信側のベンチマーク用）')
+    parser.add_argument('--sources', '-n', type=int, required=True, help=f'天体数（最大{MAX_SOURCES}）')
+    parser.add_argument('--output', '-o', type=str, required=True, help='出力するSQLiteファイル')
+    parser.add_argument('--epochs', type=int, default=DEFAULT_EPOCHS, help=f'1天体あたりのエポック数（デフォルト: {DEFAULT_EPOCHS}）')
+    parser.add_argument('--visits-min', type=int, default=DEFAULT_VISITS_MIN, help='1エポックあたりの最少観測回数')
+    parser.add_argument('--visits-max', type=int, default=DEFAULT_VISITS_MAX, help='1エポックあたりの最多観測回数')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='1回に作成・挿入する天体数')
+    parser.add_argument('--seed', type=int, default=0, help='乱数シード')
+    parser.add_argument('--no-raw', action='store_true', help='生データを作成しない（エポック集約データのみ）')
+    parser.add_argument('--epoch-kernel', type=str, choices=list(EPOCH_KERNELS), default=DEFAULT_EPOCH_KERNEL,
+                        help='エポック集約の実装')
+    args = parser.parse_args()
+
+    if args.visits_min < 1 or args.visits_max < args.visits_min:
+        parser.error('--visits-min must be >= 1 and <= --visits-max')
+
+    generate_database(
+        args.output,
+        args.sources,
+        epochs=args.epochs,
+        visits_min=args.visits_min,
+        visits_max=args.visits_max,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+        with_raw=not args.no_raw,
+        epoch_kernel=args.epoch_kernel
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+NEOWISE ingest ベンチマーク
+
+mock_irsa_server.py のスタンドインに対して neowise_to_sqlite.py の各モードを実行し、
+sources/sec・rows/sec とステージごと（fetch / compute / write / commit）の p50/p95 を表示する。
+本物のIRSAには問い合わせない。
+
+モード:
+- sequential : 座標検索を1件ずつ（batch_process_sources）
+- parallel   : 取得スレッド → 計算スレッド → 書き込みスレッド（--parallel）
+- tap        : parallel + AllWISE ID検索（--parallel --use-tap）
+- async      : asyncioで取得（--async）
+- async-tap  : async + AllWISE ID検索 + 天体リストのアップロード（--async --use-tap --tap-batch-size）
+
+neowise_to_sqlite.py 以外の取得経路（DBは作らず、取得のみを計測する）:
+- fetch-sample : fetch_sample_data.py の fetch_neowise_data を1件ずつ
+- perf-region  : neowise_performance_test のバックエンド（/test-performance、method=query_region）
+- perf-tap     : neowise_performance_test のバックエンド（/test-performance、method=query_tap）
+
+sequential / parallel / tap と取得のみのモードは astroquery（0.4.7以降）が必要。無い場合はスキップする。
+perf-region / perf-tap はさらに fastapi が必要。async / async-tap は aiohttp が必要。
+ASAS-SN（fetch_sample_data.py の fetch_asassn_data、asassn_performance_test）は計測しない
+（スタンドインは SkyPatrol のAPIを模擬していないため）。
+
+使用方法:
+    python ingest_benchmark.py --sources 200 --latency 0.3
+    python ingest_benchmark.py --modes async,async-tap --sources 2000 --error-rate 0.05 --json result.json
+    python ingest_benchmark.py --modes fetch-sample,perf-region,perf-tap --sources 100
+    python ingest_benchmark.py --irsa-url http://127.0.0.1:8765   # 起動済みのスタンドインを使う
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+
+import neowise_to_sqlite as ingest
+from mock_irsa_server import DEFAULT_EPOCHS, DEFAULT_VISITS, MockIrsaConfig, MockIrsaServer, allwise_designation
+
+# neowise_to_sqlite.py 以外の取得経路（取得のみを計測）
+FETCH_MODES = ['fetch-sample', 'perf-region', 'perf-tap']
+MODES = ['sequential', 'parallel', 'tap', 'async', 'async-tap'] + FETCH_MODES
+
+PERF_TEST_APP = Path(__file__).resolve().parents[2] / 'neowise_performance_test' / 'backend' / 'app.py'
+
+# 結果の表に表示するステージ
+REPORT_STAGES = ['fetch', 'compute', 'write']
+
+
+def synthetic_sources(num_sources: int, seed: int = 0) -> List[tuple]:
+    """全天に一様に分布する天体リスト [(source_id, ra, dec, AllWISE_ID), ...]"""
+    rng = np.random.default_rng(seed)
+    ra = np.round(rng.uniform(0, 360, num_sources), 6)
+    dec = np.round(np.degrees(np.arcsin(rng.uniform(-1, 1, num_sources))), 6)
+    source_ids = rng.choice(10**18, size=num_sources, replace=False) + 10**18
+    return [
+        (str(source_id), float(r), float(d), allwise_designation(float(r), float(d)))
+        for source_id, r, d in zip(source_ids, ra, dec)
+    ]
+
+
+def load_perf_test_app(irsa_url: str):
+    """neowise_performance_test のバックエンドを IRSA_URL=irsa_url で読み込む（必要なライブラリが無ければImportError）"""
+    spec = importlib.util.spec_from_file_location('neowise_performance_app', PERF_TEST_APP)
+    module = importlib.util.module_from_spec(spec)
+    previous = os.environ.get('IRSA_URL')
+    os.environ['IRSA_URL'] = irsa_url
+    # app.py は同じディレクトリの metrics_exporter.py を読み込む
+    backend_dir = str(PERF_TEST_APP.parent)
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        if previous is None:
+            os.environ.pop('IRSA_URL', None)
+        else:
+            os.environ['IRSA_URL'] = previous
+    return module
+
+
+def run_fetch_mode(mode: str, source_list: List[tuple], irsa_url: str, args) -> Optional[Dict]:
+    """取得のみのモード（fetch_sample_data.py / neowise_performance_test）を実行（必要なライブラリが無ければNone）"""
+    stats = ingest.StageStats()
+    ingested = rows = 0
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output) if not args.verbose else contextlib.nullcontext():
+        if mode == 'fetch-sample':
+            import fetch_sample_data
+            missing = None if fetch_sample_data.NEOWISE_AVAILABLE else 'astroquery'  # 無い場合はダミーデータになる
+        else:
+            try:
+                app = load_perf_test_app(irsa_url)
+                missing = None
+            except ImportError as e:
+                missing = e.name
+    if missing:
+        print(f"  {mode}: skipped ({missing} not available)")
+        return None
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output) if not args.verbose else contextlib.nullcontext():
+        if mode == 'fetch-sample':
+            fetch_sample_data.use_irsa_url(irsa_url)
+            for source_id, ra, dec, _ in source_list:
+                with stats.timer('fetch'):
+                    observations = fetch_sample_data.fetch_neowise_data(ra, dec, source_id)
+                if observations:
+                    ingested += 1
+                    rows += len(observations)
+        else:
+            request = app.TestRequest(
+                catalog_entries=[
+                    app.CatalogEntry(source_id=source_id, ra=ra, dec=dec, allwise_id=allwise_id)
+                    for source_id, ra, dec, allwise_id in source_list
+                ],
+                method='query_region' if mode == 'perf-region' else 'query_tap'
+            )
+            result = asyncio.run(app.test_performance(request))
+            for r in result.results:
+                if r.success:
+                    stats.add('fetch', r.query_time)
+            ingested = result.successful_queries
+            rows = sum(r.num_observations for r in result.results)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'sources': len(source_list),
+        'ingested': ingested,
+        'seconds': elapsed,
+        'sources_per_sec': len(source_list) / elapsed,
+        'rows': rows,
+        'rows_per_sec': rows / elapsed,
+        'stages': stats.percentiles(),
+    }
+
+
+def run_mode(mode: str, source_list: List[tuple], db_path: str, irsa_url: str, args) -> Optional[Dict]:
+    """1つのモードを実行して計測結果を返す（必要なライブラリが無ければNone）"""
+    if mode in FETCH_MODES:
+        return run_fetch_mode(mode, source_list, irsa_url, args)
+    if mode in ('sequential', 'parallel', 'tap') and not ingest.ASTROQUERY_AVAILABLE:
+        print(f"  {mode}: skipped (astroquery not available)")
+        return None
+    if mode in ('async', 'async-tap') and not ingest.AIOHTTP_AVAILABLE:
+        print(f"  {mode}: skipped (aiohttp not available)")
+        return None
+
+    ingest.use_irsa_url(irsa_url)
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output) if not args.verbose else contextlib.nullcontext():
+        if mode == 'sequential':
+            ingest.batch_process_sources([s[:3] for s in source_list], db_path, epoch_kernel=args.epoch_kernel)
+        elif mode in ('parallel', 'tap'):
+            ingest.batch_process_sources_parallel(
+                source_list, db_path,
+                num_workers=args.workers,
+                use_tap=(mode == 'tap'),
+                compute_workers=args.compute_workers,
+                compute_processes=args.compute_processes,
+                epoch_kernel=args.epoch_kernel
+            )
+        else:
+            ingest.batch_process_sources_async(
+                source_list, db_path,
+                max_in_flight=args.max_in_flight,
+                use_tap=(mode == 'async-tap'),
+                irsa_url=irsa_url,
+                compute_workers=args.compute_workers,
+                tap_batch_size=args.tap_batch_size if mode == 'async-tap' else 1,
+                compute_processes=args.compute_processes,
+                epoch_kernel=args.epoch_kernel
+            )
+    elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(db_path)
+    rows = sum(
+        conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        for table in ('neowise_raw_observations', 'neowise_epoch_summary')
+    )
+    done = conn.execute("SELECT COUNT(*) FROM ingest_state WHERE status != 'error'").fetchone()[0]
+    conn.close()
+
+    return {
+        'mode': mode,
+        'sources': len(source_list),
+        'ingested': done,
+        'seconds': elapsed,
+        'sources_per_sec': len(source_list) / elapsed,
+        'rows': rows,
+        'rows_per_sec': rows / elapsed,
+        'stages': ingest.stage_stats.percentiles(),
+    }
+
+
+def print_results(results: List[Dict]):
+    header = f"{'mode':<12} {'sources':>8} {'ok':>6} {'time[s]':>8} {'src/s':>8} {'rows/s':>9} {'requests':>9}"
+    for stage in REPORT_STAGES:
+        header += f" {stage + ' p50/p95[ms]':>22}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        line = (f"{r['mode']:<12} {r['sources']:>8} {r['ingested']:>6} {r['seconds']:>8.2f} "
+                f"{r['sources_per_sec']:>8.1f} {r['rows_per_sec']:>9.0f} {r['server']['requests']:>9}")
+        for stage in REPORT_STAGES:
+            p = r['stages'].get(stage)
+            cell = f"{p['p50'] * 1000:.1f}/{p['p95'] * 1000:.1f}" if p else '-'
+            line += f" {cell:>22}"
+        print(line)
+
+
+def server_stats(irsa_url: str, server: Optional[MockIrsaServer]) -> Dict:
+    if server is not None:
+        return server.stats_snapshot()
+    try:
+        return requests.get(f"{irsa_url.rstrip('/')}/stats", timeout=10).json()
+    except Exception:
+        return {'requests': 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NEOWISE ingestのベンチマーク（ローカルのIRSAスタンドインを使用）')
+    parser.add_argument('--modes', type=str, default=','.join(MODES), help=f'実行するモード（カンマ区切り: {",".join(MODES)}）')
+    parser.add_argument('--sources', type=int, default=200, help='天体数（デフォルト: 200）')
+    parser.add_argument('--seed', type=int, default=0, help='天体リストの乱数シード')
+    parser.add_argument('--irsa-url', type=str, default=None, help='起動済みのスタンドインのURL（省略時は内部で起動）')
+    parser.add_argument('--latency', type=float, default=0.2, help='スタンドイン: 1リクエストあたりの平均遅延（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='スタンドイン: 502を返す割合')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='スタンドイン: 応答せずに切断する割合')
+    parser.add_argument('--hang-seconds', type=float, default=5.0, help='スタンドイン: タイムアウト模擬時に待つ秒数')
+    parser.add_argument('--epochs', type=int, default=DEFAULT_EPOCHS, help='スタンドイン: 1天体あたりのエポック数')
+    parser.add_argument('--visits', type=int, default=DEFAULT_VISITS, help='スタンドイン: 1エポックあたりの観測回数')
+    parser.add_argument('--workers', type=int, default=4, help='parallel / tap: 取得ワーカー数')
+    parser.add_argument('--compute-workers', type=int, default=None, help='エポック集約のワーカー数')
+    parser.add_argument('--compute-processes', type=int, nargs='?', const=os.cpu_count() or 1, default=None,
+                        help='エポック集約を別プロセスで行う（プロセス数、省略時はCPUコア数）')
+    parser.add_argument('--epoch-kernel', type=str, choices=list(ingest.EPOCH_KERNELS), default=ingest.DEFAULT_EPOCH_KERNEL,
+                        help='エポック集約の実装')
+    parser.add_argument('--max-in-flight', type=int, default=ingest.DEFAULT_MAX_IN_FLIGHT, help='async: 同時リクエスト数')
+    parser.add_argument('--tap-batch-size', type=int, default=100, help='async-tap: 1クエリにまとめる天体数')
+    parser.add_argument('--json', type=str, default=None, help='結果をJSONで保存するパス')
+    parser.add_argument('--keep-db', type=str, default=None, help='出力DBを残すディレクトリ')
+    parser.add_argument('--verbose', action='store_true', help='ingestの出力・ログを表示')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    server = None
+    irsa_url = args.irsa_url
+    if irsa_url is None:
+        server = MockIrsaServer(MockIrsaConfig(
+            latency=args.latency,
+            error_rate=args.error_rate,
+            timeout_rate=args.timeout_rate,
+            hang_seconds=args.hang_seconds,
+            epochs=args.epochs,
+            visits=args.visits
+        ))
+        server.start()
+        irsa_url = server.url
+
+    source_list = synthetic_sources(args.sources, args.seed)
+    print(f"Benchmarking {len(source_list)} sources against {irsa_url} "
+          f"(latency={args.latency}s, error_rate={args.error_rate}, timeout_rate={args.timeout_rate})")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_dir = Path(args.keep_db or tmp_dir)
+        db_dir.mkdir(parents=True, exist_ok=True)
+        for mode in modes:
+            db_path = str(db_dir / f"bench_{mode}.db")
+            Path(db_path).unlink(missing_ok=True)
+            before = server_stats(irsa_url, server)
+            result = run_mode(mode, source_list, db_path, irsa_url, args)
+            if result is None:
+                continue
+            after = server_stats(irsa_url, server)
+            result['server'] = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+            results.append(result)
+            print(f"  {mode}: {result['seconds']:.2f} s")
+
+    if server is not None:
+        server.stop()
+
+    print()
+    if results:
+        print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
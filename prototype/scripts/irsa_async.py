@@ -0,0 +1,295 @@
+"""
+IRSA TAP 非同期クライアント（aiohttp）
+
+neowise_to_sqlite.py の --async モードで使用する。
+座標検索・AllWISE ID検索のいずれもIRSAのTAP同期エンドポイント（/TAP/sync）に
+ADQLを送り、CSVで受け取ってDataFrameに変換する。
+
+- 1つのClientSession（コネクションプール）を全リクエストで共有
+- 同時に発行するリクエスト数をasyncio.Semaphoreで制限
+- 429/5xx・タイムアウト・接続エラーは asyncio.sleep による指数バックオフで再試行
+  （スレッドをブロックしない）
+- 複数の天体をVOTableでアップロード（TAP_UPLOAD）し、1クエリで座標またはAllWISE IDで
+  結合して取得できる（--tap-batch-size）。結果はtarget_id列で天体ごとに分割する
+
+base_url を変えるとローカルのスタンドインサーバーに向けられる。
+"""
+
+import asyncio
+import io
+import logging
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+# aiohttpは利用可能な場合のみインポート
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+DEFAULT_IRSA_URL = "https://irsa.ipac.caltech.edu"
+TAP_SYNC_PATH = "/TAP/sync"
+NEOWISE_TABLE = "neowiser_p1bs_psd"
+
+# 座標検索の半径（fetch_neowise_region と同じ5秒角）
+CONE_RADIUS_DEG = 5.0 / 3600.0
+
+# TAP_UPLOADで送る天体リストのテーブル名
+UPLOAD_TABLE = "targets"
+
+# 再試行するHTTPステータス
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# CSVで数値として読まれると壊れる列（'0000' → 0 など）
+STRING_COLUMNS = {
+    "cc_flags": str,
+    "ph_qual": str,
+    "moon_masked": str,
+    "scan_id": str,
+    "designation": str,
+    "target_id": str,
+}
+
+
+def _since_clause(since_mjd: Optional[float]) -> str:
+    """since_mjdより新しい観測に絞る条件（--update 用）"""
+    return f" AND mjd > {since_mjd!r}" if since_mjd is not None else ""
+
+
+def cone_query(ra: float, dec: float, radius_deg: float = CONE_RADIUS_DEG, since_mjd: Optional[float] = None) -> str:
+    """座標検索のADQL"""
+    return (
+        f"SELECT * FROM {NEOWISE_TABLE} "
+        f"WHERE CONTAINS(POINT('ICRS', ra, dec), CIRCLE('ICRS', {ra!r}, {dec!r}, {radius_deg!r})) = 1"
+        f"{_since_clause(since_mjd)} "
+        f"ORDER BY mjd"
+    )
+
+
+def designation_query(allwise_id: str, since_mjd: Optional[float] = None) -> str:
+    """AllWISE ID（designation）検索のADQL"""
+    allwise_id = allwise_id.replace("'", "''")
+    return (
+        f"SELECT * FROM {NEOWISE_TABLE} WHERE designation = '{allwise_id}'"
+        f"{_since_clause(since_mjd)} ORDER BY mjd"
+    )
+
+
+def cone_upload_query(radius_deg: float = CONE_RADIUS_DEG) -> str:
+    """
+    アップロードした天体リスト（target_id, ra, dec, since_mjd）と座標で結合するADQL
+
+    since_mjdは天体ごとの「これより新しい観測のみ」の条件（不要なら0）
+    """
+    return (
+        f"SELECT t.target_id, n.* FROM {NEOWISE_TABLE} AS n "
+        f"JOIN TAP_UPLOAD.{UPLOAD_TABLE} AS t "
+        f"ON CONTAINS(POINT('ICRS', n.ra, n.dec), CIRCLE('ICRS', t.ra, t.dec, {radius_deg!r})) = 1 "
+        f"WHERE n.mjd > t.since_mjd "
+        f"ORDER BY t.target_id, n.mjd"
+    )
+
+
+def designation_upload_query() -> str:
+    """アップロードした天体リスト（target_id, designation, since_mjd）とAllWISE IDで結合するADQL"""
+    return (
+        f"SELECT t.target_id, n.* FROM {NEOWISE_TABLE} AS n "
+        f"JOIN TAP_UPLOAD.{UPLOAD_TABLE} AS t ON n.designation = t.designation "
+        f"WHERE n.mjd > t.since_mjd "
+        f"ORDER BY t.target_id, n.mjd"
+    )
+
+
+def targets_votable(columns: List[Tuple[str, str]], rows: List[tuple]) -> bytes:
+    """
+    TAP_UPLOAD用のVOTable（TABLEDATA形式）を作成
+
+    Parameters:
+    -----------
+    columns : list
+        [(列名, VOTableのdatatype), ...]。datatypeは "char" または "double"
+    rows : list
+        各行の値のタプル
+    """
+    fields = "".join(
+        f'<FIELD name="{name}" datatype="{datatype}" arraysize="*"/>' if datatype == "char"
+        else f'<FIELD name="{name}" datatype="{datatype}"/>'
+        for name, datatype in columns
+    )
+    table_rows = "".join(
+        "<TR>" + "".join(f"<TD>{escape(repr(v) if isinstance(v, float) else str(v))}</TD>" for v in row) + "</TR>"
+        for row in rows
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">'
+        f'<RESOURCE><TABLE name="{UPLOAD_TABLE}">{fields}'
+        f"<DATA><TABLEDATA>{table_rows}</TABLEDATA></DATA>"
+        "</TABLE></RESOURCE></VOTABLE>"
+    ).encode("utf-8")
+
+
+def split_by_target(df: pd.DataFrame, target_ids: List[str]) -> Dict[str, pd.DataFrame]:
+    """結合クエリの結果をtarget_idごとに分割（該当なしの天体は空のDataFrame）"""
+    results = {target_id: pd.DataFrame() for target_id in target_ids}
+    if df.empty:
+        return results
+    for target_id, group in df.groupby("target_id", sort=False):
+        if target_id in results:
+            results[target_id] = group.drop(columns="target_id").reset_index(drop=True)
+    return results
+
+
+def parse_tap_csv(text: str) -> pd.DataFrame:
+    """TAPのCSVレスポンスをDataFrameに変換（フラグ列は文字列のまま、数値は桁落ちなし）"""
+    if not text.strip():
+        return pd.DataFrame()
+    return pd.read_csv(
+        io.StringIO(text),
+        dtype=STRING_COLUMNS,
+        keep_default_na=False,
+        na_values=["", "null", "NaN", "nan"],
+        float_precision="round_trip",
+    )
+
+
+class TapQueryError(Exception):
+    """再試行しても成功しなかったTAPクエリ"""
+
+
+class AsyncIrsaClient:
+    """
+    IRSA TAP の非同期クライアント
+
+    async with で使用する::
+
+        async with AsyncIrsaClient(max_in_flight=64) as client:
+            df = await client.query(cone_query(ra, dec))
+
+    Parameters:
+    -----------
+    base_url : str
+        IRSAのベースURL（ローカルのスタンドインサーバーも指定可）
+    max_in_flight : int
+        同時に発行するリクエスト数の上限
+    max_attempts : int
+        1クエリあたりの最大試行回数
+    backoff_factor : float
+        再試行の待ち時間の係数（backoff_factor × 2**attempt 秒）
+    timeout : float
+        1リクエストのタイムアウト（秒）
+    """
+
+    def __init__(
+        self,
+        base_url: str = DEFAULT_IRSA_URL,
+        max_in_flight: int = 32,
+        max_attempts: int = 4,
+        backoff_factor: float = 1.0,
+        timeout: float = 120.0,
+    ):
+        if not AIOHTTP_AVAILABLE:
+            raise RuntimeError("aiohttp is required for the async IRSA client")
+        self.tap_url = base_url.rstrip("/") + TAP_SYNC_PATH
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session = None
+        self.requests = 0
+        self.retries = 0
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+
+    async def query(self, adql: str, upload: Optional[bytes] = None) -> pd.DataFrame:
+        """
+        ADQLを実行し、結果をDataFrameで返す（失敗時はTapQueryError）
+
+        uploadにVOTableを渡すと TAP_UPLOAD.targets として参照できる
+        """
+        params = {"REQUEST": "doQuery", "LANG": "ADQL", "FORMAT": "csv", "QUERY": adql}
+        if upload is not None:
+            params["UPLOAD"] = f"{UPLOAD_TABLE},param:{UPLOAD_TABLE}"
+        last_error = None
+
+        for attempt in range(self.max_attempts):
+            if upload is None:
+                data = params
+            else:
+                # multipart/form-data（FormDataは再送できないため試行ごとに作る）
+                data = aiohttp.FormData(params)
+                data.add_field(UPLOAD_TABLE, upload, filename=f"{UPLOAD_TABLE}.xml",
+                               content_type="application/x-votable+xml")
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    async with self._session.post(self.tap_url, data=data) as response:
+                        text = await response.text()
+                        if response.status == 200:
+                            return parse_tap_csv(text)
+                        last_error = f"HTTP {response.status}"
+                        if response.status not in RETRY_STATUSES:
+                            break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = f"{type(e).__name__}: {e}"
+
+            if attempt < self.max_attempts - 1:
+                wait_time = self.backoff_factor * 2 ** attempt
+                self.retries += 1
+                logging.warning(f"TAP query failed ({last_error}). Retrying in {wait_time}s...")
+                await asyncio.sleep(wait_time)
+
+        raise TapQueryError(last_error)
+
+    async def fetch_region(self, ra: float, dec: float, since_mjd: Optional[float] = None) -> pd.DataFrame:
+        """座標検索（半径5秒角）。since_mjdを指定するとそれより新しい観測のみ"""
+        return await self.query(cone_query(ra, dec, since_mjd=since_mjd))
+
+    async def fetch_designation(self, allwise_id: str, since_mjd: Optional[float] = None) -> pd.DataFrame:
+        """AllWISE ID検索。since_mjdを指定するとそれより新しい観測のみ"""
+        return await self.query(designation_query(allwise_id, since_mjd))
+
+    async def fetch_region_batch(
+        self, targets: List[Tuple[str, float, float, Optional[float]]]
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        複数の天体を1クエリで座標検索（半径5秒角）
+
+        targets: [(target_id, ra, dec, since_mjd), ...]。target_id → 生データ を返す
+        """
+        upload = targets_votable(
+            [("target_id", "char"), ("ra", "double"), ("dec", "double"), ("since_mjd", "double")],
+            [(t, float(ra), float(dec), float(since or 0.0)) for t, ra, dec, since in targets],
+        )
+        df = await self.query(cone_upload_query(), upload)
+        return split_by_target(df, [t[0] for t in targets])
+
+    async def fetch_designation_batch(
+        self, targets: List[Tuple[str, str, Optional[float]]]
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        複数の天体を1クエリでAllWISE ID検索
+
+        targets: [(target_id, allwise_id, since_mjd), ...]。target_id → 生データ を返す
+        """
+        upload = targets_votable(
+            [("target_id", "char"), ("designation", "char"), ("since_mjd", "double")],
+            [(t, allwise_id, float(since or 0.0)) for t, allwise_id, since in targets],
+        )
+        df = await self.query(designation_upload_query(), upload)
+        return split_by_target(df, [t[0] for t in targets])
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+NEOWISEデータベースのv1 → v2スキーマ変換
+
+neowise_to_sqlite.py が書き出すv1のDB（TEXTのsource_id・bandを全行に持ち、
+AUTOINCREMENTの行に単一列インデックスを張る）を、v2スキーマ
+（create_neowise_database_v2: 整数のsource_key・整数のバンド、
+主キー (source_key, band, mjd) で格納するWITHOUT ROWIDテーブル）の新しいファイルに変換する。
+
+- sources.id をそのままsource_keyにする（天体の順番・IDは変わらない）
+- 天体をchunkごとに主キーの順に並べて挿入する（B-treeの末尾への追加だけになり、ページが詰まる）
+- sourcesに無い天体の観測・エポック（孤立行）は変換せず、件数を表示する
+- 同じ天体・バンド・エポック・フィルタのエポックが重複している場合（ingest_state導入前の再実行で
+  追記された行）は最後に書かれた行だけを変換し、除いた件数を表示する
+- ingest_stateが無い古いDBでは、ingest_stateは空のまま変換する
+- 変換後に行数を照合し、一致した場合だけ PRAGMA user_version を SCHEMA_V2 にする
+- 出力先と同じディレクトリの一時ファイルに変換し、コミットが終わってから出力先に置き換える
+  （途中で失敗しても書きかけのファイルは残らない）
+
+app_custom.py はどちらのスキーマのDBも配信できる。ingestはv1のDBに行い、変換し直すこと。
+
+使用方法:
+    python migrate_neowise_db.py --input neowise.db --output neowise_v2.db
+    python migrate_neowise_db.py --input synthetic_1m.db --output synthetic_1m_v2.db --chunk-size 5000
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from neowise_to_sqlite import BAND_CODES, SCHEMA_V2, create_neowise_database_v2, schema_version
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# v1のband（'W1' / 'W2'）→ v2のバンド番号
+BAND_CASE = "CASE {column} " + " ".join(f"WHEN '{band}' THEN {code}" for band, code in BAND_CODES.items()) + " END"
+
+RAW_MIGRATE_SQL = f'''
+    INSERT INTO neowise_raw_observations
+    (source_key, band, mjd, dup, mpro, sigmpro, cc_flags, ph_qual, moon_masked,
+     sso_flg, qi_fact, saa_sep, sat, rchi2, qual_frame, sky, scan_id, mpro_corrected)
+    SELECT s.id, {BAND_CASE.format(column='r.band')}, r.mjd,
+           ROW_NUMBER() OVER (PARTITION BY s.id, r.band, r.mjd ORDER BY r.id) - 1,
+           r.mpro, r.sigmpro, r.cc_flags, r.ph_qual, r.moon_masked,
+           r.sso_flg, r.qi_fact, r.saa_sep, r.sat, r.rchi2, r.qual_frame, r.sky, r.scan_id, r.mpro_corrected
+    FROM v1.sources s
+    JOIN v1.neowise_raw_observations r ON r.source_id = s.source_id
+    WHERE s.id BETWEEN ? AND ?
+    ORDER BY 1, 2, 3, 4
+'''
+
+# 重複したエポックは最後に書かれた行（idが最大）だけを変換する
+EPOCH_MIGRATE_SQL = f'''
+    INSERT INTO neowise_epoch_summary
+    (source_key, band, epoch_id, filter_applied, mjd_mean, mag_mean, mag_se, mag_lim, n_points, snr)
+    SELECT source_key, band, epoch_id, filter_applied, mjd_mean, mag_mean, mag_se, mag_lim, n_points, snr
+    FROM (
+        SELECT s.id AS source_key, {BAND_CASE.format(column='e.band')} AS band, e.epoch_id,
+               COALESCE(e.filter_applied, 'default') AS filter_applied,
+               e.mjd_mean, e.mag_mean, e.mag_se, e.mag_lim, e.n_points, e.snr,
+               ROW_NUMBER() OVER (PARTITION BY s.id, e.band, e.epoch_id, COALESCE(e.filter_applied, 'default')
+                                  ORDER BY e.id DESC) AS rn
+        FROM v1.sources s
+        JOIN v1.neowise_epoch_summary e ON e.source_id = s.source_id
+        WHERE s.id BETWEEN ? AND ?
+    )
+    WHERE rn = 1
+    ORDER BY 1, 2, 3, 4
+'''
+
+# 重複していて変換されないエポックの行数（孤立行を除く）
+DUPLICATE_EPOCH_SQL = '''
+    SELECT COUNT(*) - (
+        SELECT COUNT(*) FROM (
+            SELECT DISTINCT source_id, band, epoch_id, COALESCE(filter_applied, 'default')
+            FROM v1.neowise_epoch_summary
+            WHERE source_id IN (SELECT source_id FROM v1.sources)
+        )
+    )
+    FROM v1.neowise_epoch_summary
+    WHERE source_id IN (SELECT source_id FROM v1.sources)
+'''
+
+# sourcesに登録されていない天体の行（変換されない）
+ORPHAN_SQL = '''
+    SELECT COUNT(*) FROM v1.{table}
+    WHERE source_id NOT IN (SELECT source_id FROM v1.sources)
+'''
+
+
+def _count(conn: sqlite3.Connection, table: str) -> int:
+    return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def _has_table(conn: sqlite3.Connection, schema: str, table: str) -> bool:
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,)).fetchone() is not None
+
+
+def migrate_database(input_path: str, output_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> bool:
+    """
+    v1のDBをv2スキーマの新しいファイルに変換する
+
+    出力先の隣の一時ファイルに書き、コミットが終わってから output_path に置き換える。
+    例外で中断した場合は一時ファイルを削除し、既存の output_path はそのまま残る
+
+    Returns:
+    --------
+    bool
+        行数の照合まで成功したか
+    """
+    start_time = time.time()
+    output = Path(output_path)
+    tmp_path = output.with_name(f"{output.name}.tmp-{os.getpid()}")
+    tmp_path.unlink(missing_ok=True)
+    try:
+        ok, counts = _migrate(input_path, str(tmp_path), chunk_size, start_time)
+        os.replace(tmp_path, output)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    num_sources, num_raw, num_epoch = counts
+
+    elapsed = time.time() - start_time
+    input_size = Path(input_path).stat().st_size
+    output_size = output.stat().st_size
+    print("\n=== Summary ===")
+    print(f"Database saved to: {output_path}")
+    print(f"Sources: {num_sources}")
+    print(f"Rows in neowise_raw_observations: {num_raw}")
+    print(f"Rows in neowise_epoch_summary: {num_epoch}")
+    print(f"Size: {input_size / 1024 ** 2:.1f} MiB (v1) -> {output_size / 1024 ** 2:.1f} MiB (v2), "
+          f"{output_size / input_size:.0%}")
+    print(f"Total time: {elapsed:.1f} seconds")
+    if not ok:
+        print("Migration incomplete: user_version was not set. Check the errors above.")
+    return ok
+
+
+def _migrate(input_path: str, output_path: str, chunk_size: int, start_time: float):
+    """output_path（一時ファイル）に変換し、(照合の成否, (天体数, 観測の行数, エポックの行数)) を返す"""
+    conn = create_neowise_database_v2(output_path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')  # 256 MiB
+    conn.execute('ATTACH DATABASE ? AS v1', (f"file:{Path(input_path).resolve()}?mode=ro",))
+
+    conn.execute('''
+        INSERT INTO sources (id, source_id, ra, dec, allwise_cntr, created_at)
+        SELECT id, source_id, ra, dec, allwise_cntr, created_at FROM v1.sources ORDER BY id
+    ''')
+    # ingest_stateはingest_state導入前のDBには無い
+    if _has_table(conn, 'v1', 'ingest_state'):
+        conn.execute('INSERT INTO ingest_state SELECT * FROM v1.ingest_state')
+    else:
+        print("Note: the input has no ingest_state table; ingest_state is left empty")
+    conn.commit()
+
+    min_id, max_id = conn.execute('SELECT MIN(id), MAX(id) FROM sources').fetchone()
+    num_sources = _count(conn, 'sources')
+    print(f"Migrating {num_sources} sources from {input_path} to the v2 schema...")
+
+    num_raw = num_epoch = 0
+    if num_sources:
+        for first in range(min_id, max_id + 1, chunk_size):
+            last = first + chunk_size - 1
+            num_raw += conn.execute(RAW_MIGRATE_SQL, (first, last)).rowcount
+            num_epoch += conn.execute(EPOCH_MIGRATE_SQL, (first, last)).rowcount
+            conn.commit()
+            print(f"  {min(last, max_id) - min_id + 1}/{max_id - min_id + 1} source ids, "
+                  f"{num_raw} raw rows, {num_epoch} epoch rows ({time.time() - start_time:.1f} s)")
+
+    # 行数の照合（孤立行・重複したエポックは変換しないので差し引く）
+    ok = True
+    for table, migrated in [('neowise_raw_observations', num_raw), ('neowise_epoch_summary', num_epoch)]:
+        total = _count(conn, f'v1.{table}')
+        orphans = conn.execute(ORPHAN_SQL.format(table=table)).fetchone()[0]
+        if orphans:
+            print(f"Warning: {orphans} rows in {table} have no entry in sources and were not migrated")
+        duplicates = 0
+        if table == 'neowise_epoch_summary':
+            duplicates = conn.execute(DUPLICATE_EPOCH_SQL).fetchone()[0]
+            if duplicates:
+                print(f"Warning: {duplicates} duplicate rows in {table} were dropped (kept the latest row)")
+        expected = total - orphans - duplicates
+        if migrated != expected:
+            print(f"Error: {table}: migrated {migrated} rows, expected {expected}")
+            ok = False
+
+    conn.execute('DETACH DATABASE v1')
+    if ok:
+        print("Analyzing...")
+        conn.execute('ANALYZE')
+        conn.execute(f'PRAGMA user_version = {SCHEMA_V2}')
+    conn.commit()
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.close()
+    return ok, (num_sources, num_raw, num_epoch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NEOWISEデータベースをv2スキーマ（整数キー・WITHOUT ROWID）に変換')
+    parser.add_argument('--input', '-i', type=str, required=True, help='v1のSQLiteファイル')
+    parser.add_argument('--output', '-o', type=str, required=True, help='出力するv2のSQLiteファイル')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'1トランザクションで変換する天体数（デフォルト: {DEFAULT_CHUNK_SIZE}）')
+    parser.add_argument('--force', action='store_true', help='出力ファイルがあれば上書き')
+    args = parser.parse_args()
+
+    version = schema_version(args.input)
+    if version is None:
+        print(f"Error: {args.input} not found")
+        return
+    if version == SCHEMA_V2:
+        print(f"{args.input} already uses the v2 schema")
+        return
+    # --force の場合も既存のファイルは変換が終わってから置き換える
+    if Path(args.output).exists() and not args.force:
+        print(f"Error: {args.output} already exists (use --force to overwrite)")
+        return
+
+    migrate_database(args.input, args.output, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+IRSA TAP のローカルスタンドイン（ベンチマーク・動作確認用）
+
+本物のIRSAに問い合わせずに neowise_to_sqlite.py などを計測するため、
+TAP同期エンドポイント（/TAP/sync）で neowiser_p1bs_psd 風の合成データを返す。
+
+対応するクエリ:
+- 座標検索（CONTAINS(POINT(...), CIRCLE('ICRS', ra, dec, r)) = 1）
+  astroquery の Irsa.query_region も TAP でこの形のADQLを送る
+- AllWISE ID検索（designation = 'J...'）
+- 天体リストのアップロード（TAP_UPLOAD.targets）と座標・AllWISE IDでの結合
+- いずれも "mjd > x"（天体リストの場合は since_mjd 列）で新しい観測のみに絞り込み
+
+出力形式はFORMATパラメータに従う（csv、それ以外はVOTable）。
+合成データは座標（AllWISE ID）から決まる乱数で作るため、同じ天体には常に同じ行を返す。
+
+遅延・エラー率（502）・タイムアウト（応答せずに切断）・行数・データなしの割合を設定できる。
+GET /stats でリクエスト数などの統計を返す。
+
+neowise_to_sqlite.py（--irsa-url）のほか、fetch_sample_data.py（--irsa-url）と
+neowise_performance_test のバックエンド（環境変数 IRSA_URL）の問い合わせ先にも指定できる。
+ingest_benchmark.py はこれらをまとめて計測する。
+
+※ ASAS-SN SkyPatrol（pyasassn）のAPIは模擬していない。問い合わせ先も応答形式もpyasassnの内部実装で、
+  公開された仕様が無いため。fetch_asassn_data・asassn_performance_test は計測の対象外
+
+使用方法:
+    python mock_irsa_server.py --port 8765 --latency 0.2 --error-rate 0.05
+    python neowise_to_sqlite.py --sources sources.csv --output test.db --async --irsa-url http://127.0.0.1:8765
+    python fetch_sample_data.py --num-stars 20 --irsa-url http://127.0.0.1:8765 --skip-asassn
+    IRSA_URL=http://127.0.0.1:8765 python ../../neowise_performance_test/backend/app.py
+"""
+
+import argparse
+import email.parser
+import email.policy
+import io
+import json
+import random
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PORT = 8765
+TAP_SYNC_PATH = "/TAP/sync"
+NEOWISE_TABLE = "neowiser_p1bs_psd"
+
+# 合成データの既定値（1天体あたり 20エポック × 12回 × 2バンド）
+DEFAULT_EPOCHS = 20
+DEFAULT_VISITS = 12
+
+# NEOWISEの観測開始（2013年12月）と半年ごとの再訪
+FIRST_MJD = 56650.0
+EPOCH_INTERVAL_DAYS = 182.6
+
+VOTABLE_NS = "{http://www.ivoa.net/xml/VOTable/v1.3}"
+
+CIRCLE_PATTERN = re.compile(
+    r"CIRCLE\(\s*'ICRS'\s*,\s*([-+\d.eE]+)\s*,\s*([-+\d.eE]+)\s*,\s*([-+\d.eE]+)\s*\)", re.IGNORECASE
+)
+DESIGNATION_PATTERN = re.compile(r"designation\s*=\s*'([^']+)'", re.IGNORECASE)
+SINCE_PATTERN = re.compile(r"\bmjd\s*>\s*([-+\d.eE]+)", re.IGNORECASE)
+
+
+def allwise_designation(ra: float, dec: float) -> str:
+    """座標からAllWISE形式のID（Jhhmmss.ss+ddmmss.s）を作る"""
+    # 赤経は0.01秒、赤緯は0.1秒角単位の整数にしてから分解する（59.995秒 → "60.00" を防ぐ）
+    ra_cs = int(round((ra % 360.0) / 15.0 * 3600 * 100)) % (24 * 3600 * 100)
+    h, rest = divmod(ra_cs, 3600 * 100)
+    m, s = divmod(rest, 60 * 100)
+    sign = "+" if dec >= 0 else "-"
+    dec_ds = int(round(abs(dec) * 3600 * 10))
+    d, rest = divmod(dec_ds, 3600 * 10)
+    dm, ds = divmod(rest, 60 * 10)
+    return f"J{h:02d}{m:02d}{s // 100:02d}.{s % 100:02d}{sign}{d:02d}{dm:02d}{ds // 10:02d}.{ds % 10}"
+
+
+def designation_position(designation: str) -> Optional[tuple]:
+    """AllWISE形式のIDから座標（度）を復元（形式が違えばNone）"""
+    match = re.fullmatch(r"J(\d{2})(\d{2})(\d{2}\.\d{2})([+-])(\d{2})(\d{2})(\d{2}\.\d)", designation.strip())
+    if match is None:
+        return None
+    h, m, s, sign, d, dm, ds = match.groups()
+    ra = (int(h) + int(m) / 60 + float(s) / 3600) * 15.0
+    dec = int(d) + int(dm) / 60 + float(ds) / 3600
+    return ra, -dec if sign == "-" else dec
+
+
+def synthetic_neowise_rows(
+    ra: float,
+    dec: float,
+    epochs: int = DEFAULT_EPOCHS,
+    visits: int = DEFAULT_VISITS,
+    empty_rate: float = 0.0
+) -> pd.DataFrame:
+    """
+    1天体分の neowiser_p1bs_psd 風の合成データ
+
+    乱数はAllWISE IDから決めるため、座標検索・ID検索・アップロードのどれでも同じ行になる
+    """
+    designation = allwise_designation(ra, dec)
+    rng = np.random.default_rng(zlib.crc32(designation.encode()))
+    if rng.random() < empty_rate:
+        return pd.DataFrame()
+
+    mjd = np.concatenate([
+        FIRST_MJD + EPOCH_INTERVAL_DAYS * e + np.sort(rng.uniform(0, 2, visits)) for e in range(epochs)
+    ])
+    n = len(mjd)
+    w1_base = rng.uniform(8, 14)
+
+    def flags(choices, p):
+        return ["".join(f) for f in rng.choice(choices, p=p, size=(n, 4))]
+
+    df = pd.DataFrame({
+        "designation": designation,
+        "ra": ra + rng.normal(0, 3e-5, n),
+        "dec": dec + rng.normal(0, 3e-5, n),
+        "mjd": mjd,
+        "w1mpro": np.round(w1_base + rng.normal(0, 0.05, n), 3),
+        "w1sigmpro": np.round(rng.uniform(0.01, 0.05, n), 3),
+        "w2mpro": np.round(w1_base - 0.3 + rng.normal(0, 0.05, n), 3),
+        "w2sigmpro": np.round(rng.uniform(0.01, 0.05, n), 3),
+        "cc_flags": flags(["0", "h", "d"], [0.85, 0.1, 0.05]),
+        "ph_qual": flags(["A", "B"], [0.9, 0.1]),
+        "moon_masked": flags(["0", "1"], [0.9, 0.1]),
+        "sso_flg": rng.choice([0, 1], p=[0.97, 0.03], size=n),
+        "qi_fact": rng.choice([1.0, 0.5], p=[0.85, 0.15], size=n),
+        "saa_sep": np.round(rng.uniform(-20, 120, n), 2),
+        "w1sat": rng.choice([0.0, 0.1], p=[0.95, 0.05], size=n),
+        "w2sat": np.zeros(n),
+        "w1rchi2": np.round(rng.uniform(0, 60, n), 3),
+        "w2rchi2": np.round(rng.uniform(0, 60, n), 3),
+        "qual_frame": rng.choice([0.0, 5.0, 10.0], p=[0.05, 0.15, 0.8], size=n),
+        "w1sky": np.round(rng.uniform(500, 700, n), 3),
+        "w2sky": np.round(rng.uniform(500, 700, n), 3),
+        "scan_id": [f"{rng.integers(10000, 99999)}{c}" for c in rng.choice(["a", "b", "r", "s"], size=n)],
+        "allwise_cntr": int(zlib.crc32(designation.encode()) % 10**10),
+    })
+    df.loc[rng.random(n) < 0.03, "w2mpro"] = np.nan
+    df.loc[rng.random(n) < 0.03, "w1sky"] = np.nan
+    return df
+
+
+def to_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def to_votable(df: pd.DataFrame) -> bytes:
+    """DataFrameをVOTable（TABLEDATA形式）に変換（NaNは空のTD = null）"""
+    fields = []
+    for name, dtype in df.dtypes.items():
+        if pd.api.types.is_float_dtype(dtype):
+            fields.append(f'<FIELD name="{name}" datatype="double"/>')
+        elif pd.api.types.is_integer_dtype(dtype):
+            fields.append(f'<FIELD name="{name}" datatype="long"/>')
+        else:
+            fields.append(f'<FIELD name="{name}" datatype="char" arraysize="*"/>')
+
+    out = io.StringIO()
+    out.write('<?xml version="1.0" encoding="UTF-8"?>')
+    out.write('<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">')
+    out.write(f'<RESOURCE type="results"><INFO name="QUERY_STATUS" value="OK"/><TABLE>{"".join(fields)}')
+    out.write("<DATA><TABLEDATA>")
+    for row in df.itertuples(index=False):
+        out.write("<TR>")
+        for value in row:
+            if isinstance(value, float) and np.isnan(value):
+                out.write("<TD/>")
+            else:
+                out.write(f"<TD>{escape(repr(value) if isinstance(value, float) else str(value))}</TD>")
+        out.write("</TR>")
+    out.write("</TABLEDATA></DATA></TABLE></RESOURCE></VOTABLE>")
+    return out.getvalue().encode("utf-8")
+
+
+def parse_votable(data: bytes) -> List[Dict[str, str]]:
+    """アップロードされたVOTable（TABLEDATA形式）を行の辞書のリストに変換"""
+    root = ET.fromstring(data)
+    names = [field.get("name") for field in root.iter(f"{VOTABLE_NS}FIELD")]
+    return [
+        dict(zip(names, [td.text or "" for td in tr.iter(f"{VOTABLE_NS}TD")]))
+        for tr in root.iter(f"{VOTABLE_NS}TR")
+    ]
+
+
+class MockIrsaConfig:
+    """
+    スタンドインの振る舞い
+
+    Parameters:
+    -----------
+    latency : float
+        1リクエストあたりの平均遅延（秒、±50%のばらつき）
+    error_rate : float
+        502を返す割合
+    timeout_rate : float
+        応答せずにhang_seconds待って切断する割合
+    hang_seconds : float
+        タイムアウトを模擬するときに待つ秒数
+    epochs, visits : int
+        1天体あたりのエポック数・エポックあたりの観測回数
+    empty_rate : float
+        データなしの天体の割合
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        hang_seconds: float = 30.0,
+        epochs: int = DEFAULT_EPOCHS,
+        visits: int = DEFAULT_VISITS,
+        empty_rate: float = 0.0
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.epochs = epochs
+        self.visits = visits
+        self.empty_rate = empty_rate
+
+
+class MockIrsaHandler(BaseHTTPRequestHandler):
+    """/TAP/sync（GET・POST、multipartのTAP_UPLOADを含む）と /stats を処理"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._send(200, json.dumps(self.server.stats_snapshot()).encode(), "application/json")
+        elif url.path == TAP_SYNC_PATH:
+            self._handle_tap({k: v[0] for k, v in parse_qs(url.query).items()}, {})
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def do_POST(self):
+        if urlparse(self.path).path != TAP_SYNC_PATH:
+            self._send(404, b"not found", "text/plain")
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "")
+        params, files = {}, {}
+        if content_type.startswith("multipart/"):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                payload = part.get_payload(decode=True)
+                if part.get_filename():
+                    files[name] = payload
+                else:
+                    params[name] = payload.decode("utf-8")
+        else:
+            params = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+        self._handle_tap(params, files)
+
+    def _handle_tap(self, params: Dict[str, str], files: Dict[str, bytes]):
+        server = self.server
+        config = server.config
+        params = {k.upper(): v for k, v in params.items()}
+        server.count("requests")
+
+        if config.latency > 0:
+            time.sleep(config.latency * random.uniform(0.5, 1.5))
+        roll = random.random()
+        if roll < config.timeout_rate:
+            server.count("timeouts")
+            time.sleep(config.hang_seconds)
+            self.close_connection = True
+            return
+        if roll < config.timeout_rate + config.error_rate:
+            server.count("errors")
+            self._send(502, b"Bad Gateway", "text/plain")
+            return
+
+        query = params.get("QUERY", "")
+        try:
+            df = self._run_query(query, params.get("UPLOAD"), files)
+        except ValueError as e:
+            server.count("bad_queries")
+            self._send(400, str(e).encode(), "text/plain")
+            return
+
+        server.count("rows", len(df))
+        if params.get("FORMAT", "votable").lower() in ("csv", "text/csv"):
+            self._send(200, to_csv(df), "text/csv")
+        else:
+            self._send(200, to_votable(df), "application/x-votable+xml")
+
+    def _run_query(self, query: str, upload: Optional[str], files: Dict[str, bytes]) -> pd.DataFrame:
+        config = self.server.config
+        if NEOWISE_TABLE not in query:
+            raise ValueError(f"unsupported table in query: {query}")
+
+        def rows_for(ra, dec, since_mjd):
+            df = synthetic_neowise_rows(ra, dec, config.epochs, config.visits, config.empty_rate)
+            if since_mjd is not None and not df.empty:
+                df = df[df["mjd"] > since_mjd]
+            return df
+
+        if "TAP_UPLOAD." in query.upper():
+            # UPLOAD=targets,param:targets
+            if not upload:
+                raise ValueError("TAP_UPLOAD referenced without UPLOAD parameter")
+            table_name, _, source = upload.partition(",")
+            targets = parse_votable(files[source.split(":", 1)[1]])
+            frames = []
+            for target in targets:
+                if target.get("ra"):
+                    ra, dec = float(target["ra"]), float(target["dec"])
+                else:
+                    position = designation_position(target.get("designation", ""))
+                    if position is None:
+                        continue
+                    ra, dec = position
+                since = float(target["since_mjd"]) if target.get("since_mjd") else None
+                df = rows_for(ra, dec, since)
+                if not df.empty:
+                    df.insert(0, "target_id", target["target_id"])
+                    frames.append(df)
+            if not frames:
+                return pd.DataFrame(columns=["target_id"])
+            df = pd.concat(frames, ignore_index=True)
+            return df.sort_values(["target_id", "mjd"], kind="stable")
+
+        since_match = SINCE_PATTERN.search(query)
+        since = float(since_match.group(1)) if since_match else None
+        circle = CIRCLE_PATTERN.search(query)
+        if circle:
+            return rows_for(float(circle.group(1)), float(circle.group(2)), since)
+        designation = DESIGNATION_PATTERN.search(query)
+        if designation:
+            position = designation_position(designation.group(1))
+            return rows_for(*position, since) if position else pd.DataFrame()
+        raise ValueError(f"unsupported query: {query}")
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockIrsaServer(ThreadingHTTPServer):
+    """
+    スタンドインサーバー本体
+
+    ベンチマークなどから埋め込んで使う場合::
+
+        server = MockIrsaServer(MockIrsaConfig(latency=0.1))
+        server.start()        # バックグラウンドスレッドで待ち受け
+        ... server.url ...
+        server.stop()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config: Optional[MockIrsaConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), MockIrsaHandler)
+        self.config = config or MockIrsaConfig()
+        self._stats = {"requests": 0, "errors": 0, "timeouts": 0, "bad_queries": 0, "rows": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def stats_snapshot(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-irsa", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IRSA TAPのローカルスタンドイン（合成NEOWISEデータ）')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='待ち受けるホスト')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'待ち受けるポート（デフォルト: {DEFAULT_PORT}）')
+    parser.add_argument('--latency', type=float, default=0.0, help='1リクエストあたりの平均遅延（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='502を返す割合（0〜1）')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='応答せずに切断する割合（0〜1）')
+    parser.add_argument('--hang-seconds', type=float, default=30.0, help='タイムアウト模擬時に待つ秒数')
+    parser.add_argument('--epochs', type=int, default=DEFAULT_EPOCHS, help='1天体あたりのエポック数')
+    parser.add_argument('--visits', type=int, default=DEFAULT_VISITS, help='1エポックあたりの観測回数')
+    parser.add_argument('--empty-rate', type=float, default=0.0, help='データなしの天体の割合（0〜1）')
+    args = parser.parse_args()
+
+    config = MockIrsaConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds,
+        epochs=args.epochs,
+        visits=args.visits,
+        empty_rate=args.empty_rate
+    )
+    server = MockIrsaServer(config, args.host, args.port)
+    print(f"Mock IRSA TAP listening on {server.url}{TAP_SYNC_PATH} "
+          f"(latency={args.latency}s, error_rate={args.error_rate}, timeout_rate={args.timeout_rate}, "
+          f"{args.epochs}x{args.visits} visits per source)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
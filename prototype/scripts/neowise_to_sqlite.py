@@ -30,15 +30,32 @@ import sqlite3
 import argparse
 import logging
 from pathlib import Path
-from typing import Optional, Tuple, List
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, NamedTuple, Optional, Tuple, List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import queue
+import sys
 import threading
 import time
+from multiprocessing import shared_memory
 
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from irsa_async import AIOHTTP_AVAILABLE, DEFAULT_IRSA_URL, AsyncIrsaClient
+from zero_point import ZeroPointIndex, load_zero_point_index
+
+# エポック集約のベクトル化カーネルはAPIサーバー（backend/epoch_kernel.py）と共有する
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.append(str(BACKEND_DIR))
+from epoch_kernel import aggregate_epochs
+
 # ログ設定
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
@@ -58,13 +75,63 @@ except ImportError:
     def tqdm(x, **kwargs):
         return x
 
-# スレッドセーフなデータベース書き込み用ロック
-db_lock = threading.Lock()
-
 # セマフォで「同時に発行する IRSA クエリ数」を制限（executor の workers とは別）
 MAX_CONCURRENT_QUERIES = 4
 query_semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_QUERIES)
 
+# 並列処理: 書き込みキューの長さ（計算済み・未書き込みの天体数の上限）
+DEFAULT_WRITE_QUEUE_SIZE = 64
+
+# 並列処理: 1トランザクションでコミットする行数の目安
+DEFAULT_COMMIT_ROWS = 50000
+
+# --async: 同時に発行するIRSAリクエスト数
+DEFAULT_MAX_IN_FLIGHT = 32
+
+# --async モードで1回のTAPクエリにまとめる天体数（1なら天体ごとに問い合わせ）
+DEFAULT_TAP_BATCH_SIZE = 1
+
+# エポック集約の実装（--epoch-kernel）: vectorized（複数天体を配列でまとめて計算）/ pandas（天体・バンドごとのgroupby）
+DEFAULT_EPOCH_KERNEL = 'vectorized'
+
+# v2スキーマ（整数キー・WITHOUT ROWID）のDBの PRAGMA user_version（v1のDBは0）
+SCHEMA_V2 = 2
+
+# v2スキーマのバンド番号
+BAND_CODES = {'W1': 1, 'W2': 2}
+
+# エポック集約に使うIRSAテーブルの列（--compute-processes で別プロセスに渡す列）
+AGGREGATION_COLUMNS = [
+    'mjd', 'w1mpro', 'w1sigmpro', 'w2mpro', 'w2sigmpro', 'cc_flags', 'ph_qual', 'moon_masked',
+    'sso_flg', 'qi_fact', 'saa_sep', 'w1sat', 'w2sat', 'w1rchi2', 'w2rchi2', 'qual_frame',
+    'w1sky', 'w2sky', 'scan_id'
+]
+
+# AGGREGATION_COLUMNSのうち文字列の列（固定長バイト列として渡す）
+AGGREGATION_STRING_COLUMNS = {'cc_flags', 'ph_qual', 'moon_masked', 'scan_id'}
+
+# エポック集約の結果の列（_aggregate_band_with_default_filter() の結果と同じ順）
+EPOCH_RESULT_COLUMNS = ['epoch_id', 'mjd', 'mag_mean', 'mag_se', 'n_points', 'mag_lim', 'snr']
+
+# neowise_raw_observationsの列（RAW_INSERT_SQLの列順）
+RAW_COLUMNS = [
+    'source_id', 'mjd', 'band', 'mpro', 'sigmpro', 'cc_flags', 'ph_qual', 'moon_masked',
+    'sso_flg', 'qi_fact', 'saa_sep', 'sat', 'rchi2', 'qual_frame', 'sky', 'scan_id', 'mpro_corrected'
+]
+
+RAW_INSERT_SQL = '''
+    INSERT INTO neowise_raw_observations 
+    (source_id, mjd, band, mpro, sigmpro, cc_flags, ph_qual, moon_masked,
+     sso_flg, qi_fact, saa_sep, sat, rchi2, qual_frame, sky, scan_id, mpro_corrected)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+EPOCH_INSERT_SQL = '''
+    INSERT INTO neowise_epoch_summary 
+    (source_id, band, epoch_id, mjd_mean, mag_mean, mag_se, mag_lim, n_points, snr, filter_applied)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
 
 def prepare_irsa_session(pool_maxsize=50, max_retries=3, backoff_factor=1.0):
     """
@@ -101,6 +168,19 @@ def prepare_irsa_session(pool_maxsize=50, max_retries=3, backoff_factor=1.0):
     return session
 
 
+def use_irsa_url(irsa_url: str):
+    """
+    astroquery（Irsa.query_region / Irsa.query_tap）の問い合わせ先を変更
+    
+    ローカルのスタンドイン（mock_irsa_server.py）で計測する場合に使用。
+    query_regionをTAPで実行するastroquery（0.4.7以降）が必要
+    """
+    if ASTROQUERY_AVAILABLE and irsa_url.rstrip('/') != DEFAULT_IRSA_URL:
+        Irsa.tap_url = irsa_url.rstrip('/') + '/TAP'
+        Irsa._tap = None  # 作成済みのTAPServiceを破棄して新しいURLで作り直させる
+        logging.info("Irsa TAP URL set to %s", Irsa.tap_url)
+
+
 def create_neowise_database(db_path: str) -> sqlite3.Connection:
     """
     NEOWISE生データ用のSQLiteデータベースを作成
@@ -193,10 +273,140 @@ def create_neowise_database(db_path: str) -> sqlite3.Connection:
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_epoch_source ON neowise_epoch_summary(source_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_epoch_band ON neowise_epoch_summary(band)')
     
+    # ingest_stateテーブル: 天体ごとの取り込み状況（--resume / --update 用）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            source_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,      -- 'done', 'no_data', 'error'
+            last_mjd REAL,             -- 保存済み生データの最大MJD
+            content_hash TEXT,         -- 保存済み生データのハッシュ（追加のたびに連鎖）
+            message TEXT,              -- エラー内容
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    conn.commit()
+    return conn
+
+
+def create_neowise_database_v2(db_path: str) -> sqlite3.Connection:
+    """
+    v2スキーマのSQLiteデータベースを作成（migrate_neowise_db.py で v1 から変換する）
+    
+    v1との違い:
+    - 観測・エポックの行はTEXTのsource_idの代わりに整数のsource_key（sources.id）を持つ
+    - バンドは整数（BAND_CODES: W1=1, W2=2）
+    - 観測・エポックはWITHOUT ROWIDテーブルで、主キー (source_key, band, mjd / epoch_id) の順に
+      格納される。1天体分のライトカーブはファイル上で連続し、別途のインデックスは不要
+    - 同一天体・バンド・MJDの観測が複数ある場合はdup（0, 1, ...）で区別する
+    
+    スキーマのバージョンは PRAGMA user_version（SCHEMA_V2）で判別する。
+    ingest（neowise_to_sqlite.py）はv1のDBにのみ書き込む
+    
+    Parameters:
+    -----------
+    db_path : str
+        データベースファイルのパス
+    
+    Returns:
+    --------
+    sqlite3.Connection
+        データベース接続
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    # sourcesテーブル: idがsource_key（v1と同じ列なので、sourcesを読むコードはそのまま使える）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sources (
+            id INTEGER PRIMARY KEY,
+            source_id TEXT UNIQUE NOT NULL,
+            ra REAL NOT NULL,
+            dec REAL NOT NULL,
+            allwise_cntr INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # neowise_raw_observationsテーブル: 天体・バンド・MJDの順に格納
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS neowise_raw_observations (
+            source_key INTEGER NOT NULL,
+            band INTEGER NOT NULL,
+            mjd REAL NOT NULL,
+            dup INTEGER NOT NULL DEFAULT 0,
+            
+            -- 等級データ
+            mpro REAL,
+            sigmpro REAL,
+            
+            -- フラグ情報（動的フィルタリング用）
+            cc_flags TEXT,
+            ph_qual TEXT,
+            moon_masked TEXT,
+            sso_flg INTEGER,
+            qi_fact REAL,
+            saa_sep REAL,
+            sat REAL,
+            rchi2 REAL,
+            qual_frame REAL,
+            sky REAL,
+            
+            -- スキャン情報（ゼロポイント補正用）
+            scan_id TEXT,
+            
+            -- 補正後の等級
+            mpro_corrected REAL,
+            
+            PRIMARY KEY (source_key, band, mjd, dup)
+        ) WITHOUT ROWID
+    ''')
+    
+    # neowise_epoch_summaryテーブル: 天体・バンド・エポックの順に格納
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS neowise_epoch_summary (
+            source_key INTEGER NOT NULL,
+            band INTEGER NOT NULL,
+            epoch_id INTEGER NOT NULL,
+            filter_applied TEXT NOT NULL DEFAULT 'default',
+            mjd_mean INTEGER NOT NULL,
+            mag_mean REAL,
+            mag_se REAL,
+            mag_lim REAL,
+            n_points INTEGER,
+            snr REAL,
+            
+            PRIMARY KEY (source_key, band, epoch_id, filter_applied)
+        ) WITHOUT ROWID
+    ''')
+    
+    # ingest_stateテーブル: v1と同じ
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            source_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            last_mjd REAL,
+            content_hash TEXT,
+            message TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
     conn.commit()
     return conn
 
 
+def schema_version(db_path: str) -> Optional[int]:
+    """DBのスキーマのバージョン（PRAGMA user_version、v1は0）。ファイルが無ければNone"""
+    if not Path(db_path).exists():
+        return None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+
+
 def clear_database(db_path: str) -> bool:
     """
     SQLiteデータベースの全データをクリア（テーブル構造は維持）
@@ -219,9 +429,12 @@ def clear_database(db_path: str) -> bool:
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         
-        # 各テーブルのデータを削除
-        tables = ['neowise_epoch_summary', 'neowise_raw_observations', 'sources']
+        # 各テーブルのデータを削除（ingest_stateは古いDBには無い）
+        existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        tables = ['neowise_epoch_summary', 'neowise_raw_observations', 'sources', 'ingest_state']
         for table in tables:
+            if table not in existing:
+                continue
             cursor.execute(f'DELETE FROM {table}')
             logging.info(f"Cleared table: {table}")
         
@@ -261,18 +474,21 @@ def drop_database(db_path: str) -> bool:
         return False
 
 
-def load_zp_stb(zp_stb_path: Optional[str] = None) -> Optional[pd.DataFrame]:
+def load_zp_stb(zp_stb_path: Optional[str] = None) -> Optional[ZeroPointIndex]:
     """
     ゼロポイント補正テーブルを読み込む
     
+    CSVはscan_idの昇順の配列（zero_point.py のインデックス、CSVの隣の *.zpidx）に変換してディスクに保存し、
+    以降の実行ではメモリマップで開く。計算スレッド・集約プロセスは同じファイルを共有する
+    
     Parameters:
     -----------
     zp_stb_path : str, optional
-        NEOWISE_zp_stb.csvのパス
+        NEOWISE_zp_stb.csv、または zero_point.py で作成したインデックスのディレクトリのパス
     
     Returns:
     --------
-    pd.DataFrame or None
+    ZeroPointIndex or None
         ゼロポイント補正テーブル
     """
     if zp_stb_path is None or not Path(zp_stb_path).exists():
@@ -280,9 +496,9 @@ def load_zp_stb(zp_stb_path: Optional[str] = None) -> Optional[pd.DataFrame]:
         return None
     
     try:
-        zp_stb = pd.read_csv(zp_stb_path, skiprows=12).rename(columns={'scan': 'scan_id'})
-        print(f"Loaded zp_stb with {len(zp_stb)} entries")
-        return zp_stb
+        zp_index = load_zero_point_index(zp_stb_path)
+        print(f"Loaded zp_stb with {len(zp_index)} entries ({zp_index.path or 'in memory'})")
+        return zp_index
     except Exception as e:
         print(f"Error loading zp_stb: {e}")
         return None
@@ -293,12 +509,15 @@ def get_neowise_raw_data(
     dec: float, 
     source_id: str, 
     conn: sqlite3.Connection, 
-    zp_stb_df: Optional[pd.DataFrame] = None,
-    save_raw: bool = True
+    zp_index: Optional[ZeroPointIndex] = None,
+    save_raw: bool = True,
+    previous: Optional['IngestState'] = None,
+    aggregate=None
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     NEOWISEの生データを取得し、SQLiteに保存する関数
     
+    previousを指定すると、保存済みの最大MJDより新しい観測のみを追加する（--update）
     Parameters:
     -----------
     ra : float
@@ -309,10 +528,14 @@ def get_neowise_raw_data(
         天体の識別子（Gaia SOURCE_ID推奨）
     conn : sqlite3.Connection
         SQLiteデータベース接続
-    zp_stb_df : pd.DataFrame, optional
+    zp_index : ZeroPointIndex, optional
         ゼロポイント補正テーブル
     save_raw : bool
         生データを保存するかどうか（デフォルト: True）
+    previous : IngestState, optional
+        前回の取り込み状況（--update 時）
+    aggregate : callable, optional
+        エポック集約の実装（EPOCH_KERNELSの値、デフォルト: DEFAULT_EPOCH_KERNEL）
     
     Returns:
     --------
@@ -324,71 +547,514 @@ def get_neowise_raw_data(
         print(f"Skipping {source_id}: astroquery not available")
         return pd.DataFrame(), pd.DataFrame()
     
-    cursor = conn.cursor()
+    since_mjd = previous.last_mjd if previous is not None else None
     
     # 1. IRSAからデータを取得
     try:
-        table = Irsa.query_region(
-            coord.SkyCoord(ra, dec, unit=(u.deg, u.deg)), 
-            catalog='neowiser_p1bs_psd', 
-            radius='0d0m5s'
-        )
-        table.sort('mjd')
-        raw_df = table.to_pandas()
+        with stage_stats.timer('fetch'):
+            raw_df = fetch_neowise_region(ra, dec, since_mjd)
     except Exception as e:
         print(f"Error querying IRSA for RA={ra}, DEC={dec}: {e}")
+        record_ingest_error(conn.cursor(), source_id, str(e))
+        conn.commit()
         return pd.DataFrame(), pd.DataFrame()
+    
+    # 2. 保存する行とエポック集約データを計算
+    with stage_stats.timer('compute'):
+        stored_raw_rows = load_stored_raw_rows(conn, source_id) if since_mjd is not None else None
+        rows = compute_source_rows(source_id, ra, dec, raw_df, zp_index, save_raw, previous, stored_raw_rows,
+                                   aggregate)
+    
+    # 3. SQLiteに保存（失敗した天体は行を残さず、ingest_stateにエラーを記録する）
+    try:
+        with stage_stats.timer('write'):
+            write_source_rows_atomic(conn, rows)
+    except Exception as e:
+        record_ingest_error(conn.cursor(), source_id, f"write failed: {e}")
+        conn.commit()
+        raise
+    with stage_stats.timer('commit'):
+        conn.commit()
+    
+    return rows.w1_result, rows.w2_result
+
+
+def fetch_neowise_region(ra: float, dec: float, since_mjd: Optional[float] = None) -> pd.DataFrame:
+    """
+    座標検索（半径5秒角）でIRSAからNEOWISEの生データを取得
+    
+    複数のオブジェクトが含まれる場合は空のDataFrameを返す。
+    since_mjdを指定するとそれより新しい観測のみを返す（query_regionは条件を
+    付けられないため、取得後に絞り込む）
+    """
+    table = Irsa.query_region(
+        coord.SkyCoord(ra, dec, unit=(u.deg, u.deg)), 
+        catalog='neowiser_p1bs_psd', 
+        radius='0d0m5s'
+    )
+    table.sort('mjd')
+    raw_df = _single_object_or_empty(table.to_pandas(), ra, dec)
+    if since_mjd is not None and not raw_df.empty:
+        raw_df = raw_df[raw_df['mjd'] > since_mjd].reset_index(drop=True)
+    return raw_df
+
 
+def _single_object_or_empty(raw_df: pd.DataFrame, ra: float, dec: float) -> pd.DataFrame:
+    """座標検索の結果が1つのオブジェクトのみならそのまま、そうでなければ空のDataFrameを返す"""
     if raw_df.empty:
         print(f"No data found for RA={ra}, DEC={dec}")
-        return pd.DataFrame(), pd.DataFrame()
+        return raw_df
     
     # 複数オブジェクトのチェック
     if len(set(raw_df['allwise_cntr'])) != 1:
         print(f"Warning: Multiple objects found for RA={ra}, DEC={dec}")
-        return pd.DataFrame(), pd.DataFrame()
+        return pd.DataFrame()
+    
+    return raw_df
+
+
+def fetch_neowise_tap(allwise_id: str, since_mjd: Optional[float] = None) -> pd.DataFrame:
+    """
+    TAPでAllWISE ID（designation）が一致するNEOWISEの生データを取得
     
-    allwise_cntr = raw_df['allwise_cntr'].iloc[0]
+    since_mjdを指定するとそれより新しい観測のみを取得する
+    """
+    # 注: AllWISE IDは "Jhhmmss.ss+ddmmss.s" 形式
+    # neowiser_p1bs_psd テーブルの designation カラムで検索
+    since_clause = f"AND mjd > {since_mjd!r}" if since_mjd is not None else ""
+    query = f"""
+    SELECT * FROM neowiser_p1bs_psd 
+    WHERE designation = '{allwise_id}' {since_clause}
+    ORDER BY mjd
+    """
+    raw_df = Irsa.query_tap(query).to_pandas()
     
-    # 2. sourcesテーブルに登録
-    cursor.execute('''
-        INSERT OR IGNORE INTO sources (source_id, ra, dec, allwise_cntr)
-        VALUES (?, ?, ?, ?)
-    ''', (source_id, ra, dec, int(allwise_cntr)))
+    if raw_df.empty:
+        print(f"No data found for AllWISE_ID={allwise_id}")
+    return raw_df
+
+
+class IngestState(NamedTuple):
+    """ingest_stateテーブルの1行（天体ごとの取り込み状況）"""
+    status: str
+    last_mjd: Optional[float]
+    content_hash: Optional[str]
+
+
+def load_ingest_state(db_path: str) -> Dict[str, IngestState]:
+    """
+    ingest_stateテーブルを読み込む（DBやテーブルが無ければ空）
+    
+    Returns:
+    --------
+    dict
+        source_id → IngestState
+    """
+    if not Path(db_path).exists():
+        return {}
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('SELECT source_id, status, last_mjd, content_hash FROM ingest_state').fetchall()
+    except sqlite3.OperationalError:
+        # ingest_stateテーブルが無い古いDB
+        rows = []
+    finally:
+        conn.close()
+    return {source_id: IngestState(status, last_mjd, content_hash) for source_id, status, last_mjd, content_hash in rows}
+
+
+def backfill_ingest_state(db_path: str):
+    """
+    ingest_stateが無い天体（ingest_state導入前に取り込んだ天体）について、
+    保存済みの生データの最大MJDから取り込み状況を作成する
+    """
+    if not Path(db_path).exists():
+        return
+    conn = create_neowise_database(db_path)
+    cursor = conn.execute('''
+        INSERT INTO ingest_state (source_id, status, last_mjd)
+        SELECT source_id, 'done', MAX(mjd) FROM neowise_raw_observations
+        WHERE source_id NOT IN (SELECT source_id FROM ingest_state)
+        GROUP BY source_id
+    ''')
+    if cursor.rowcount > 0:
+        print(f"Backfilled ingest_state for {cursor.rowcount} sources")
+    conn.commit()
+    conn.close()
+
+
+def load_stored_raw_rows(conn: sqlite3.Connection, source_id: str) -> list:
+    """保存済みの生データ（RAW_COLUMNSの順のタプル）をMJD順に読み込む"""
+    return conn.execute(f'''
+        SELECT {', '.join(RAW_COLUMNS)} FROM neowise_raw_observations
+        WHERE source_id = ? ORDER BY mjd
+    ''', (source_id,)).fetchall()
+
+
+# 計算スレッドごとの読み取り専用接続（--update で保存済みの生データを読む）
+_thread_local = threading.local()
+
+
+def _thread_read_connection(db_path: str) -> sqlite3.Connection:
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=30)
+        _thread_local.conn = conn
+    return conn
+
+
+def _rows_hash(raw_rows: list, previous_hash: Optional[str] = None) -> str:
+    """生データの行のハッシュ（追加時は前回のハッシュに連鎖させる）"""
+    digest = hashlib.sha1((previous_hash or '').encode())
+    for row in raw_rows:
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+class SourceRows(NamedTuple):
+    """1天体分の書き込み内容（計算ステージ → 書き込みステージ）"""
+    source_id: str
+    source_row: Optional[tuple]  # sourcesテーブルの行（Noneなら登録しない）
+    raw_rows: list  # neowise_raw_observationsの行
+    epoch_rows: list  # neowise_epoch_summaryの行
+    w1_result: pd.DataFrame
+    w2_result: pd.DataFrame
+    append: bool = False  # True: 既存の生データに追加（--update）、False: 天体のデータを置き換え
+    last_mjd: Optional[float] = None  # 書き込み後の生データの最大MJD
+    content_hash: Optional[str] = None  # 書き込み後の生データのハッシュ
+    
+    @property
+    def num_rows(self) -> int:
+        return len(self.raw_rows) + len(self.epoch_rows) + (1 if self.source_row else 0)
+    
+    @property
+    def has_epochs(self) -> bool:
+        return not self.w1_result.empty or not self.w2_result.empty
+
+
+def compute_source_rows(
+    source_id: str,
+    ra: float,
+    dec: float,
+    raw_df: pd.DataFrame,
+    zp_index: Optional[ZeroPointIndex] = None,
+    save_raw: bool = True,
+    previous: Optional[IngestState] = None,
+    stored_raw_rows: Optional[list] = None,
+    aggregate=None,
+    epochs: Optional[Tuple[pd.DataFrame, pd.DataFrame]] = None
+) -> SourceRows:
+    """
+    IRSAから取得した生データから、保存する行とエポック集約データを計算する
+    
+    DBには触れないため、任意のスレッドから呼び出せる。
+    previous・stored_raw_rows（保存済みの生データ）を指定すると追加モードになり、
+    previous.last_mjdより新しい観測のみを追加し、エポックは保存済み＋追加分の
+    全データから計算し直す（--update）。
+    aggregateはエポック集約を行う関数（デフォルト: DEFAULT_EPOCH_KERNELの実装、
+    別プロセスで計算する場合はAggregationPool）。
+    epochsには複数天体をまとめて集約した結果（aggregate_sources_batch() の天体分）を渡せる
+    （置き換えの場合のみ使い、aggregateは呼ばない）
+    """
+    aggregate = aggregate or EPOCH_KERNELS[DEFAULT_EPOCH_KERNEL]
+    append = previous is not None and previous.last_mjd is not None and stored_raw_rows is not None
+    if append:
+        if not raw_df.empty:
+            raw_df = raw_df[raw_df['mjd'] > previous.last_mjd].reset_index(drop=True)
+        if raw_df.empty:
+            # 新しい観測なし（保存済みのデータ・エポックはそのまま）
+            return SourceRows(source_id, None, [], [], pd.DataFrame(), pd.DataFrame(),
+                              True, previous.last_mjd, previous.content_hash)
     
-    # 3. mjdフィルタリング（zp_stb適用範囲のみ）
-    if zp_stb_df is not None and not zp_stb_df.empty:
-        raw_df = raw_df[raw_df['mjd'] > zp_stb_df['mjd'].min()].reset_index(drop=True)
+    if raw_df.empty:
+        return SourceRows(source_id, None, [], [], pd.DataFrame(), pd.DataFrame())
+    
+    allwise_cntr = raw_df['allwise_cntr'].iloc[0] if 'allwise_cntr' in raw_df.columns else None
+    source_row = (source_id, ra, dec, int(allwise_cntr) if pd.notna(allwise_cntr) else None)
+    
+    # mjdフィルタリング（zp_stb適用範囲のみ）
+    raw_df = _zp_range(raw_df, zp_index)
     
     if raw_df.empty:
         print(f"No data after MJD filtering for source_id={source_id}")
-        return pd.DataFrame(), pd.DataFrame()
+        if append:
+            return SourceRows(source_id, None, [], [], pd.DataFrame(), pd.DataFrame(),
+                              True, previous.last_mjd, previous.content_hash)
+        return SourceRows(source_id, source_row, [], [], pd.DataFrame(), pd.DataFrame())
+    
+    raw_rows = raw_observation_rows(raw_df, source_id, zp_index) if save_raw else []
+    
+    if append:
+        # 保存済み＋追加分の生データ（補正済み等級）からエポックを計算し直す
+        w1_result, w2_result = aggregate(_stored_rows_frame(stored_raw_rows + raw_rows), source_id, None)
+        last_mjd = max(previous.last_mjd, float(raw_df['mjd'].max()))
+        content_hash = _rows_hash(raw_rows, previous.content_hash)
+    else:
+        # デフォルトフィルタでエポック集約データを計算
+        w1_result, w2_result = epochs if epochs is not None else aggregate(raw_df, source_id, zp_index)
+        last_mjd = float(raw_df['mjd'].max())
+        content_hash = _rows_hash(raw_rows)
+    epoch_rows = epoch_summary_rows(w1_result, source_id, 'W1') + epoch_summary_rows(w2_result, source_id, 'W2')
+    
+    for result, band in [(w1_result, 'W1'), (w2_result, 'W2')]:
+        if not result.empty:
+            result['Source'] = source_id
+            result['band'] = band
+    
+    return SourceRows(source_id, source_row, raw_rows, epoch_rows, w1_result, w2_result,
+                      append, last_mjd, content_hash)
+
+
+def _zp_range(raw_df: pd.DataFrame, zp_index: Optional[ZeroPointIndex]) -> pd.DataFrame:
+    """ゼロポイント補正テーブルの適用範囲（mjd > zp_index.mjd_min）の観測のみを残す"""
+    if zp_index is not None and len(zp_index):
+        return raw_df[raw_df['mjd'] > zp_index.mjd_min].reset_index(drop=True)
+    return raw_df
+
+
+def aggregate_bands(
+    table_df: pd.DataFrame,
+    source_id: str,
+    zp_index: Optional[ZeroPointIndex]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """IRSAのテーブルからW1・W2のエポック集約データを計算（デフォルトフィルタ）"""
+    w1_result = _aggregate_band_with_default_filter(table_df.copy(), 'W1', source_id, zp_index)
+    w2_result = _aggregate_band_with_default_filter(table_df.copy(), 'W2', source_id, zp_index)
+    return w1_result, w2_result
+
+
+def _stored_rows_frame(raw_rows: list) -> pd.DataFrame:
+    """
+    neowise_raw_observationsの行（RAW_COLUMNSの順）をIRSAのテーブルと同じ列名に戻す
+    
+    W1の行とW2の行を縦に並べる（もう一方のバンドの列は欠損値）ため、aggregate_bands()で
+    バンドごとに集約できる。保存済みの行はゼロポイント補正済み（mpro_corrected）・
+    小数点以下4桁に丸め済みのため、IRSAのデータから直接計算した場合と
+    最大で0.0001等級程度異なることがある
+    """
+    stored = pd.DataFrame(raw_rows, columns=RAW_COLUMNS)
+    tables = []
+    for band in ['W1', 'W2']:
+        band_lower = band.lower()
+        band_rows = stored[stored['band'] == band].sort_values('mjd', kind='stable')
+        # IRSAのテーブルと同じ列名に戻す
+        table_df = pd.DataFrame({
+            'mjd': band_rows['mjd'],
+            f'{band_lower}mpro': band_rows['mpro_corrected'],
+            f'{band_lower}sigmpro': band_rows['sigmpro'],
+            'cc_flags': band_rows['cc_flags'],
+            'ph_qual': band_rows['ph_qual'],
+            'moon_masked': band_rows['moon_masked'],
+            'sso_flg': band_rows['sso_flg'],
+            'qi_fact': band_rows['qi_fact'],
+            'saa_sep': band_rows['saa_sep'],
+            f'{band_lower}sat': band_rows['sat'],
+            f'{band_lower}rchi2': band_rows['rchi2'],
+            'qual_frame': band_rows['qual_frame'],
+            f'{band_lower}sky': band_rows['sky'],
+            'scan_id': band_rows['scan_id'],
+        }).reset_index(drop=True)
+        tables.append(table_df)
+    return pd.concat(tables, ignore_index=True)
+
+
+def write_source_rows(cursor, rows: SourceRows):
+    """
+    compute_source_rows() の結果をSQLiteに書き込む（コミットは呼び出し側）
     
-    # 4. 生データをSQLiteに保存
-    if save_raw:
-        _save_raw_observations(raw_df, source_id, zp_stb_df, cursor)
+    置き換えの場合は天体の既存の生データ・エポックを削除してから挿入するため、
+    再実行しても行が重複しない。追加の場合は生データを追記し、エポックを入れ替える。
+    ingest_stateも同じトランザクションで更新する
+    """
+    if rows.source_row is not None:
+        cursor.execute('''
+            INSERT OR IGNORE INTO sources (source_id, ra, dec, allwise_cntr)
+            VALUES (?, ?, ?, ?)
+        ''', rows.source_row)
+        if not rows.append:
+            cursor.execute('DELETE FROM neowise_raw_observations WHERE source_id = ?', (rows.source_id,))
+        cursor.execute('DELETE FROM neowise_epoch_summary WHERE source_id = ?', (rows.source_id,))
+    _executemany(cursor, 'neowise_raw_observations', RAW_INSERT_SQL, rows.raw_rows)
+    _executemany(cursor, 'neowise_epoch_summary', EPOCH_INSERT_SQL, rows.epoch_rows)
+    
+    status = 'done' if rows.source_row is not None or rows.append else 'no_data'
+    cursor.execute('''
+        INSERT OR REPLACE INTO ingest_state (source_id, status, last_mjd, content_hash, message, updated_at)
+        VALUES (?, ?, ?, ?, NULL, CURRENT_TIMESTAMP)
+    ''', (rows.source_id, status, rows.last_mjd, rows.content_hash))
+
+
+def write_source_rows_atomic(conn: sqlite3.Connection, rows: SourceRows):
+    """
+    write_source_rows() を天体ごとのセーブポイントの中で実行する（コミットは呼び出し側）
     
-    conn.commit()
+    書き込みに失敗した場合はその天体の行（DELETE・途中までのINSERT）を取り消してから例外を送出するため、
+    同じトランザクションでコミットする他の天体と一緒に書きかけの行がコミットされることはない
+    """
+    # トランザクションの外のSAVEPOINTはRELEASEでコミットされてしまうため、先にトランザクションを開始する
+    if not conn.in_transaction:
+        conn.execute('BEGIN')
+    cursor = conn.cursor()
+    cursor.execute('SAVEPOINT src')
+    try:
+        write_source_rows(cursor, rows)
+    except BaseException:
+        cursor.execute('ROLLBACK TO src')
+        cursor.execute('RELEASE src')
+        raise
+    cursor.execute('RELEASE src')
+
+
+def record_ingest_error(cursor, source_id: str, message: str):
+    """取り込みに失敗した天体をingest_stateに記録（前回のlast_mjd・ハッシュは残す）"""
+    cursor.execute('''
+        INSERT INTO ingest_state (source_id, status, message, updated_at)
+        VALUES (?, 'error', ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(source_id) DO UPDATE SET
+            status = 'error', message = excluded.message, updated_at = excluded.updated_at
+    ''', (source_id, message))
+
+
+class InsertStats:
+    """
+    SQLiteへの挿入行数と所要時間の集計（スレッドセーフ）
     
-    # 5. デフォルトフィルタでエポック集約データを計算・保存
-    w1_result = _process_band_with_default_filter(raw_df.copy(), 'W1', source_id, zp_stb_df, cursor)
-    w2_result = _process_band_with_default_filter(raw_df.copy(), 'W2', source_id, zp_stb_df, cursor)
+    ingestのサマリーで rows/sec を表示するために使用
+    """
     
-    conn.commit()
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.rows = {}
+            self.seconds = 0.0
+    
+    def add(self, table: str, num_rows: int, seconds: float):
+        with self._lock:
+            self.rows[table] = self.rows.get(table, 0) + num_rows
+            self.seconds += seconds
+    
+    def print_summary(self, elapsed_time: float):
+        with self._lock:
+            rows = dict(self.rows)
+            seconds = self.seconds
+        total = sum(rows.values())
+        for table, num_rows in rows.items():
+            print(f"Rows inserted into {table}: {num_rows}")
+        if total:
+            print(f"Insert throughput: {total / max(elapsed_time, 1e-9):.0f} rows/sec overall, "
+                  f"{total / max(seconds, 1e-9):.0f} rows/sec in INSERT ({seconds:.2f} s)")
+
+
+insert_stats = InsertStats()
+
+
+class StageStats:
+    """
+    ingestの各ステージ（fetch / compute / write / commit）の所要時間の集計（スレッドセーフ）
     
-    return w1_result, w2_result
+    サマリーとベンチマーク（ingest_benchmark.py）で p50/p95 を表示するために使用。
+    fetchは1リクエスト（再試行を含む）、compute・writeは1天体、commitは1トランザクションごとに記録する
+    """
+    
+    STAGES = ('fetch', 'compute', 'write', 'commit')
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.samples = {stage: [] for stage in self.STAGES}
+    
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+    
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+    
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """stage → {count, total, p50, p95}（秒）"""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self.samples.items() if values}
+        return {
+            stage: {
+                'count': len(values),
+                'total': float(np.sum(values)),
+                'p50': float(np.percentile(values, 50)),
+                'p95': float(np.percentile(values, 95)),
+            }
+            for stage, values in samples.items()
+        }
+    
+    def print_summary(self):
+        for stage, p in self.percentiles().items():
+            print(f"Stage {stage}: n={p['count']}, p50={p['p50'] * 1000:.1f} ms, "
+                  f"p95={p['p95'] * 1000:.1f} ms, total={p['total']:.2f} s")
 
 
-def _save_raw_observations(
-    raw_df: pd.DataFrame, 
-    source_id: str, 
-    zp_stb_df: Optional[pd.DataFrame], 
-    cursor
-):
+stage_stats = StageStats()
+
+
+def _column_values(
+    df: pd.DataFrame, 
+    col: str, 
+    default=None, 
+    decimals: Optional[int] = None,
+    dtype: Optional[type] = None
+) -> list:
+    """
+    executemany用に列をPythonの値のリストに変換
+    
+    列が無ければdefault、欠損値（NaN）はNoneにする。
+    丸め・型変換は列単位でまとめて行う（行ごとのround()を使わない）
     """
-    生の観測データをSQLiteに保存
+    if col not in df.columns:
+        return [default] * len(df)
+    
+    series = df[col]
+    if decimals is not None:
+        series = series.round(decimals)
+    missing = series.isna().to_numpy()
+    if dtype is not None:
+        series = series.fillna(0 if default is None else default).astype(dtype)
+    # tolist()でNumPyの型からPythonの型に変換される
+    values = series.to_numpy().tolist()
+    if missing.any() and (dtype is None or default is None):
+        values = [None if m else v for v, m in zip(values, missing)]
+    return values
+
+
+def _executemany(cursor, table: str, sql: str, rows: list):
+    """executemanyで一括挿入し、行数と所要時間を記録"""
+    if not rows:
+        return
+    start = time.perf_counter()
+    cursor.executemany(sql, rows)
+    insert_stats.add(table, len(rows), time.perf_counter() - start)
+
+
+def raw_observation_rows(
+    raw_df: pd.DataFrame, 
+    source_id, 
+    zp_index: Optional[ZeroPointIndex]
+) -> list:
     """
+    neowise_raw_observationsに挿入する行（タプル）のリストを作成
     
+    source_idは1天体分ならsource_idの文字列、複数天体を縦に連結した場合は各行のsource_id
+    （generate_synthetic_db.py がchunk単位で作る）
+    """
+    source_ids = None if isinstance(source_id, str) else np.asarray(source_id, dtype=object)
+    rows = []
     for band in ['W1', 'W2']:
         band_lower = band.lower()
         mag_col = f'{band_lower}mpro'
@@ -399,64 +1065,50 @@ def _save_raw_observations(
         dmag_col = f'{band_lower}dmag'
         
         # バンドのデータを抽出
-        band_df = raw_df.dropna(subset=[mag_col]).copy()
+        band_mask = raw_df[mag_col].notna().to_numpy()
+        band_df = raw_df[band_mask].copy()
         
         if band_df.empty:
             continue
+        band_ids = [source_id] * len(band_df) if source_ids is None else source_ids[band_mask].tolist()
         
-        # ゼロポイント補正値をマージ
-        if zp_stb_df is not None and dmag_col in zp_stb_df.columns:
-            band_df = band_df.merge(
-                zp_stb_df[['scan_id', dmag_col]], 
-                on='scan_id', 
-                how='left'
-            )
-            band_df['mpro_corrected'] = band_df[mag_col] - band_df[dmag_col].fillna(0)
+        # ゼロポイント補正値をscan_idで引く（テーブルに無いscanは補正なし）
+        if zp_index is not None and zp_index.has(dmag_col):
+            band_df['mpro_corrected'] = band_df[mag_col] - zp_index.correction(band_df['scan_id'], dmag_col)
         else:
             band_df['mpro_corrected'] = band_df[mag_col]
         
-        # SQLiteに挿入（等級データは小数点以下4桁に丸める）
-        for _, row in band_df.iterrows():
-            # mpro, sigmpro, mpro_corrected を小数点以下4桁に丸める
-            mpro_rounded = round(row[mag_col], 4) if pd.notna(row[mag_col]) else None
-            sigmpro_rounded = round(row[unc_col], 4) if pd.notna(row[unc_col]) else None
-            mpro_corrected_rounded = round(row['mpro_corrected'], 4) if pd.notna(row['mpro_corrected']) else None
-            
-            cursor.execute('''
-                INSERT INTO neowise_raw_observations 
-                (source_id, mjd, band, mpro, sigmpro, cc_flags, ph_qual, moon_masked,
-                 sso_flg, qi_fact, saa_sep, sat, rchi2, qual_frame, sky, scan_id, mpro_corrected)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                source_id,
-                row['mjd'],
-                band,
-                mpro_rounded,
-                sigmpro_rounded,
-                row.get('cc_flags', ''),
-                row.get('ph_qual', ''),
-                row.get('moon_masked', ''),
-                int(row.get('sso_flg', 0)),
-                row.get('qi_fact', 1.0),
-                row.get('saa_sep', 0.0),
-                row.get(sat_col, 0.0),
-                row.get(rchi2_col, 0.0),
-                row.get('qual_frame', 0.0),
-                row.get(sky_col) if pd.notna(row.get(sky_col)) else None,
-                row.get('scan_id', ''),
-                mpro_corrected_rounded
-            ))
-
-
-def _process_band_with_default_filter(
+        # 列単位で丸め・型変換して行を作成（等級データは小数点以下4桁に丸める）
+        rows.extend(zip(
+            band_ids,
+            _column_values(band_df, 'mjd'),
+            [band] * len(band_df),
+            _column_values(band_df, mag_col, decimals=4),
+            _column_values(band_df, unc_col, decimals=4),
+            _column_values(band_df, 'cc_flags', ''),
+            _column_values(band_df, 'ph_qual', ''),
+            _column_values(band_df, 'moon_masked', ''),
+            _column_values(band_df, 'sso_flg', 0, dtype=int),
+            _column_values(band_df, 'qi_fact', 1.0),
+            _column_values(band_df, 'saa_sep', 0.0),
+            _column_values(band_df, sat_col, 0.0),
+            _column_values(band_df, rchi2_col, 0.0),
+            _column_values(band_df, 'qual_frame', 0.0),
+            _column_values(band_df, sky_col),
+            _column_values(band_df, 'scan_id', ''),
+            _column_values(band_df, 'mpro_corrected', decimals=4)
+        ))
+    return rows
+
+
+def _aggregate_band_with_default_filter(
     table_df: pd.DataFrame, 
     band: str, 
     source_id: str, 
-    zp_stb_df: Optional[pd.DataFrame],
-    cursor
+    zp_index: Optional[ZeroPointIndex]
 ) -> pd.DataFrame:
     """
-    デフォルトフィルタを適用してエポック集約データを計算・保存
+    デフォルトフィルタを適用してエポック集約データを計算（DBには書き込まない）
     """
     band_lower = band.lower()
     mag_col = f'{band_lower}mpro'
@@ -495,13 +1147,8 @@ def _process_band_with_default_filter(
         return pd.DataFrame()
     
     # ゼロポイント補正
-    if zp_stb_df is not None and dmag_col in zp_stb_df.columns:
-        table_filtered = table_filtered.merge(
-            zp_stb_df[['scan_id', dmag_col]], 
-            on='scan_id', 
-            how='left'
-        )
-        table_filtered[mag_col] -= table_filtered[dmag_col].fillna(0)
+    if zp_index is not None and zp_index.has(dmag_col):
+        table_filtered[mag_col] -= zp_index.correction(table_filtered['scan_id'], dmag_col)
     
     # 3σクリッピング
     mean_mag = table_filtered[mag_col].mean()
@@ -573,297 +1220,995 @@ def _process_band_with_default_filter(
     result = result.drop(columns=['flux_mean', 'flux_error_sq_sum', 'flux_count'])
     result = result.sort_values('mjd').reset_index(drop=True)
     
-    # SQLiteに保存（mjd_meanは整数、等級データは小数点以下4桁に丸める）
-    for _, row in result.iterrows():
-        # mjd_meanを整数に丸める
-        mjd_mean_rounded = int(round(row['mjd']))
-        # mag_mean, mag_se, mag_limを小数点以下4桁に丸める
-        mag_mean_rounded = round(row['mag_mean'], 4) if pd.notna(row['mag_mean']) else None
-        mag_se_rounded = round(row['mag_se'], 4) if pd.notna(row['mag_se']) else None
-        mag_lim_rounded = round(row['mag_lim'], 4) if pd.notna(row['mag_lim']) and not np.isnan(row['mag_lim']) else None
-        snr_rounded = round(row['snr'], 2) if pd.notna(row['snr']) and not np.isnan(row['snr']) else None
-        
-        cursor.execute('''
-            INSERT INTO neowise_epoch_summary 
-            (source_id, band, epoch_id, mjd_mean, mag_mean, mag_se, mag_lim, n_points, snr, filter_applied)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            source_id,
-            band,
-            int(row['epoch_id']),
-            mjd_mean_rounded,
-            mag_mean_rounded,
-            mag_se_rounded,
-            mag_lim_rounded,
-            int(row['n_points']),
-            snr_rounded,
-            'default'
-        ))
-    
-    result['Source'] = source_id
-    result['band'] = band
-    
     print(f"Found {len(result)} good epochs for {band} band, source_id={source_id}")
     return result
 
 
-def get_neowise_by_allwise_tap(
-    allwise_id: str, 
-    source_id: str, 
-    ra: float,
-    dec: float,
-    conn: sqlite3.Connection, 
-    zp_stb_df: Optional[pd.DataFrame] = None,
-    save_raw: bool = True
-) -> Tuple[pd.DataFrame, pd.DataFrame]:
+
+def _char_at(values: pd.Series, idx: int) -> np.ndarray:
+    """文字列の列のidx文字目（1バイト）の配列。短い文字列・欠損値はb''（.str[idx] と同じく一致しない）"""
+    codes = np.array(values.fillna('').to_numpy(), dtype='S')
+    width = codes.dtype.itemsize
+    if width <= idx:
+        return np.full(len(codes), b'', dtype='S1')
+    return codes.view('S1').reshape(len(codes), width)[:, idx]
+
+
+def _default_filter_mask(table_df: pd.DataFrame, band: str) -> np.ndarray:
+    """_aggregate_band_with_default_filter() のデフォルトフィルタを通過する行（等級の欠損も除く）"""
+    band_lower = band.lower()
+    flag_idx = 0 if band == 'W1' else 1
+    return (
+        table_df[f'{band_lower}mpro'].notna().to_numpy() &
+        (_char_at(table_df['cc_flags'], flag_idx) == b'0') &
+        (table_df['sso_flg'] == 0).to_numpy() &
+        (table_df['qi_fact'] == 1.0).to_numpy() &
+        (table_df['saa_sep'] >= 5.0).to_numpy() &
+        (_char_at(table_df['ph_qual'], flag_idx) == b'A') &
+        (_char_at(table_df['moon_masked'], flag_idx) == b'0') &
+        (table_df[f'{band_lower}sat'] <= 0.05).to_numpy() &
+        (table_df[f'{band_lower}rchi2'] <= 50).to_numpy() &
+        (table_df['qual_frame'] > 0.0).to_numpy() &
+        table_df[f'{band_lower}sky'].notna().to_numpy()
+    )
+
+
+def aggregate_sources_vectorized(
+    table_df: pd.DataFrame,
+    source_ids,
+    zp_index: Optional[ZeroPointIndex] = None
+) -> Dict[str, Tuple[pd.DataFrame, pd.DataFrame]]:
     """
-    TAP（Table Access Protocol）を使用してAllWISE IDでNEOWISEデータを取得
-    座標検索より高速（約2-5倍）
+    複数天体分の生データから、全天体・全バンドのエポック集約データを一度に計算する
+    
+    _aggregate_band_with_default_filter() と同じ手順（デフォルトフィルタ → ゼロポイント補正 →
+    3σクリッピング → mjd.diff() >= 100 でエポック分割 → S/N判定 → エポック平均・mag_lim）を、
+    天体×バンドごとのgroupby().agg()やラムダを使わず、backend/epoch_kernel.py の
+    aggregate_epochs()（並べ替え済み配列と np.add.reduceat）で計算する。
+    エポックは元の関数と同じく天体ごとの入力順（IRSAから受け取った順）で区切る
     
     Parameters:
     -----------
-    allwise_id : str
-        AllWISE ID（例: "J192843.67+193120.8"）
-    source_id : str
-        天体の識別子（Gaia SOURCE_ID推奨）
-    ra : float
-        赤経（度）- メタデータ用
-    dec : float
-        赤緯（度）- メタデータ用
-    conn : sqlite3.Connection
-        SQLiteデータベース接続
-    zp_stb_df : pd.DataFrame, optional
+    table_df : pd.DataFrame
+        IRSAのテーブルを天体ごとに縦に連結したもの
+    source_ids : array-like or str
+        各行の天体のsource_id（1天体分ならsource_idの文字列）
+    zp_index : ZeroPointIndex, optional
         ゼロポイント補正テーブル
-    save_raw : bool
-        生データを保存するかどうか
     
     Returns:
     --------
-    tuple
-        (W1のDataFrame, W2のDataFrame) - エポック集約データ
+    dict
+        source_id → (W1のDataFrame, W2のDataFrame)。エポックが無いバンドは空のDataFrame
     """
+    if isinstance(source_ids, str):
+        source_codes, source_uniques = np.zeros(len(table_df), dtype=np.int64), [source_ids]
+    else:
+        source_codes, source_uniques = pd.factorize(np.asarray(source_ids))
     
-    if not ASTROQUERY_AVAILABLE:
-        print(f"Skipping {source_id}: astroquery not available")
-        return pd.DataFrame(), pd.DataFrame()
-    
-    cursor = conn.cursor()
-    
-    # TAP queryでAllWISE IDで直接検索
-    try:
-        # AllWISE IDから allwise_cntr を取得する方法
-        # 注: AllWISE IDは "Jhhmmss.ss+ddmmss.s" 形式
-        # neowiser_p1bs_psd テーブルの designation カラムで検索
+    groups, mjds, mags, mag_errors = [], [], [], []
+    for band_index, band in enumerate(['W1', 'W2']):
+        band_lower = band.lower()
+        mag_col = f'{band_lower}mpro'
+        unc_col = f'{band_lower}sigmpro'
+        dmag_col = f'{band_lower}dmag'
+        try:
+            mask = _default_filter_mask(table_df, band)
+        except (KeyError, TypeError) as e:
+            print(f"Warning: Filter error for {band}: {e}")
+            continue
         
-        query = f"""
-        SELECT * FROM neowiser_p1bs_psd 
-        WHERE designation = '{allwise_id}'
-        ORDER BY mjd
-        """
+        band_mags = table_df[mag_col].to_numpy(dtype=np.float64)[mask]
+        if zp_index is not None and zp_index.has(dmag_col):
+            # 全天体分のscan_idをまとめて1回の二分探索で引く
+            band_mags = band_mags - zp_index.correction(table_df['scan_id'].to_numpy()[mask], dmag_col)
         
-        result = Irsa.query_tap(query)
-        raw_df = result.to_pandas()
-    except Exception as e:
-        print(f"Error querying TAP for AllWISE_ID={allwise_id}: {e}")
-        # フォールバック: 座標検索
-        print(f"  Falling back to coordinate search...")
-        return get_neowise_raw_data(ra, dec, source_id, conn, zp_stb_df, save_raw)
+        # グループ番号 = 天体番号×2 + バンド（W1=0, W2=1）
+        groups.append(source_codes[mask] * 2 + band_index)
+        mjds.append(table_df['mjd'].to_numpy(dtype=np.float64)[mask])
+        mags.append(band_mags)
+        mag_errors.append(table_df[unc_col].to_numpy(dtype=np.float64)[mask])
+    
+    results = {source_id: [pd.DataFrame(), pd.DataFrame()] for source_id in source_uniques}
+    if not groups:
+        return {source_id: tuple(bands) for source_id, bands in results.items()}
+    
+    epochs = aggregate_epochs(
+        np.concatenate(groups), np.concatenate(mjds), np.concatenate(mags), np.concatenate(mag_errors),
+        sort_by_mjd=False
+    )
+    
+    # 天体×バンドごとにエポックの平均MJDの昇順（元の関数と同じ）
+    order = np.lexsort((epochs['mjd'], epochs['group']))
+    group = epochs['group'][order]
+    columns = {name: epochs[name][order] for name in EPOCH_RESULT_COLUMNS}
+    bounds = np.flatnonzero(np.r_[True, group[1:] != group[:-1], True]) if len(group) else []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        group_id = group[start]
+        results[source_uniques[group_id // 2]][group_id % 2] = pd.DataFrame(
+            {name: values[start:end] for name, values in columns.items()}
+        )
+    return {source_id: tuple(bands) for source_id, bands in results.items()}
 
-    if raw_df.empty:
-        print(f"No data found for AllWISE_ID={allwise_id}")
-        return pd.DataFrame(), pd.DataFrame()
+
+def aggregate_bands_vectorized(
+    table_df: pd.DataFrame,
+    source_id: str,
+    zp_index: Optional[ZeroPointIndex]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """aggregate_bands() と同じ結果をベクトル化カーネルで計算（1天体分）"""
+    results = aggregate_sources_vectorized(table_df, source_id, zp_index)[source_id]
+    for result, band in zip(results, ['W1', 'W2']):
+        if not result.empty:
+            print(f"Found {len(result)} good epochs for {band} band, source_id={source_id}")
+    return results
+
+
+def aggregate_sources_batch(
+    table_df: pd.DataFrame,
+    source_ids: List[str],
+    counts: List[int],
+    zp_index: Optional[ZeroPointIndex]
+) -> Dict[str, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    天体ごとに連続して縦に連結した生データ（source_ids[i] の行が counts[i] 行）を1回で集約する
     
-    allwise_cntr = raw_df['allwise_cntr'].iloc[0] if 'allwise_cntr' in raw_df.columns else None
+    一括取得（TAP_UPLOAD）した天体をまとめて aggregate_sources_vectorized() に渡す。
+    結果は天体ごとに aggregate_bands_vectorized() を呼んだ場合と同じ
+    """
+    results = aggregate_sources_vectorized(
+        table_df, np.repeat(np.asarray(source_ids, dtype=object), counts), zp_index
+    )
+    for source_id, bands in results.items():
+        for result, band in zip(bands, ['W1', 'W2']):
+            if not result.empty:
+                print(f"Found {len(result)} good epochs for {band} band, source_id={source_id}")
+    return results
+
+
+# --epoch-kernel で選べるエポック集約の実装（結果は同一）
+EPOCH_KERNELS = {
+    'vectorized': aggregate_bands_vectorized,
+    'pandas': aggregate_bands,
+}
+
+# 複数天体をまとめて集約できる実装（無いカーネルは天体ごとに集約する）
+BATCH_EPOCH_KERNELS = {
+    'vectorized': aggregate_sources_batch,
+}
+
+def epoch_summary_rows(result: pd.DataFrame, source_id, band: str) -> list:
+    """
+    neowise_epoch_summaryに挿入する行（タプル）のリストを作成
     
-    # sourcesテーブルに登録
-    with db_lock:
-        cursor.execute('''
-            INSERT OR IGNORE INTO sources (source_id, ra, dec, allwise_cntr)
-            VALUES (?, ?, ?, ?)
-        ''', (source_id, ra, dec, int(allwise_cntr) if allwise_cntr else None))
+    mjd_meanは整数、等級データは小数点以下4桁に丸める。
+    source_idは1天体分ならsource_idの文字列、複数天体の結果を縦に連結した場合は各行のsource_id
+    """
+    if result.empty:
+        return []
+    
+    return list(zip(
+        [source_id] * len(result) if isinstance(source_id, str) else list(source_id),
+        [band] * len(result),
+        _column_values(result, 'epoch_id', dtype=int),
+        _column_values(result, 'mjd', decimals=0, dtype=int),
+        _column_values(result, 'mag_mean', decimals=4),
+        _column_values(result, 'mag_se', decimals=4),
+        _column_values(result, 'mag_lim', decimals=4),
+        _column_values(result, 'n_points', dtype=int),
+        _column_values(result, 'snr', decimals=2),
+        ['default'] * len(result)
+    ))
+
+
+
+def _pack_frame(table_df: pd.DataFrame) -> np.ndarray:
+    """
+    エポック集約に使う列だけを1つの構造化配列（1行1レコード）にまとめる
     
-    # mjdフィルタリング
-    if zp_stb_df is not None and not zp_stb_df.empty:
-        raw_df = raw_df[raw_df['mjd'] > zp_stb_df['mjd'].min()].reset_index(drop=True)
+    数値はfloat64、文字列は固定長バイト列（欠損は空文字列）にする。
+    pandasのオブジェクト列を含まないため、共有メモリにそのまま置ける
+    """
+    fields = {}
+    for col in AGGREGATION_COLUMNS:
+        if col not in table_df.columns:
+            continue
+        if col in AGGREGATION_STRING_COLUMNS:
+            values = table_df[col].fillna('').astype(str).to_numpy()
+            fields[col] = np.array(values, dtype=f'S{max(1, max(map(len, values), default=1))}')
+        else:
+            fields[col] = pd.to_numeric(table_df[col], errors='coerce').to_numpy(dtype=np.float64)
+    packed = np.empty(len(table_df), dtype=[(col, values.dtype) for col, values in fields.items()])
+    for col, values in fields.items():
+        packed[col] = values
+    return packed
+
+
+def _unpack_frame(packed: np.ndarray) -> pd.DataFrame:
+    """_pack_frame() の逆変換（列はすべてコピーするため、元のバッファは解放してよい）"""
+    return pd.DataFrame({
+        col: packed[col].astype(str) if packed.dtype[col].kind == 'S' else packed[col].copy()
+        for col in packed.dtype.names
+    })
+
+
+# 集約プロセス側のゼロポイント補正テーブルと集約の実装（プロセスの起動時に1回だけ受け取る）
+_worker_zp_index: Optional[ZeroPointIndex] = None
+_worker_aggregate = None
+
+
+def _init_aggregation_worker(zp_index: Optional[ZeroPointIndex], epoch_kernel: str, quiet: bool):
+    global _worker_zp_index, _worker_aggregate
+    _worker_zp_index = zp_index
+    _worker_aggregate = EPOCH_KERNELS[epoch_kernel]
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def _aggregate_shared(
+    shm_name: str,
+    dtype: np.dtype,
+    length: int,
+    source_id: str,
+    use_zp: bool
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    集約プロセスで実行: 共有メモリ上の生データからW1・W2のエポック集約データを計算
     
-    if raw_df.empty:
-        print(f"No data after MJD filtering for source_id={source_id}")
-        return pd.DataFrame(), pd.DataFrame()
+    spawnで起動したプロセスは親とresource_trackerを共有するため、
+    共有メモリの解放（unlink）は作成した親だけが行えばよい
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        packed = np.ndarray(length, dtype=dtype, buffer=shm.buf)
+        table_df = _unpack_frame(packed)
+        del packed
+    finally:
+        shm.close()
+    return _worker_aggregate(table_df, source_id, _worker_zp_index if use_zp else None)
+
+
+def _aggregate_shared_batch(
+    shm_name: str,
+    dtype: np.dtype,
+    length: int,
+    source_ids: List[str],
+    counts: List[int],
+    use_zp: bool
+) -> Dict[str, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """集約プロセスで実行: 共有メモリ上の複数天体分の生データを aggregate_sources_batch() で集約"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        packed = np.ndarray(length, dtype=dtype, buffer=shm.buf)
+        table_df = _unpack_frame(packed)
+        del packed
+    finally:
+        shm.close()
+    return aggregate_sources_batch(table_df, source_ids, counts, _worker_zp_index if use_zp else None)
+
+
+class AggregationPool:
+    """
+    エポック集約（フィルタ・3σクリッピング・groupby）を別プロセスで行うプール
     
-    # 生データをSQLiteに保存
-    if save_raw:
-        with db_lock:
-            _save_raw_observations(raw_df, source_id, zp_stb_df, cursor)
-            conn.commit()
+    集約はpandasの処理とPythonのラムダが中心でGILを手放さないため、計算スレッドを
+    増やしても1コアしか使えない。計算スレッドからaggregate_bands()等の代わりに呼び出すと、
+    集約に必要な列を共有メモリに置いてプロセスに渡し、結果（エポックのDataFrame）を待つ。
+    待っている間はGILを手放すので、取得・書き込みのスレッドは止まらない。
+    ゼロポイント補正テーブルはプロセスの起動時に1回だけ渡す
+    （ディスクに保存したインデックスはパスだけが渡り、各プロセスが同じファイルをメモリマップする）
     
-    # エポック集約データを計算・保存
-    with db_lock:
-        w1_result = _process_band_with_default_filter(raw_df.copy(), 'W1', source_id, zp_stb_df, cursor)
-        w2_result = _process_band_with_default_filter(raw_df.copy(), 'W2', source_id, zp_stb_df, cursor)
-        conn.commit()
+    Parameters:
+    -----------
+    processes : int
+        集約プロセス数
+    zp_index : ZeroPointIndex, optional
+        ゼロポイント補正テーブル
+    epoch_kernel : str
+        プロセス内で使う集約の実装（EPOCH_KERNELSのキー）
+    """
     
-    return w1_result, w2_result
+    def __init__(
+        self,
+        processes: int,
+        zp_index: Optional[ZeroPointIndex] = None,
+        epoch_kernel: str = DEFAULT_EPOCH_KERNEL
+    ):
+        self.processes = processes
+        # 複数天体をまとめて集約できるか（aggregate_batch）
+        self.batch = epoch_kernel in BATCH_EPOCH_KERNELS
+        # 取得・書き込みのスレッドが動いている状態でforkしないようspawnで起動する
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_aggregation_worker,
+            initargs=(zp_index, epoch_kernel, sys.stdout is not sys.__stdout__)
+        )
+    
+    def __call__(
+        self,
+        table_df: pd.DataFrame,
+        source_id: str,
+        zp_index: Optional[ZeroPointIndex]
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        return self._submit(_aggregate_shared, table_df, source_id, zp_index is not None)
+    
+    def aggregate_batch(
+        self,
+        table_df: pd.DataFrame,
+        source_ids: List[str],
+        counts: List[int],
+        zp_index: Optional[ZeroPointIndex]
+    ) -> Dict[str, Tuple[pd.DataFrame, pd.DataFrame]]:
+        """aggregate_sources_batch() を別プロセスで実行（天体の境界は行数だけを渡す）"""
+        return self._submit(_aggregate_shared_batch, table_df, source_ids, counts, zp_index is not None)
+    
+    def _submit(self, function, table_df: pd.DataFrame, *args):
+        packed = _pack_frame(table_df)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, packed.nbytes))
+        try:
+            view = np.ndarray(len(packed), dtype=packed.dtype, buffer=shm.buf)
+            view[:] = packed
+            del view
+            future = self.executor.submit(function, shm.name, packed.dtype, len(packed), *args)
+            return future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+    
+    def shutdown(self):
+        self.executor.shutdown()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.shutdown()
 
 
-def _process_single_source(
-    args: tuple,
-    zp_stb_df: Optional[pd.DataFrame],
-    db_path: str,
+def _fetch_source(
+    source: tuple,
     use_tap: bool = False,
-    max_attempts: int = 4
-) -> Tuple[str, bool, str]:
+    max_attempts: int = 4,
+    since_mjd: Optional[float] = None
+) -> pd.DataFrame:
     """
-    単一の天体を処理（並列処理用）
+    単一の天体の生データをIRSAから取得（並列処理の取得ステージ）
     セマフォによるクエリ数制限とリトライロジック付き
     
     Parameters:
     -----------
-    args : tuple
+    source : tuple
         (source_id, ra, dec, [allwise_id]) のタプル
-    zp_stb_df : pd.DataFrame
-        ゼロポイント補正テーブル
-    db_path : str
-        データベースパス
     use_tap : bool
         TAPクエリを使用するか
     max_attempts : int
         最大リトライ回数
+    since_mjd : float, optional
+        指定するとそれより新しい観測のみを取得（--update）
     
     Returns:
     --------
-    tuple
-        (source_id, success, message)
+    pd.DataFrame
+        生データ（見つからなければ空）
     """
-    source_id = args[0]
-    ra = args[1]
-    dec = args[2]
-    allwise_id = args[3] if len(args) > 3 else None
+    source_id = source[0]
+    
+    if not ASTROQUERY_AVAILABLE:
+        print(f"Skipping {source_id}: astroquery not available")
+        return pd.DataFrame()
     
     logging.info(f"START source {source_id}")
     
-    # 各スレッドで独自の接続を作成
-    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+    with stage_stats.timer('fetch'):
+        return _fetch_source_with_retry(source, use_tap, max_attempts, since_mjd)
+
+
+def _fetch_source_with_retry(
+    source: tuple,
+    use_tap: bool,
+    max_attempts: int,
+    since_mjd: Optional[float]
+) -> pd.DataFrame:
+    """_fetch_source の本体（セマフォによるクエリ数制限と指数バックオフでの再試行）"""
+    source_id, ra, dec = source[0], source[1], source[2]
+    allwise_id = source[3] if len(source) > 3 else None
     
     for attempt in range(max_attempts):
         try:
             # セマフォでIRSAクエリ数を制限
             with query_semaphore:
                 if use_tap and allwise_id:
-                    w1_result, w2_result = get_neowise_by_allwise_tap(
-                        allwise_id, source_id, ra, dec, conn, zp_stb_df, save_raw=True
-                    )
-                else:
-                    w1_result, w2_result = get_neowise_raw_data(
-                        ra, dec, source_id, conn, zp_stb_df, save_raw=True
-                    )
-            
-            conn.close()
-            
-            if not w1_result.empty or not w2_result.empty:
-                logging.info(f"SUCCESS source {source_id}")
-                return (source_id, True, "Success")
-            else:
-                logging.warning(f"No valid data for source {source_id}")
-                return (source_id, False, "No valid data")
-                
+                    try:
+                        return fetch_neowise_tap(allwise_id, since_mjd)
+                    except Exception as e:
+                        print(f"Error querying TAP for AllWISE_ID={allwise_id}: {e}")
+                        print("  Falling back to coordinate search...")
+                return fetch_neowise_region(ra, dec, since_mjd)
         except Exception as e:
             if attempt < max_attempts - 1:
                 wait_time = 2 ** attempt  # exponential backoff
                 logging.warning(f"Attempt {attempt+1} failed for {source_id}: {e}. Retrying in {wait_time}s...")
                 time.sleep(wait_time)
             else:
-                conn.close()
-                logging.error(f"FAILED source {source_id} after {max_attempts} attempts: {e}")
-                return (source_id, False, str(e))
+                raise
+
+
+def _compute_stage(
+    source: tuple,
+    raw_df: Optional[pd.DataFrame],
+    fetch_error: Optional[BaseException],
+    zp_index: Optional[ZeroPointIndex],
+    write_queue: queue.Queue,
+    previous: Optional[IngestState] = None,
+    db_path: Optional[str] = None,
+    aggregate=None,
+    epochs: Optional[Tuple[pd.DataFrame, pd.DataFrame]] = None,
+    batch_seconds: float = 0.0
+):
+    """
+    取得済みの生データからエポック集約を計算し、書き込みキューに積む（並列処理の計算ステージ）
     
-    conn.close()
-    return (source_id, False, "Max attempts exceeded")
+    取得に失敗した場合（fetch_errorあり）はエラーとして書き込みステージに渡す。
+    --update で追加する場合は、保存済みの生データをスレッドごとの読み取り接続で読み込む。
+    aggregateにAggregationPoolを渡すと、エポック集約は別プロセスで行う。
+    epochsは _compute_batch_stage() でまとめて集約した結果（batch_secondsはその所要時間の天体あたりの按分）。
+    キューが一杯の場合はここで待つため、書き込みが追いつかないと取得・計算も止まる
+    """
+    source_id, ra, dec = source[0], source[1], source[2]
+    try:
+        if fetch_error is not None:
+            raise fetch_error
+        start = time.perf_counter()
+        stored_raw_rows = None
+        if previous is not None and previous.last_mjd is not None:
+            stored_raw_rows = load_stored_raw_rows(_thread_read_connection(db_path), source_id)
+        rows = compute_source_rows(source_id, ra, dec, raw_df, zp_index, True, previous, stored_raw_rows,
+                                   aggregate, epochs)
+        stage_stats.add('compute', time.perf_counter() - start + batch_seconds)
+        item = (source_id, rows, None)
+    except Exception as e:
+        logging.error(f"FAILED source {source_id}: {e}")
+        item = (source_id, None, str(e))
+    write_queue.put(item)
+
+
+def _compute_batch_stage(
+    batch: List[tuple],
+    fetched: Dict[str, Tuple[Optional[pd.DataFrame], Optional[BaseException]]],
+    zp_index: Optional[ZeroPointIndex],
+    write_queue: queue.Queue,
+    update_state: Dict[str, IngestState],
+    db_path: str,
+    aggregate=None,
+    aggregate_batch=None
+):
+    """
+    一括取得した天体（TAP_UPLOADの1バッチ）のエポック集約を1回の呼び出しでまとめて計算し、
+    天体ごとに書き込みキューに積む（--async --tap-batch-size の計算ステージ）
+    
+    aggregate_batchは aggregate_sources_batch() または AggregationPool.aggregate_batch。
+    Noneの場合（pandasカーネル）や、取得に失敗した天体・--update で追加する天体は1件ずつ集約する。
+    まとめた集約が失敗した場合も1件ずつ集約し直す
+    """
+    def previous(source):
+        return update_state.get(source[0])
+    
+    def appending(source):
+        state = previous(source)
+        return state is not None and state.last_mjd is not None
+    
+    frames = {}
+    if aggregate_batch is not None:
+        for source in batch:
+            raw_df, error = fetched[source[0]]
+            if error is None and not appending(source) and not raw_df.empty:
+                frame = _zp_range(raw_df, zp_index)
+                if not frame.empty:
+                    frames[source[0]] = frame
+    
+    epochs, batch_seconds = {}, 0.0
+    if frames:
+        start = time.perf_counter()
+        try:
+            epochs = aggregate_batch(
+                pd.concat(frames.values(), ignore_index=True), list(frames),
+                [len(frame) for frame in frames.values()], zp_index
+            )
+        except Exception as e:
+            logging.warning(f"Batched aggregation for {len(frames)} sources failed ({e}). Aggregating one by one...")
+        batch_seconds = (time.perf_counter() - start) / len(frames)
+    
+    for source in batch:
+        raw_df, error = fetched[source[0]]
+        source_epochs = epochs.get(source[0])
+        _compute_stage(source, raw_df, error, zp_index, write_queue, previous(source), db_path, aggregate,
+                       source_epochs, batch_seconds if source_epochs is not None else 0.0)
+
+
+class IngestWriter(threading.Thread):
+    """
+    SQLiteへの書き込み専用スレッド（並列処理の書き込みステージ）
+    
+    キューから1天体分の行（SourceRows）を受け取り、commit_rows行程度ごとに
+    1トランザクションでコミットする。天体ごとにセーブポイントを置くため、書き込みに失敗した天体は
+    行を残さず、ingest_stateのエラーだけが記録される。DBに書き込むのはこのスレッドだけなので、
+    ロックや書き込みの競合（database is locked）は発生しない。
+    キューにNoneが積まれると残りをコミットして終了する
+    
+    Parameters:
+    -----------
+    db_path : str
+        データベースパス
+    write_queue : queue.Queue
+        (source_id, SourceRows or None, エラーメッセージ or None) のキュー
+    commit_rows : int
+        1トランザクションでコミットする行数の目安
+    on_written : callable, optional
+        1天体分を処理するたびに呼ばれる関数
+    """
+    
+    def __init__(self, db_path: str, write_queue: queue.Queue, commit_rows: int = DEFAULT_COMMIT_ROWS, on_written=None):
+        super().__init__(name="ingest-writer", daemon=True)
+        self.db_path = db_path
+        self.write_queue = write_queue
+        self.commit_rows = commit_rows
+        self.on_written = on_written
+        self.success_count = 0
+        self.error_count = 0
+        self.errors = []
+        self.commits = 0
+    
+    def run(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        pending_rows = 0
+        try:
+            while True:
+                item = self.write_queue.get()
+                if item is None:
+                    break
+                
+                source_id, rows, error = item
+                if error is None:
+                    try:
+                        with stage_stats.timer('write'):
+                            write_source_rows_atomic(conn, rows)
+                        pending_rows += rows.num_rows
+                    except Exception as e:
+                        error = f"write failed: {e}"
+                
+                if error is not None:
+                    self.error_count += 1
+                    self.errors.append(f"{source_id}: {error}")
+                    record_ingest_error(cursor, source_id, error)
+                elif rows.has_epochs or rows.append:
+                    self.success_count += 1
+                    logging.info(f"SUCCESS source {source_id}")
+                else:
+                    self.error_count += 1
+                    logging.warning(f"No valid data for source {source_id}")
+                
+                if pending_rows >= self.commit_rows:
+                    with stage_stats.timer('commit'):
+                        conn.commit()
+                    self.commits += 1
+                    pending_rows = 0
+                
+                if self.on_written is not None:
+                    self.on_written()
+            
+            with stage_stats.timer('commit'):
+                conn.commit()
+            self.commits += 1
+        finally:
+            conn.close()
 
 
 def batch_process_sources_parallel(
-    source_list: List[tuple], 
-    db_path: str, 
-    zp_stb_df: Optional[pd.DataFrame] = None,
+    source_list: List[tuple],
+    db_path: str,
+    zp_index: Optional[ZeroPointIndex] = None,
     num_workers: int = 4,
-    use_tap: bool = False
+    use_tap: bool = False,
+    compute_workers: Optional[int] = None,
+    queue_size: int = DEFAULT_WRITE_QUEUE_SIZE,
+    commit_rows: int = DEFAULT_COMMIT_ROWS,
+    update_state: Optional[Dict[str, IngestState]] = None,
+    compute_processes: Optional[int] = None,
+    epoch_kernel: str = DEFAULT_EPOCH_KERNEL
 ):
     """
     複数の天体を並列処理してSQLiteに保存
     
+    取得（num_workersスレッド）→ 計算（compute_workersスレッド）→ 書き込み（1スレッド）
+    のパイプラインで処理する。各ステージの間はキューでつながっており、
+    同時に扱う天体数は上限を持つため、天体数が多くてもメモリ使用量は一定に保たれる。
+    compute_processesを指定すると、エポック集約はその数のプロセスで行う（全コアを使う）。
+    
     Parameters:
     -----------
     source_list : list
         [(source_id, ra, dec, [allwise_id]), ...] のリスト
     db_path : str
         出力するSQLiteファイルのパス
-    zp_stb_df : pd.DataFrame, optional
+    zp_index : ZeroPointIndex, optional
         ゼロポイント補正テーブル
     num_workers : int
-        並列ワーカー数（デフォルト: 4）
+        IRSAからの取得を行うワーカー数（デフォルト: 4）
     use_tap : bool
         TAPクエリを使用するか（AllWISE_IDが必要）
+    compute_workers : int, optional
+        エポック集約を行うワーカー数（デフォルト: CPUコア数とnum_workersの小さい方）
+    queue_size : int
+        書き込みキューの長さ
+    commit_rows : int
+        1トランザクションでコミットする行数の目安
+    update_state : dict, optional
+        --update 時の source_id → IngestState（保存済みの天体は新しい観測のみ追加）
+    compute_processes : int, optional
+        エポック集約を行うプロセス数（デフォルト: 計算スレッド内で集約）
+    epoch_kernel : str
+        エポック集約の実装（EPOCH_KERNELSのキー、デフォルト: DEFAULT_EPOCH_KERNEL）
     """
     
     # データベース作成（メインスレッドで）
     conn = create_neowise_database(db_path)
     conn.close()
+    update_state = update_state or {}
     
     # IRSAセッションの準備（コネクションプールとリトライ設定）
     prepare_irsa_session(pool_maxsize=num_workers * 2, max_retries=3, backoff_factor=1.0)
     
-    print(f"Processing {len(source_list)} sources with {num_workers} workers...")
+    if compute_workers is None:
+        if compute_processes:
+            # 計算スレッドは集約プロセスの結果を待つだけなので、プロセス数より多めにする
+            compute_workers = compute_processes * 2
+        else:
+            compute_workers = max(1, min(num_workers, os.cpu_count() or 1))
+    
+    print(f"Processing {len(source_list)} sources with {num_workers} fetch workers, "
+          f"{compute_workers} compute workers and 1 writer...")
+    if compute_processes:
+        aggregator = AggregationPool(compute_processes, zp_index, epoch_kernel)
+        print(f"Aggregating epochs in {compute_processes} processes ({epoch_kernel} kernel)")
+    else:
+        aggregator = EPOCH_KERNELS[epoch_kernel]
     if use_tap:
         print("Using TAP query (AllWISE ID search) - faster!")
     
     start_time = time.time()
-    success_count = 0
-    error_count = 0
-    errors = []
-    
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        futures = {
-            executor.submit(
-                _process_single_source, 
-                source, 
-                zp_stb_df, 
-                db_path,
-                use_tap
-            ): source[0]
-            for source in source_list
-        }
+    insert_stats.reset()
+    stage_stats.reset()
+    
+    # 取得中・計算中・書き込み待ちの天体数の上限（書き込みが終わると解放）
+    inflight = threading.BoundedSemaphore(num_workers + compute_workers + queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    writer = IngestWriter(db_path, write_queue, commit_rows, on_written=inflight.release)
+    writer.start()
+    
+    # 取得プールを先に閉じる（取得完了時のコールバックが計算プールに投入するため）
+    with ThreadPoolExecutor(max_workers=compute_workers, thread_name_prefix="compute") as compute_pool:
         
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing"):
-            source_id = futures[future]
+        def on_fetched(future, source):
+            error = future.exception()
+            raw_df = None if error is not None else future.result()
+            compute_pool.submit(
+                _compute_stage, source, raw_df, error, zp_index, write_queue,
+                update_state.get(source[0]), db_path, aggregator
+            )
+        
+        with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="fetch") as fetch_pool:
+            for source in tqdm(source_list, total=len(source_list), desc="Processing"):
+                inflight.acquire()
+                previous = update_state.get(source[0])
+                since_mjd = previous.last_mjd if previous is not None else None
+                fetch_future = fetch_pool.submit(_fetch_source, source, use_tap, since_mjd=since_mjd)
+                fetch_future.add_done_callback(lambda future, source=source: on_fetched(future, source))
+    
+    write_queue.put(None)
+    writer.join()
+    if isinstance(aggregator, AggregationPool):
+        aggregator.shutdown()
+    
+    elapsed_time = time.time() - start_time
+    
+    print("\n=== Summary ===")
+    print(f"Database saved to: {db_path}")
+    print(f"Successfully processed: {writer.success_count}")
+    print(f"Errors: {writer.error_count}")
+    print(f"Total time: {elapsed_time:.1f} seconds ({elapsed_time/len(source_list):.2f} sec/source)")
+    print(f"Transactions committed: {writer.commits}")
+    insert_stats.print_summary(elapsed_time)
+    stage_stats.print_summary()
+    
+    if writer.errors:
+        print("\nFirst 10 errors:")
+        for err in writer.errors[:10]:
+            print(f"  {err}")
+
+
+async def _fetch_source_async(
+    client: AsyncIrsaClient,
+    source: tuple,
+    use_tap: bool = False,
+    since_mjd: Optional[float] = None
+) -> pd.DataFrame:
+    """
+    単一の天体の生データを非同期に取得（--async モードの取得ステージ）
+    
+    再試行はクライアント側で asyncio.sleep により行うため、待機中もスレッドを占有しない
+    """
+    ra, dec = source[1], source[2]
+    allwise_id = source[3] if len(source) > 3 else None
+    
+    if use_tap and allwise_id:
+        try:
+            raw_df = await client.fetch_designation(allwise_id, since_mjd)
+            if raw_df.empty:
+                print(f"No data found for AllWISE_ID={allwise_id}")
+            return raw_df
+        except Exception as e:
+            print(f"Error querying TAP for AllWISE_ID={allwise_id}: {e}")
+            print("  Falling back to coordinate search...")
+    
+    return _single_object_or_empty(await client.fetch_region(ra, dec, since_mjd), ra, dec)
+
+
+async def _fetch_batch_async(
+    client: AsyncIrsaClient,
+    batch: List[tuple],
+    use_tap: bool,
+    update_state: Dict[str, IngestState]
+) -> Dict[str, Tuple[Optional[pd.DataFrame], Optional[BaseException]]]:
+    """
+    複数の天体の生データを天体リストのアップロード（TAP_UPLOAD）で一括取得（--tap-batch-size）
+    
+    AllWISE IDのある天体はID結合、それ以外は座標結合の1クエリにまとめ、結果を天体ごとに分割する。
+    一括クエリが失敗した場合は、その天体を1件ずつの問い合わせで取得し直す
+    
+    Returns:
+    --------
+    dict
+        source_id → (生データ, 取得時の例外)
+    """
+    def since(source):
+        previous = update_state.get(source[0])
+        return previous.last_mjd if previous is not None else None
+    
+    results = {}
+    by_position = list(batch)
+    
+    if use_tap:
+        by_designation = [s for s in batch if len(s) > 3 and s[3]]
+        by_position = [s for s in batch if not (len(s) > 3 and s[3])]
+        if by_designation:
             try:
-                sid, success, msg = future.result()
-                if success:
-                    success_count += 1
-                else:
-                    error_count += 1
-                    if msg != "No valid data":
-                        errors.append(f"{sid}: {msg}")
+                frames = await client.fetch_designation_batch([(s[0], s[3], since(s)) for s in by_designation])
+                for source in by_designation:
+                    if frames[source[0]].empty:
+                        print(f"No data found for AllWISE_ID={source[3]}")
+                    results[source[0]] = (frames[source[0]], None)
             except Exception as e:
-                error_count += 1
-                errors.append(f"{source_id}: {str(e)}")
+                print(f"Error querying TAP for {len(by_designation)} AllWISE IDs: {e}")
+                print("  Falling back to coordinate search...")
+                by_position += by_designation
+    
+    if by_position:
+        try:
+            frames = await client.fetch_region_batch([(s[0], s[1], s[2], since(s)) for s in by_position])
+            for source in by_position:
+                results[source[0]] = (_single_object_or_empty(frames[source[0]], source[1], source[2]), None)
+        except Exception as e:
+            logging.warning(f"Batched TAP query for {len(by_position)} sources failed ({e}). Querying one by one...")
+            
+            async def fetch_one(source):
+                try:
+                    return source[0], (await _fetch_source_async(client, source, False, since(source)), None)
+                except Exception as error:
+                    return source[0], (None, error)
+            
+            results.update(await asyncio.gather(*(fetch_one(s) for s in by_position)))
+    
+    return results
+
+
+async def _run_async_fetchers(
+    source_list: List[tuple],
+    client: AsyncIrsaClient,
+    use_tap: bool,
+    compute_pool: ThreadPoolExecutor,
+    compute_slots: int,
+    zp_index: Optional[ZeroPointIndex],
+    write_queue: queue.Queue,
+    update_state: Dict[str, IngestState],
+    db_path: str,
+    batch_size: int = DEFAULT_TAP_BATCH_SIZE,
+    aggregator=None,
+    aggregate_batch=None
+):
+    """
+    max_in_flight個のコルーチンで天体リストを順に取得し、計算プールに渡す
+    
+    batch_sizeが2以上なら、batch_size個ずつ1クエリにまとめて取得し、
+    エポック集約もバッチごとに1回で行う（_compute_batch_stage）。
+    計算待ちのタスク（天体またはバッチ）の数はcompute_slotsまでに制限する（書き込みが詰まると取得も止まる）
+    """
+    loop = asyncio.get_running_loop()
+    batches = [source_list[i:i + batch_size] for i in range(0, len(source_list), batch_size)]
+    batches = iter(tqdm(batches, total=len(batches), desc="Processing"))
+    compute_pending = asyncio.Semaphore(compute_slots)
+    
+    async def fetch_worker():
+        # 1つのイテレータを全コルーチンで共有（イベントループ上なので競合しない）
+        for batch in batches:
+            start = time.perf_counter()
+            if len(batch) > 1:
+                fetched = await _fetch_batch_async(client, batch, use_tap, update_state)
+            else:
+                source = batch[0]
+                previous = update_state.get(source[0])
+                since_mjd = previous.last_mjd if previous is not None else None
+                try:
+                    fetched = {source[0]: (await _fetch_source_async(client, source, use_tap, since_mjd), None)}
+                except Exception as e:
+                    fetched = {source[0]: (None, e)}
+            stage_stats.add('fetch', time.perf_counter() - start)
+            
+            for source in batch:
+                error = fetched[source[0]][1]
+                if error is not None:
+                    logging.error(f"FAILED source {source[0]}: {error}")
+            
+            await compute_pending.acquire()
+            if len(batch) > 1:
+                future = loop.run_in_executor(
+                    compute_pool, _compute_batch_stage, batch, fetched, zp_index, write_queue,
+                    update_state, db_path, aggregator, aggregate_batch
+                )
+            else:
+                raw_df, error = fetched[batch[0][0]]
+                future = loop.run_in_executor(
+                    compute_pool, _compute_stage, batch[0], raw_df, error, zp_index, write_queue,
+                    update_state.get(batch[0][0]), db_path, aggregator
+                )
+            future.add_done_callback(lambda _: compute_pending.release())
+    
+    await asyncio.gather(*(fetch_worker() for _ in range(client.max_in_flight)))
+    
+    # 計算中の天体がすべて書き込みキューに積まれるまで待つ
+    for _ in range(compute_slots):
+        await compute_pending.acquire()
+
+
+def batch_process_sources_async(
+    source_list: List[tuple],
+    db_path: str,
+    zp_index: Optional[ZeroPointIndex] = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    use_tap: bool = False,
+    irsa_url: str = DEFAULT_IRSA_URL,
+    compute_workers: Optional[int] = None,
+    queue_size: int = DEFAULT_WRITE_QUEUE_SIZE,
+    commit_rows: int = DEFAULT_COMMIT_ROWS,
+    update_state: Optional[Dict[str, IngestState]] = None,
+    tap_batch_size: int = DEFAULT_TAP_BATCH_SIZE,
+    compute_processes: Optional[int] = None,
+    epoch_kernel: str = DEFAULT_EPOCH_KERNEL
+):
+    """
+    複数の天体をasyncioで取得してSQLiteに保存
+    
+    IRSAへの問い合わせは1つのイベントループ・1つのHTTPセッションで行い、
+    同時リクエスト数はmax_in_flightで制限する。スレッド数を増やさずに
+    数百件のリクエストを同時に待てる。tap_batch_sizeを2以上にすると、
+    天体リストをアップロードしてtap_batch_size個ずつ1クエリで取得する。
+    計算・書き込みは並列処理と同じ（計算スレッドプール → 書き込み専用スレッド）。
+    compute_processesを指定すると、エポック集約はその数のプロセスで行う。
+    
+    Parameters:
+    -----------
+    source_list : list
+        [(source_id, ra, dec, [allwise_id]), ...] のリスト
+    db_path : str
+        出力するSQLiteファイルのパス
+    zp_index : ZeroPointIndex, optional
+        ゼロポイント補正テーブル
+    max_in_flight : int
+        同時に発行するIRSAリクエスト数
+    use_tap : bool
+        AllWISE IDで検索するか（AllWISE_IDが必要）
+    irsa_url : str
+        IRSAのベースURL（ローカルのスタンドインサーバーも指定可）
+    compute_workers : int, optional
+        エポック集約を行うワーカー数（デフォルト: CPUコア数）
+    queue_size : int
+        書き込みキューの長さ
+    commit_rows : int
+        1トランザクションでコミットする行数の目安
+    update_state : dict, optional
+        --update 時の source_id → IngestState（保存済みの天体は新しい観測のみ追加）
+    tap_batch_size : int
+        1回のTAPクエリにまとめる天体数（1なら天体ごとに問い合わせ）
+    compute_processes : int, optional
+        エポック集約を行うプロセス数（デフォルト: 計算スレッド内で集約）
+    epoch_kernel : str
+        エポック集約の実装（EPOCH_KERNELSのキー、デフォルト: DEFAULT_EPOCH_KERNEL）
+    """
+    if not AIOHTTP_AVAILABLE:
+        print("Error: --async requires aiohttp (pip install aiohttp)")
+        return
+    
+    # データベース作成（メインスレッドで）
+    conn = create_neowise_database(db_path)
+    conn.close()
+    update_state = update_state or {}
+    
+    if compute_workers is None:
+        compute_workers = compute_processes * 2 if compute_processes else os.cpu_count() or 1
+    
+    print(f"Processing {len(source_list)} sources with up to {max_in_flight} requests in flight "
+          f"({irsa_url}), {compute_workers} compute workers and 1 writer...")
+    if compute_processes:
+        aggregator = AggregationPool(compute_processes, zp_index, epoch_kernel)
+        aggregate_batch = aggregator.aggregate_batch if aggregator.batch else None
+        print(f"Aggregating epochs in {compute_processes} processes ({epoch_kernel} kernel)")
+    else:
+        aggregator = EPOCH_KERNELS[epoch_kernel]
+        aggregate_batch = BATCH_EPOCH_KERNELS.get(epoch_kernel)
+    if use_tap:
+        print("Using TAP query (AllWISE ID search) - faster!")
+    if tap_batch_size > 1:
+        print(f"Uploading targets in batches of {tap_batch_size} sources per TAP query")
+    
+    start_time = time.time()
+    insert_stats.reset()
+    stage_stats.reset()
+    
+    write_queue = queue.Queue(maxsize=queue_size)
+    writer = IngestWriter(db_path, write_queue, commit_rows)
+    writer.start()
+    
+    async def run():
+        async with AsyncIrsaClient(irsa_url, max_in_flight=max_in_flight) as client:
+            await _run_async_fetchers(
+                source_list, client, use_tap, compute_pool, compute_workers * 2, zp_index, write_queue,
+                update_state, db_path, max(1, tap_batch_size), aggregator, aggregate_batch
+            )
+            return client.requests, client.retries
+    
+    with ThreadPoolExecutor(max_workers=compute_workers, thread_name_prefix="compute") as compute_pool:
+        num_requests, num_retries = asyncio.run(run())
+    
+    write_queue.put(None)
+    writer.join()
+    if isinstance(aggregator, AggregationPool):
+        aggregator.shutdown()
     
     elapsed_time = time.time() - start_time
     
-    print(f"\n=== Summary ===")
+    print("\n=== Summary ===")
     print(f"Database saved to: {db_path}")
-    print(f"Successfully processed: {success_count}")
-    print(f"Errors: {error_count}")
+    print(f"Successfully processed: {writer.success_count}")
+    print(f"Errors: {writer.error_count}")
     print(f"Total time: {elapsed_time:.1f} seconds ({elapsed_time/len(source_list):.2f} sec/source)")
-    
-    if errors:
-        print(f"\nFirst 10 errors:")
-        for err in errors[:10]:
+    print(f"HTTP requests: {num_requests} ({num_retries} retries)")
+    print(f"Transactions committed: {writer.commits}")
+    insert_stats.print_summary(elapsed_time)
+    stage_stats.print_summary()
+    
+    if writer.errors:
+        print("\nFirst 10 errors:")
+        for err in writer.errors[:10]:
             print(f"  {err}")
 
 
 def batch_process_sources(
     source_list: List[Tuple[str, float, float]], 
     db_path: str, 
-    zp_stb_df: Optional[pd.DataFrame] = None
+    zp_index: Optional[ZeroPointIndex] = None,
+    update_state: Optional[Dict[str, IngestState]] = None,
+    epoch_kernel: str = DEFAULT_EPOCH_KERNEL
 ):
     """
     複数の天体を一括処理してSQLiteに保存（シーケンシャル処理）
@@ -874,25 +2219,34 @@ def batch_process_sources(
         [(source_id, ra, dec), ...] のリスト
     db_path : str
         出力するSQLiteファイルのパス
-    zp_stb_df : pd.DataFrame, optional
+    zp_index : ZeroPointIndex, optional
         ゼロポイント補正テーブル
+    update_state : dict, optional
+        --update 時の source_id → IngestState（保存済みの天体は新しい観測のみ追加）
+    epoch_kernel : str
+        エポック集約の実装（EPOCH_KERNELSのキー、デフォルト: DEFAULT_EPOCH_KERNEL）
     """
     
     # データベース作成
     conn = create_neowise_database(db_path)
+    update_state = update_state or {}
     
     print(f"Processing {len(source_list)} sources (sequential)...")
     
     start_time = time.time()
     success_count = 0
     error_count = 0
+    insert_stats.reset()
+    stage_stats.reset()
     
     for source_id, ra, dec in tqdm(source_list, desc="Processing sources"):
         try:
+            previous = update_state.get(source_id)
             w1_result, w2_result = get_neowise_raw_data(
-                ra, dec, source_id, conn, zp_stb_df, save_raw=True
+                ra, dec, source_id, conn, zp_index, save_raw=True, previous=previous,
+                aggregate=EPOCH_KERNELS[epoch_kernel]
             )
-            if not w1_result.empty or not w2_result.empty:
+            if not w1_result.empty or not w2_result.empty or previous is not None:
                 success_count += 1
         except Exception as e:
             print(f"Error processing source_id={source_id}: {e}")
@@ -903,11 +2257,13 @@ def batch_process_sources(
     
     elapsed_time = time.time() - start_time
     
-    print(f"\n=== Summary ===")
+    print("\n=== Summary ===")
     print(f"Database saved to: {db_path}")
     print(f"Successfully processed: {success_count}")
     print(f"Errors: {error_count}")
     print(f"Total time: {elapsed_time:.1f} seconds ({elapsed_time/len(source_list):.2f} sec/source)")
+    insert_stats.print_summary(elapsed_time)
+    stage_stats.print_summary()
 
 
 def main():
@@ -930,7 +2286,7 @@ def main():
         '--zp-stb', '-z',
         type=str,
         default=None,
-        help='NEOWISE_zp_stb.csvのパス'
+        help='NEOWISE_zp_stb.csvのパス（初回に隣へ *.zpidx のインデックスを作成）、または zero_point.py で作成したインデックス'
     )
     parser.add_argument(
         '--parallel', '-p',
@@ -943,11 +2299,79 @@ def main():
         default=4,
         help='並列ワーカー数（デフォルト: 4）'
     )
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='asyncioでIRSAに問い合わせる（aiohttpが必要、数百件の同時リクエストに対応）'
+    )
+    parser.add_argument(
+        '--max-in-flight',
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help=f'--async: 同時に発行するリクエスト数（デフォルト: {DEFAULT_MAX_IN_FLIGHT}）'
+    )
+    parser.add_argument(
+        '--irsa-url',
+        type=str,
+        default=DEFAULT_IRSA_URL,
+        help=f'IRSAのベースURL（mock_irsa_server.py等のスタンドイン、デフォルト: {DEFAULT_IRSA_URL}）'
+    )
+    parser.add_argument(
+        '--tap-batch-size',
+        type=int,
+        default=DEFAULT_TAP_BATCH_SIZE,
+        help='--async: 天体リストをアップロードして1回のTAPクエリで取得する天体数（デフォルト: 1 = 天体ごとに問い合わせ）'
+    )
+    parser.add_argument(
+        '--compute-workers',
+        type=int,
+        default=None,
+        help='並列処理: エポック集約を行うワーカー数（デフォルト: CPUコア数とworkersの小さい方）'
+    )
+    parser.add_argument(
+        '--compute-processes',
+        type=int,
+        nargs='?',
+        const=os.cpu_count() or 1,
+        default=None,
+        help='並列処理・--async: エポック集約を別プロセスで行う（プロセス数、省略時はCPUコア数）'
+    )
+    parser.add_argument(
+        '--epoch-kernel',
+        type=str,
+        choices=list(EPOCH_KERNELS),
+        default=DEFAULT_EPOCH_KERNEL,
+        help=f'エポック集約の実装（結果は同一、デフォルト: {DEFAULT_EPOCH_KERNEL}）'
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=DEFAULT_WRITE_QUEUE_SIZE,
+        help=f'並列処理: 書き込みキューの長さ（デフォルト: {DEFAULT_WRITE_QUEUE_SIZE}）'
+    )
+    parser.add_argument(
+        '--commit-rows',
+        type=int,
+        default=DEFAULT_COMMIT_ROWS,
+        help=f'並列処理: 1トランザクションでコミットする行数（デフォルト: {DEFAULT_COMMIT_ROWS}）'
+    )
     parser.add_argument(
         '--use-tap',
         action='store_true',
         help='TAP検索を使用（AllWISE_IDカラムが必要、高速）'
     )
+    resume_group = parser.add_mutually_exclusive_group()
+    resume_group.add_argument(
+        '--resume',
+        action='store_true',
+        help='取り込み済み（ingest_stateがdone/no_data）の天体をスキップして再開'
+    )
+    resume_group.add_argument(
+        '--update',
+        action='store_true',
+        help='取り込み済みの天体は保存済みの最大MJDより新しい観測のみを取得して追加'
+    )
     parser.add_argument(
         '--clear',
         action='store_true',
@@ -979,8 +2403,15 @@ def main():
         print("       Use --clear or --drop alone to manage the database")
         return
     
-    # 天体リストを読み込み
-    sources_df = pd.read_csv(args.sources)
+    # v2スキーマ（migrate_neowise_db.py で変換したDB）には書き込まない
+    if schema_version(args.output) == SCHEMA_V2:
+        print(f"Error: {args.output} uses the v2 schema (converted by migrate_neowise_db.py)")
+        print("       Ingest into a v1 database and convert it again")
+        return
+    
+    # 天体リストを読み込み（source_idは文字列のまま読む。数値として読むと
+    # 他の列と一緒にfloatに変換され、19桁のGaia SOURCE_IDが壊れる）
+    sources_df = pd.read_csv(args.sources, dtype={'source_id': str, 'AllWISE_ID': str})
     required_cols = ['source_id', 'ra', 'dec']
     
     for col in required_cols:
@@ -1008,22 +2439,70 @@ def main():
             for _, row in sources_df.iterrows()
         ]
     
+    # 取り込み状況に応じて対象を絞り込む
+    update_state = None
+    if args.resume:
+        ingest_state = load_ingest_state(args.output)
+        completed = {sid for sid, state in ingest_state.items() if state.status in ('done', 'no_data')}
+        source_list = [s for s in source_list if s[0] not in completed]
+        print(f"Resume: skipping {len(completed)} completed sources, {len(source_list)} remaining")
+    elif args.update:
+        backfill_ingest_state(args.output)
+        update_state = {
+            sid: state for sid, state in load_ingest_state(args.output).items()
+            if state.last_mjd is not None
+        }
+        print(f"Update: {len(update_state)} sources will fetch only observations newer than their stored max MJD")
+    
+    if not source_list:
+        print("Nothing to do")
+        return
+    
     # ゼロポイント補正テーブルを読み込み
-    zp_stb_df = load_zp_stb(args.zp_stb)
+    zp_index = load_zp_stb(args.zp_stb)
+    use_irsa_url(args.irsa_url)
+    
+    if args.compute_processes and not (args.parallel or args.use_async):
+        print("Warning: --compute-processes requires --parallel or --async. Aggregating in the main process.")
+    if args.tap_batch_size > 1 and not args.use_async:
+        print("Warning: --tap-batch-size requires --async. Querying one source at a time.")
     
     # 処理実行
-    if args.parallel:
+    if args.use_async:
+        batch_process_sources_async(
+            source_list,
+            args.output,
+            zp_index,
+            max_in_flight=args.max_in_flight,
+            use_tap=args.use_tap,
+            irsa_url=args.irsa_url,
+            compute_workers=args.compute_workers,
+            queue_size=args.queue_size,
+            commit_rows=args.commit_rows,
+            update_state=update_state,
+            tap_batch_size=args.tap_batch_size,
+            compute_processes=args.compute_processes,
+            epoch_kernel=args.epoch_kernel
+        )
+    elif args.parallel:
         batch_process_sources_parallel(
             source_list, 
             args.output, 
-            zp_stb_df,
+            zp_index,
             num_workers=args.workers,
-            use_tap=args.use_tap
+            use_tap=args.use_tap,
+            compute_workers=args.compute_workers,
+            queue_size=args.queue_size,
+            commit_rows=args.commit_rows,
+            update_state=update_state,
+            compute_processes=args.compute_processes,
+            epoch_kernel=args.epoch_kernel
         )
     else:
         # シーケンシャル処理（従来方式）
         simple_source_list = [(s[0], s[1], s[2]) for s in source_list]
-        batch_process_sources(simple_source_list, args.output, zp_stb_df)
+        batch_process_sources(simple_source_list, args.output, zp_index, update_state=update_state,
+                              epoch_kernel=args.epoch_kernel)
 
 
 
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+ライトカーブJSONの事前圧縮スクリプト
+
+prototype/data/ 以下の全JSONファイルについて、gzip（.json.gz）と
+brotli（.json.br）の圧縮版を同じディレクトリに書き出す。
+バックエンド（app.py）はAccept-Encodingに応じてこれらをそのまま配信する。
+
+圧縮前にJSONとして読み込めること、必須キーが揃っていることを確認するため、
+配信時のjson.load・pydantic検証は不要になる。
+
+使用方法:
+    python precompress_data.py
+    python precompress_data.py --data-dir ../data --force
+"""
+
+import argparse
+import gzip
+import json
+from pathlib import Path
+
+# brotliは利用可能な場合のみインポート
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+    print("Warning: brotli not available. Only gzip variants will be written.")
+
+REQUIRED_KEYS = {"source_id", "ra", "dec", "num_observations", "observations"}
+
+
+def validate_lightcurve(path: Path) -> bool:
+    """JSONとして読み込め、必須キーが揃っているか確認"""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"  Skipping {path.name}: invalid JSON ({e})")
+        return False
+
+    missing = REQUIRED_KEYS - set(data)
+    if missing:
+        print(f"  Skipping {path.name}: missing keys {sorted(missing)}")
+        return False
+    return True
+
+
+def write_if_stale(source: Path, target: Path, compress, force: bool) -> bool:
+    """圧縮版が存在しないか古い場合のみ書き出す"""
+    if not force and target.exists() and target.stat().st_mtime_ns >= source.stat().st_mtime_ns:
+        return False
+    data = source.read_bytes()
+    tmp_path = target.with_name(target.name + ".tmp")
+    tmp_path.write_bytes(compress(data))
+    tmp_path.replace(target)
+    return True
+
+
+def precompress_directory(data_dir: Path, force: bool = False) -> dict:
+    """ディレクトリ内の全JSONファイルの圧縮版を作成"""
+    stats = {"files": 0, "skipped": 0, "written": 0, "raw_bytes": 0, "gzip_bytes": 0, "brotli_bytes": 0}
+
+    for path in sorted(data_dir.glob("*.json")):
+        if not validate_lightcurve(path):
+            stats["skipped"] += 1
+            continue
+        stats["files"] += 1
+        stats["raw_bytes"] += path.stat().st_size
+
+        # mtime=0で内容が同じなら同じバイト列になるようにする
+        gz_path = path.with_name(path.name + ".gz")
+        if write_if_stale(path, gz_path, lambda b: gzip.compress(b, compresslevel=9, mtime=0), force):
+            stats["written"] += 1
+        stats["gzip_bytes"] += gz_path.stat().st_size
+
+        if BROTLI_AVAILABLE:
+            br_path = path.with_name(path.name + ".br")
+            if write_if_stale(path, br_path, lambda b: brotli.compress(b, quality=11), force):
+                stats["written"] += 1
+            stats["brotli_bytes"] += br_path.stat().st_size
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ライトカーブJSONのgzip/brotli圧縮版を作成')
+    parser.add_argument(
+        '--data-dir', '-d',
+        type=str,
+        default=str(Path(__file__).parent.parent / "data"),
+        help='データディレクトリ（neowise/, asassn/ を含む）'
+    )
+    parser.add_argument(
+        '--force', '-f',
+        action='store_true',
+        help='既存の圧縮版も作り直す'
+    )
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    for survey in ["neowise", "asassn"]:
+        survey_dir = data_dir / survey
+        if not survey_dir.exists():
+            print(f"Warning: {survey_dir} not found")
+            continue
+
+        stats = precompress_directory(survey_dir, args.force)
+        print(f"{survey}: {stats['files']} files ({stats['skipped']} skipped), {stats['written']} variants written")
+        if stats["raw_bytes"]:
+            print(f"  raw:    {stats['raw_bytes']:>10,} bytes")
+            print(f"  gzip:   {stats['gzip_bytes']:>10,} bytes ({stats['gzip_bytes'] / stats['raw_bytes']:.1%})")
+            if BROTLI_AVAILABLE:
+                print(f"  brotli: {stats['brotli_bytes']:>10,} bytes ({stats['brotli_bytes'] / stats['raw_bytes']:.1%})")
+
+
+if __name__ == "__main__":
+    main()
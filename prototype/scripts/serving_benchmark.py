@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+配信側（app_custom.py / app.py）のHTTP負荷ベンチマーク
+
+ビューアー（index.html）のアクセスパターンを再現する:
+    1セッション = GET /api/list
+                  → 天体ごとに /api/lightcurve/neowise と /api/lightcurve/asassn を同時に取得
+                    （Promise.all と同じ）を stars-per-session 回
+--users 個の仮想ユーザーがこのセッションを --duration 秒間繰り返し、
+エンドポイントごとのスループットとレイテンシのパーセンタイル（p50/p90/p95/p99）を表示する。
+
+天体は --db を指定するとDBの全天体から無作為に選ぶ（キャッシュが効きにくい本番に近い負荷）。
+--db にはSQLiteのDBのほか、Parquetデータセット（convert_to_parquet.py）やJSONディレクトリも指定できる。
+指定しない場合は /api/list が返す天体（先頭20件）から選ぶ。
+--start-server を付けると、--db のストアで --app のAPI（uvicorn）を起動してから計測する
+（ストアは環境変数 NEOWISE_STORE で渡す）。
+
+aiohttpが必要（pip install aiohttp）。
+
+使用方法:
+    python generate_synthetic_db.py --sources 100000 --output synthetic_100k.db
+    python serving_benchmark.py --db synthetic_100k.db --start-server --users 32 --duration 60
+    python convert_to_parquet.py --input synthetic_100k.db --output synthetic_100k_parquet
+    python serving_benchmark.py --db synthetic_100k_parquet --start-server --users 32 --duration 60
+    python serving_benchmark.py --url http://localhost:8000 --users 8 --raw-fraction 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# aiohttpは利用可能な場合のみインポート
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# --start-server で起動できるAPI
+APPS = ["app_custom", "app"]
+
+# 結果の表の行（エンドポイント）
+ENDPOINTS = ["list", "neowise", "asassn", "star"]
+ENDPOINT_LABELS = {
+    "list": "/api/list",
+    "neowise": "/api/lightcurve/neowise",
+    "asassn": "/api/lightcurve/asassn",
+    "star": "star view (neowise+asassn)",
+}
+PERCENTILES = [50, 90, 95, 99]
+
+
+def sample_source_ids(db_path: str, sample_size: int, seed: int) -> List[str]:
+    """DBの天体から無作為にsample_size個のsource_idを選ぶ（sources.idで抽出）"""
+    if Path(db_path).is_dir():
+        return sample_store_source_ids(db_path, sample_size, seed)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        max_id = conn.execute("SELECT MAX(id) FROM sources").fetchone()[0] or 0
+        rng = np.random.default_rng(seed)
+        ids = np.unique(rng.integers(1, max_id + 1, size=min(sample_size, max_id)))
+        source_ids = []
+        for start in range(0, len(ids), 900):
+            chunk = ids[start:start + 900].tolist()
+            placeholders = ",".join("?" * len(chunk))
+            source_ids += [row[0] for row in conn.execute(
+                f"SELECT source_id FROM sources WHERE id IN ({placeholders})", chunk
+            )]
+    finally:
+        conn.close()
+    return source_ids
+
+
+def sample_store_source_ids(store_path: str, sample_size: int, seed: int) -> List[str]:
+    """SQLite以外のストア（Parquet / JSONディレクトリ）の天体から無作為に選ぶ"""
+    sys.path.append(str(BACKEND_DIR))
+    from lightcurve_store import open_store
+
+    source_ids = open_store(store_path).source_ids()
+    rng = np.random.default_rng(seed)
+    chosen = np.sort(rng.choice(len(source_ids), size=min(sample_size, len(source_ids)), replace=False))
+    return [source_ids[i] for i in chosen]
+
+
+class LoadStats:
+    """エンドポイントごとのレイテンシとエラー数"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.errors: Dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.status_codes: Dict[int, int] = {}
+        self.recording = False
+
+    def record(self, endpoint: str, seconds: float, ok: bool, status: Optional[int] = None):
+        if not self.recording:
+            return
+        self.latencies[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+        if status is not None:
+            self.status_codes[status] = self.status_codes.get(status, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for name in ENDPOINTS:
+            values = np.array(self.latencies[name])
+            if len(values) == 0:
+                continue
+            entry = {
+                "requests": int(len(values)),
+                "errors": self.errors[name],
+                "per_sec": len(values) / elapsed,
+                "max_ms": float(values.max() * 1000),
+            }
+            for p in PERCENTILES:
+                entry[f"p{p}_ms"] = float(np.percentile(values, p) * 1000)
+            result[name] = entry
+        return result
+
+
+async def timed_get(session, url: str, params: dict, endpoint: str, stats: LoadStats):
+    """GETしてボディを読み切るまでの時間を記録"""
+    start = time.perf_counter()
+    try:
+        async with session.get(url, params=params) as response:
+            body = await response.read()
+            ok = response.status == 200
+            stats.record(endpoint, time.perf_counter() - start, ok, response.status)
+            return json.loads(body) if ok and endpoint == "list" else None
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        stats.record(endpoint, time.perf_counter() - start, False)
+        return None
+
+
+async def virtual_user(
+    session,
+    base_url: str,
+    source_ids: Optional[List[str]],
+    stars_per_session: int,
+    raw_fraction: float,
+    deadline: float,
+    stats: LoadStats,
+    rng: random.Random
+):
+    """ビューアー1つ分のアクセスをdeadlineまで繰り返す"""
+    while time.perf_counter() < deadline:
+        listing = await timed_get(session, f"{base_url}/api/list", {}, "list", stats)
+        candidates = source_ids or (listing or {}).get("neowise_sources") or []
+        if not candidates:
+            await asyncio.sleep(0.1)
+            continue
+
+        for _ in range(stars_per_session):
+            if time.perf_counter() >= deadline:
+                break
+            source_id = str(rng.choice(candidates))
+            neowise_params = {"source_id": source_id}
+            if rng.random() < raw_fraction:
+                neowise_params["raw"] = "true"
+            start = time.perf_counter()
+            await asyncio.gather(
+                timed_get(session, f"{base_url}/api/lightcurve/neowise", neowise_params, "neowise", stats),
+                timed_get(session, f"{base_url}/api/lightcurve/asassn", {"source_id": source_id}, "asassn", stats),
+            )
+            stats.record("star", time.perf_counter() - start, True)
+
+
+async def run_load(args, base_url: str, source_ids: Optional[List[str]]) -> Dict:
+    stats = LoadStats()
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.users * 2)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        deadline = start + args.warmup + args.duration
+
+        async def start_recording():
+            await asyncio.sleep(args.warmup)
+            stats.recording = True
+
+        stats.recording = args.warmup <= 0
+        users = [
+            virtual_user(session, base_url, source_ids, args.stars_per_session, args.raw_fraction,
+                         deadline, stats, random.Random(args.seed + i))
+            for i in range(args.users)
+        ]
+        await asyncio.gather(start_recording(), *users)
+
+        health = None
+        try:
+            async with session.get(f"{base_url}/health") as response:
+                health = await response.json()
+        except Exception:
+            pass
+
+    elapsed = args.duration
+    total = sum(len(stats.latencies[name]) for name in ("list", "neowise", "asassn"))
+    return {
+        "url": base_url,
+        "users": args.users,
+        "duration": elapsed,
+        "requests": total,
+        "requests_per_sec": total / elapsed,
+        "star_views_per_sec": len(stats.latencies["star"]) / elapsed,
+        "status_codes": stats.status_codes,
+        "endpoints": stats.summary(elapsed),
+        "server_health": health,
+    }
+
+
+def print_report(report: Dict):
+    print(f"\n=== Load test: {report['users']} users x {report['duration']:.0f} s against {report['url']} ===")
+    header = f"{'endpoint':<28} {'requests':>9} {'errors':>7} {'req/s':>8}"
+    header += "".join(f" {'p' + str(p):>8}" for p in PERCENTILES) + f" {'max':>8}  (ms)"
+    print(header)
+    print("-" * len(header))
+    for name, entry in report["endpoints"].items():
+        line = f"{ENDPOINT_LABELS[name]:<28} {entry['requests']:>9} {entry['errors']:>7} {entry['per_sec']:>8.1f}"
+        line += "".join(f" {entry[f'p{p}_ms']:>8.1f}" for p in PERCENTILES) + f" {entry['max_ms']:>8.1f}"
+        print(line)
+    print(f"\nThroughput: {report['requests_per_sec']:.1f} requests/sec, "
+          f"{report['star_views_per_sec']:.1f} star views/sec")
+    print(f"Status codes: {report['status_codes']}")
+    health = report.get("server_health") or {}
+    for cache in ("response_cache", "downsample_cache", "epoch_cache"):
+        if cache in health:
+            print(f"{cache}: {health[cache]}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path: str, port: int, workers: int, app_name: str = "app_custom") -> subprocess.Popen:
+    """APIをuvicornで起動し、/health が応答するまで待つ"""
+    env = dict(os.environ, NEOWISE_STORE=str(Path(db_path).resolve()))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{app_name}:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    for _ in range(600):
+        if process.poll() is not None:
+            raise RuntimeError(f"{app_name}.py exited during startup")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{app_name}.py did not start within 60 seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='app_custom.py / app.py のHTTP負荷ベンチマーク（ビューアーのアクセスパターン）')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='APIのベースURL')
+    parser.add_argument('--db', type=str, default=None,
+                        help='天体を選ぶDB・Parquetデータセット・JSONディレクトリ（--start-server時は配信するストア）')
+    parser.add_argument('--start-server', action='store_true', help='--db のストアで --app のAPIを起動して計測')
+    parser.add_argument('--app', type=str, default='app_custom', choices=APPS,
+                        help='--start-server: 起動するAPI（デフォルト: app_custom）')
+    parser.add_argument('--server-workers', type=int, default=1, help='--start-server: uvicornのワーカー数')
+    parser.add_argument('--users', type=int, default=16, help='同時に動く仮想ユーザー数（デフォルト: 16）')
+    parser.add_argument('--duration', type=float, default=30.0, help='計測時間（秒）')
+    parser.add_argument('--warmup', type=float, default=0.0, help='計測前のウォームアップ時間（秒）')
+    parser.add_argument('--stars-per-session', type=int, default=10, help='1回の /api/list の後に表示する天体数')
+    parser.add_argument('--raw-fraction', type=float, default=0.0, help='生データ（raw=true）で取得する割合')
+    parser.add_argument('--sample-size', type=int, default=10000, help='--db から選ぶ天体数')
+    parser.add_argument('--timeout', type=float, default=60.0, help='1リクエストのタイムアウト（秒）')
+    parser.add_argument('--seed', type=int, default=0, help='乱数シード')
+    parser.add_argument('--json', type=str, default=None, help='結果をJSONで保存するパス')
+    args = parser.parse_args()
+
+    if not AIOHTTP_AVAILABLE:
+        print("Error: serving_benchmark.py requires aiohttp (pip install aiohttp)")
+        return
+    if args.start_server and not args.db:
+        parser.error('--start-server requires --db')
+
+    source_ids = None
+    if args.db:
+        source_ids = sample_source_ids(args.db, args.sample_size, args.seed)
+        print(f"Sampled {len(source_ids)} source_ids from {args.db}")
+
+    server = None
+    base_url = args.url.rstrip('/')
+    if args.start_server:
+        port = _free_port()
+        print(f"Starting {args.app}.py on port {port} with {args.db}...")
+        server = start_server(args.db, port, args.server_workers, args.app)
+        base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        report = asyncio.run(run_load(args, base_url, source_ids))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
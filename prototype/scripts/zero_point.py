@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+ゼロポイント補正テーブル（NEOWISE_zp_stb.csv）のインデックス
+
+neowise_to_sqlite.py は観測ごとに scan_id でゼロポイント補正値（w1dmag / w2dmag）を引く。
+CSVをDataFrameのまま使うと、天体・バンドごとに merge（表全体のハッシュ・結合結果のコピー）が走るため、
+scan_id の昇順に並べた配列に変換してディスクに保存し、np.searchsorted でまとめて引く:
+
+    <name>.zpidx/index.json      元のCSV（パス・サイズ・更新時刻）、行数、mjdの最小値
+    <name>.zpidx/scan_id.npy     scan_id（固定長バイト列、昇順、重複なし）
+    <name>.zpidx/w1dmag.npy      scan_id と同じ順の補正値（float64）
+    <name>.zpidx/w2dmag.npy
+
+配列は np.load(mmap_mode='r') で開くため、スレッドは同じ配列を共有し、
+別プロセス（AggregationPool）にはパスだけを渡して各プロセスが同じファイルをマップする
+（OSのページキャッシュ上の1つのコピーを共有する）。
+
+CSVを指定すると隣の <name>.zpidx を使い、無いかCSVより古ければ作り直す。
+
+使用方法:
+    python zero_point.py --input NEOWISE_zp_stb.csv
+    python zero_point.py --input NEOWISE_zp_stb.csv --output /data/NEOWISE_zp_stb.zpidx
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+INDEX_SUFFIX = '.zpidx'
+INDEX_META = 'index.json'
+INDEX_FORMAT = 'neowise-zp-stb-index'
+
+# NEOWISE_zp_stb.csv の先頭の説明行
+CSV_SKIPROWS = 12
+
+# インデックスに入れる補正値の列
+DMAG_COLUMNS = ['w1dmag', 'w2dmag']
+
+
+def read_zp_stb_csv(csv_path) -> pd.DataFrame:
+    """NEOWISE_zp_stb.csv を読み込む（scan列はscan_idに改名）"""
+    return pd.read_csv(csv_path, skiprows=CSV_SKIPROWS).rename(columns={'scan': 'scan_id'})
+
+
+def _encode_scan_ids(scan_ids) -> np.ndarray:
+    """scan_idを固定長バイト列の配列に変換（欠損は空文字列）"""
+    values = pd.Series(scan_ids, dtype=object).fillna('').astype(str).to_numpy(dtype=str)
+    return values.astype(bytes)
+
+
+def _source_stamp(csv_path: Path) -> dict:
+    stat = csv_path.stat()
+    return {'path': str(csv_path.resolve()), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class ZeroPointIndex:
+    """
+    scan_id → 補正値（w1dmag, w2dmag）の検索用インデックス
+
+    Parameters:
+    -----------
+    scan_ids : np.ndarray
+        scan_id（固定長バイト列、昇順、重複なし）
+    dmag : dict
+        列名（w1dmag / w2dmag）→ scan_ids と同じ順の補正値
+    mjd_min : float
+        補正テーブルのmjdの最小値（これより前の観測は補正範囲外として除外する）
+    path : str, optional
+        保存先のインデックス（load() で開いた場合）。pickle時はパスだけを渡す
+    """
+
+    def __init__(self, scan_ids: np.ndarray, dmag: Dict[str, np.ndarray], mjd_min: float,
+                 path: Optional[str] = None):
+        self.scan_ids = scan_ids
+        self.dmag = dmag
+        self.mjd_min = mjd_min
+        self.path = path
+
+    @classmethod
+    def from_frame(cls, zp_stb: pd.DataFrame) -> 'ZeroPointIndex':
+        """
+        補正テーブルのDataFrameからインデックスを作成
+
+        scan_idが重複する場合は最初の行を使う（mergeでは観測が重複行の数だけ複製されていた）
+        """
+        mjd_min = float(zp_stb['mjd'].min()) if 'mjd' in zp_stb.columns and len(zp_stb) else float('nan')
+        scan_ids = _encode_scan_ids(zp_stb['scan_id'])
+        first = ~pd.Series(scan_ids).duplicated().to_numpy()
+        order = np.argsort(scan_ids[first], kind='stable')
+        dmag = {
+            col: pd.to_numeric(zp_stb[col], errors='coerce').to_numpy(dtype=np.float64)[first][order]
+            for col in DMAG_COLUMNS if col in zp_stb.columns
+        }
+        return cls(scan_ids[first][order], dmag, mjd_min)
+
+    @classmethod
+    def load(cls, path) -> 'ZeroPointIndex':
+        """保存済みのインデックスを読み取り専用でメモリマップして開く"""
+        path = Path(path)
+        with open(path / INDEX_META) as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT:
+            raise ValueError(f"not a zero-point index: {path}")
+        # 0行の配列はマップできないので読み込む
+        mmap_mode = 'r' if meta['rows'] else None
+        scan_ids = np.load(path / 'scan_id.npy', mmap_mode=mmap_mode)
+        dmag = {col: np.load(path / f'{col}.npy', mmap_mode=mmap_mode) for col in meta['columns']}
+        return cls(scan_ids, dmag, meta['mjd_min'], str(path.resolve()))
+
+    def save(self, path, source: Optional[dict] = None):
+        """
+        インデックスをディレクトリに保存する
+
+        一時ディレクトリに書いてから置き換えるため、既存のインデックスを開いているプロセスは影響を受けない
+        """
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        np.save(tmp / 'scan_id.npy', self.scan_ids)
+        for col, values in self.dmag.items():
+            np.save(tmp / f'{col}.npy', values)
+        meta = {
+            'format': INDEX_FORMAT,
+            'rows': len(self),
+            'mjd_min': self.mjd_min,
+            'columns': list(self.dmag),
+            'source': source,
+        }
+        with open(tmp / INDEX_META, 'w') as f:
+            json.dump(meta, f, indent=2)
+        if path.exists():
+            shutil.rmtree(path)
+        tmp.rename(path)
+
+    def __len__(self) -> int:
+        return len(self.scan_ids)
+
+    def __reduce__(self):
+        # 保存済みならパスだけをpickleし、受け取ったプロセスで同じファイルをマップする
+        if self.path is not None:
+            return (ZeroPointIndex.load, (self.path,))
+        return (ZeroPointIndex, (np.asarray(self.scan_ids), dict(self.dmag), self.mjd_min))
+
+    def has(self, dmag_col: str) -> bool:
+        """補正値の列（w1dmag / w2dmag）を持つか"""
+        return dmag_col in self.dmag
+
+    def lookup(self, scan_ids, dmag_col: str) -> np.ndarray:
+        """scan_idごとの補正値（テーブルに無いscan_idはNaN）"""
+        keys = _encode_scan_ids(scan_ids)
+        values = np.full(len(keys), np.nan)
+        if len(self.scan_ids) == 0 or len(keys) == 0:
+            return values
+        positions = np.minimum(np.searchsorted(self.scan_ids, keys), len(self.scan_ids) - 1)
+        found = self.scan_ids[positions] == keys
+        values[found] = self.dmag[dmag_col][positions[found]]
+        return values
+
+    def correction(self, scan_ids, dmag_col: str) -> np.ndarray:
+        """等級から引く補正値（テーブルに無いscan_id・欠損は0。merge + fillna(0) と同じ）"""
+        return np.nan_to_num(self.lookup(scan_ids, dmag_col), nan=0.0)
+
+
+def default_index_path(csv_path) -> Path:
+    """CSVに対応するインデックスのパス（NEOWISE_zp_stb.csv → NEOWISE_zp_stb.zpidx）"""
+    return Path(csv_path).with_suffix(INDEX_SUFFIX)
+
+
+def compile_zp_stb(csv_path, output=None) -> ZeroPointIndex:
+    """CSVからインデックスを作成して保存し、メモリマップで開き直して返す"""
+    csv_path = Path(csv_path)
+    output = Path(output) if output else default_index_path(csv_path)
+    index = ZeroPointIndex.from_frame(read_zp_stb_csv(csv_path))
+    index.save(output, _source_stamp(csv_path))
+    return ZeroPointIndex.load(output)
+
+
+def load_zero_point_index(path) -> ZeroPointIndex:
+    """
+    インデックスのディレクトリ、またはCSVを指定してインデックスを開く
+
+    CSVの場合は隣の <name>.zpidx を使い、無いか元のCSVと一致しなければ作り直す。
+    インデックスを書けない場所のCSVはメモリ上に作成する（プロセスにはpickleで配列ごと渡る）
+    """
+    path = Path(path)
+    if path.is_dir():
+        return ZeroPointIndex.load(path)
+
+    index_path = default_index_path(path)
+    if (index_path / INDEX_META).exists():
+        with open(index_path / INDEX_META) as f:
+            source = json.load(f).get('source')
+        if source == _source_stamp(path):
+            return ZeroPointIndex.load(index_path)
+    try:
+        return compile_zp_stb(path, index_path)
+    except OSError as e:
+        print(f"Warning: could not write zero-point index {index_path}: {e}. Using an in-memory index.")
+        return ZeroPointIndex.from_frame(read_zp_stb_csv(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NEOWISE_zp_stb.csv を scan_id で引くインデックスに変換')
+    parser.add_argument('--input', '-i', type=str, required=True, help='NEOWISE_zp_stb.csvのパス')
+    parser.add_argument('--output', '-o', type=str, default=None,
+                        help=f'出力するインデックスのディレクトリ（デフォルト: CSVと同じ場所の *{INDEX_SUFFIX}）')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    output = args.output or default_index_path(args.input)
+    index = compile_zp_stb(args.input, output)
+    print(f"Zero-point index saved to: {output}")
+    print(f"Scans: {len(index)} ({', '.join(index.dmag)}), mjd >= {index.mjd_min}")
+    print(f"Total time: {time.time() - start_time:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+lightcurve_store.py のストア間で天体の検索結果が一致することのテスト
+
+    python -m pytest prototype/tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+PROTOTYPE_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROTOTYPE_DIR / 'backend'))
+sys.path.append(str(PROTOTYPE_DIR / 'scripts'))
+
+from lightcurve_store import open_store  # noqa: E402
+from neowise_to_sqlite import EPOCH_INSERT_SQL, RAW_INSERT_SQL, create_neowise_database  # noqa: E402
+
+SOURCE_IDS = ['4094266021184988288', '4094266021184988300']
+
+
+@pytest.fixture(scope='module')
+def stores(tmp_path_factory):
+    """同じ内容のSQLiteストアと列ファイルのストア"""
+    export_columnar = pytest.importorskip('export_columnar')
+    directory = tmp_path_factory.mktemp('stores')
+    db_path = str(directory / 'neowise.db')
+    conn = create_neowise_database(db_path)
+    for i, source_id in enumerate(SOURCE_IDS):
+        conn.execute('INSERT INTO sources (source_id, ra, dec, allwise_cntr) VALUES (?, ?, ?, ?)',
+                     (source_id, 270.0 + i, -30.0, 1000 + i))
+        for epoch_id in range(3):
+            mjd = 56700.0 + 182.6 * epoch_id
+            conn.execute(RAW_INSERT_SQL, (source_id, mjd, 'W1', 10.0 + i, 0.02, '0000', 'AA', '00', 0, 1.0,
+                                          50.0, 0.0, 1.0, 10.0, 600.0, '12345a', 10.0 + i))
+            conn.execute(EPOCH_INSERT_SQL, (source_id, 'W1', epoch_id, int(mjd), 10.0 + i, 0.01, 0.001, 12,
+                                            400.0, 'default'))
+    conn.commit()
+    conn.close()
+    export_columnar.export(db_path, str(directory / 'columnar'))
+    return {'sqlite': open_store(db_path), 'columnar': open_store(str(directory / 'columnar'))}
+
+
+@pytest.mark.parametrize('kind', ['sqlite', 'columnar'])
+@pytest.mark.parametrize('source_id', [SOURCE_IDS[0][:-3], SOURCE_IDS[0] + '999', SOURCE_IDS[0] + '0'])
+def test_prefix_and_extended_ids_are_not_found(stores, kind, source_id):
+    """既存のsource_idの先頭部分・後ろに数字を足したsource_idは、どのストアでも見つからない"""
+    store = stores[kind]
+    assert store.sources([source_id]).empty
+    assert store.raw_observations([source_id]).empty
+    assert store.epoch_summary([source_id]).empty
+    assert store.lightcurves([source_id]) == {}
+    # 結合済みのライトカーブは列ファイルのストアのみ（他のストアは常にNone）
+    assert store.lightcurve_arrays(source_id) is None
+
+
+@pytest.mark.parametrize('kind', ['sqlite', 'columnar'])
+def test_existing_ids_are_found(stores, kind):
+    store = stores[kind]
+    lookup = [SOURCE_IDS[0] + '999', SOURCE_IDS[1], SOURCE_IDS[0][:-3]]
+    assert sorted(store.sources(lookup).index) == [SOURCE_IDS[1]]
+    epochs = store.epoch_summary(lookup)
+    assert set(epochs['source_id']) == {SOURCE_IDS[1]}
+    assert len(epochs) == 3
+    assert list(store.lightcurves(lookup)) == [SOURCE_IDS[1]]
+    if kind == 'columnar':
+        assert store.lightcurve_arrays(SOURCE_IDS[0])[0]['source_id'] == SOURCE_IDS[0]